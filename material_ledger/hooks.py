@@ -155,6 +155,13 @@ fixtures = [
 # 	}
 # }
 
+doc_events = {
+	# Score each posting against the cached anomaly baselines and alert the AI dashboard
+	"GL Entry": {
+		"on_submit": "material_ledger.material_ledger.services.realtime_anomaly.on_gl_entry_submit"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -176,6 +183,26 @@ fixtures = [
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		# Re-enqueue AI jobs and chunks whose retry backoff has passed,
+		# then free stale lane slots and dispatch waiting AI jobs;
+		# persist the real-time anomaly alerts queued since the last run
+		"* * * * *": [
+			"material_ledger.material_ledger.services.queue_service.retry_due_ai_jobs",
+			"material_ledger.material_ledger.services.queue_service.dispatch_ai_jobs",
+			"material_ledger.material_ledger.services.realtime_anomaly.flush_anomaly_alerts"
+		]
+	},
+	"daily": [
+		"material_ledger.material_ledger.services.ai_anomaly_service.run_nightly_anomaly_detection",
+		"material_ledger.material_ledger.services.anomaly_findings.purge_old_findings"
+	],
+	"weekly": [
+		"material_ledger.material_ledger.services.anomaly_model.retrain_anomaly_models"
+	]
+}
+
 # Testing
 # -------
 
@@ -11,6 +11,7 @@ from functools import wraps
 from material_ledger.material_ledger.services.validators import InputValidator, LedgerValidator, AnalysisValidator
 from material_ledger.material_ledger.services.financial_calculator import FinancialCalculator
 from material_ledger.material_ledger.services.ai_service import get_ai_service, generate_ai_report as ai_generate_report
+from material_ledger.material_ledger.services.job_registry import InFlightRegistry
 
 # Import security module
 try:
@@ -588,17 +589,20 @@ def get_financial_analysis(company, year, period="annual", period_number=None, s
                 "equity_changes": equity_changes,
                 "cash_flow": cash_flow
             }
-            # Enqueue background job for AI generation
-            frappe.enqueue(
-                "material_ledger.material_ledger.api.generate_ai_report_background",
-                queue="long",
-                timeout=300,
-                job_id=ai_job_id,
-                company=company,
-                year=year,
-                data=ai_data,
-                job_id_key=ai_job_id
-            )
+            # Enqueue background job for AI generation, unless an identical one is in flight
+            _owner, is_new = InFlightRegistry().claim(ai_job_id, ai_job_id, ttl=300)
+            if is_new:
+                frappe.cache().set_value(f"ai_status_{ai_job_id}", "loading", expires_in_sec=300)
+                frappe.enqueue(
+                    "material_ledger.material_ledger.api.generate_ai_report_background",
+                    queue="long",
+                    timeout=300,
+                    job_id=ai_job_id,
+                    company=company,
+                    year=year,
+                    data=ai_data,
+                    job_id_key=ai_job_id
+                )
 
     response = {
         "period": period_label,
@@ -957,6 +961,9 @@ def generate_ai_report_background(company, year, data, job_id_key):
         frappe.log_error(f"AI Background Job Error: {str(e)}", "Material Ledger AI")
         frappe.cache().set_value(f"ai_status_{job_id_key}", "error", expires_in_sec=300)
         frappe.cache().set_value(f"ai_error_{job_id_key}", str(e), expires_in_sec=300)
+    
+    finally:
+        InFlightRegistry().release(job_id_key, job_id_key)
 
 
 @frappe.whitelist()
@@ -2586,17 +2593,21 @@ def check_recent_financial_anomalies(company):
 @frappe.whitelist()
 @rate_limited()
 @audit_logged("action", "ai_chat")
-def chat_with_ai_assistant(message, company, chat_history=None):
+def chat_with_ai_assistant(message, company, chat_history=None, chat_id=None):
     """
     Chat with AI financial assistant
     
+    The answer is generated by a background job and streamed to the
+    browser through realtime events, so no web worker waits on the LLM.
+    
     Args:
         message: User message
         company: Company context
         chat_history: Previous chat history
+        chat_id: Optional client-generated id used to correlate streamed events
         
     Returns:
-        dict: AI response
+        dict: Queued chat id, or an immediate response when chat is unavailable
     """
     try:
         if not message or not message.strip():
@@ -2611,45 +2622,104 @@ def chat_with_ai_assistant(message, company, chat_history=None):
         if not ai_service.is_available():
             return {"response": "عذراً، خدمة المساعد الذكي غير متاحة حالياً. يرجى المحاولة لاحقاً."}
         
+        if isinstance(chat_history, str):
+            chat_history = json.loads(chat_history)
+        
+        if not chat_id or not str(chat_id).isalnum():
+            chat_id = frappe.generate_hash(length=16)
+        
+        # Stream the answer from a background job on the short queue
+        frappe.enqueue(
+            "material_ledger.material_ledger.api.stream_ai_chat_response",
+            queue="short",
+            timeout=300,
+            chat_id=chat_id,
+            message=message,
+            company=company,
+            chat_history=chat_history or [],
+            user=frappe.session.user
+        )
+        
+        return {"status": "queued", "chat_id": chat_id}
+        
+    except Exception as e:
+        frappe.log_error(f"AI Assistant Chat Error: {str(e)}", "Material Ledger API")
+        return {"response": "عذراً، حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."}
+
+
+def stream_ai_chat_response(chat_id, message, company, chat_history, user):
+    """
+    Background job for the AI assistant
+    Streams tokens to the user via realtime events, then sends the final cleaned answer
+    """
+    try:
+        ai_service = get_ai_service()
+        
         # Get company context
         year = frappe.utils.nowdate().split('-')[0]
         try:
             financial_data = get_financial_analysis(company, year, sections=["ratios"])
-        except:
+        except Exception:
             financial_data = None
         
         # Build context-aware prompt
         prompt = build_assistant_prompt(message, company, financial_data, chat_history)
         
-        # Get AI response
-        try:
-            if hasattr(ai_service, '_call_deepseek'):
-                ai_response = ai_service._call_deepseek(prompt)
-            else:
-                ai_response = "عذراً، لم أتمكن من معالجة طلبك حالياً."
-            
-            # Clean and format response
-            clean_response = clean_ai_response(ai_response, message)
-            
-            return {"response": clean_response}
-            
-        except Exception as ai_error:
-            frappe.log_error(f"AI Assistant Error: {str(ai_error)}", "Material Ledger API")
-            return {"response": "عذراً، واجهت مشكلة في فهم طلبك. يرجى إعادة صياغة السؤال أو المحاولة مرة أخرى."}
+        # Batch tokens so the socket sees a handful of events per second, not one per token
+        tokens = []
+        buffer = []
+        last_flush = time.time()
+        for token in ai_service.stream_completion(prompt):
+            tokens.append(token)
+            buffer.append(token)
+            if time.time() - last_flush >= 0.1:
+                frappe.publish_realtime(
+                    "ai_chat_token",
+                    {"chat_id": chat_id, "token": "".join(buffer)},
+                    user=user
+                )
+                buffer = []
+                last_flush = time.time()
+        
+        if buffer:
+            frappe.publish_realtime(
+                "ai_chat_token",
+                {"chat_id": chat_id, "token": "".join(buffer)},
+                user=user
+            )
         
-    except Exception as e:
-        frappe.log_error(f"AI Assistant Chat Error: {str(e)}", "Material Ledger API")
-        return {"response": "عذراً، حدث خطأ غير متوقع. يرجى المحاولة مرة أخرى."}
+        # Clean and format response
+        clean_response = clean_ai_response("".join(tokens), message)
+        
+        frappe.publish_realtime(
+            "ai_chat_complete",
+            {"chat_id": chat_id, "response": clean_response},
+            user=user
+        )
+        
+    except Exception as ai_error:
+        frappe.log_error(f"AI Assistant Error: {str(ai_error)}", "Material Ledger API")
+        frappe.publish_realtime(
+            "ai_chat_error",
+            {
+                "chat_id": chat_id,
+                "response": "عذراً، واجهت مشكلة في فهم طلبك. يرجى إعادة صياغة السؤال أو المحاولة مرة أخرى."
+            },
+            user=user
+        )
 
 
 def build_assistant_prompt(message, company, financial_data, chat_history):
     """Build context-aware prompt for AI assistant"""
+    from material_ledger.material_ledger.services.prompt_budget import get_prompt_budget
+    
+    budget = get_prompt_budget()
     
     # Company context
-    context = f"""أنت مساعد مالي ذكي متخصص في التحليل المالي. تتحدث مع مستخدم من شركة "{company}".
-
-📊 **بيانات الشركة المتاحة:**"""
+    header = f"""أنت مساعد مالي ذكي متخصص في التحليل المالي. تتحدث مع مستخدم من شركة "{company}".
+"""
     
+    context = "📊 **بيانات الشركة المتاحة:**"
     if financial_data and 'ratios' in financial_data:
         ratios = financial_data['ratios']
         context += f"""
@@ -2662,16 +2732,17 @@ def build_assistant_prompt(message, company, financial_data, chat_history):
     else:
         context += "\n- البيانات المالية محدودة أو غير متاحة"
     
-    # Chat history context
-    if chat_history and len(chat_history) > 0:
-        context += f"\n\n💬 **آخر محادثة:**\n"
-        for chat in chat_history[-3:]:  # Last 3 exchanges
-            context += f"المستخدم: {chat.get('user', '')}\n"
-            context += f"المساعد: {chat.get('assistant', '')}\n"
+    # Chat history context - last 3 exchanges, each message capped
+    history = ""
+    compact_history = budget.truncate_history(chat_history, max_turns=3)
+    if compact_history:
+        history = "\n💬 **آخر محادثة:**\n"
+        for chat in compact_history:
+            history += f"المستخدم: {chat['user']}\n"
+            history += f"المساعد: {chat['assistant']}\n"
     
     # Instructions
-    context += f"""
-
+    footer = f"""
 🎯 **تعليماتك:**
 1. أجب على سؤال المستخدم بناء على البيانات المتاحة
 2. كن واضحاً ومفيداً وودوداً 
@@ -2680,11 +2751,11 @@ def build_assistant_prompt(message, company, financial_data, chat_history):
 5. إذا لم تجد بيانات كافية، اقترح كيفية الحصول عليها
 6. الإجابة باللغة العربية بشكل احترافي
 
-❓ **سؤال المستخدم:** {message}
+❓ **سؤال المستخدم:** {budget.truncate_text(message, 500)}
 
 💡 **إجابتك (200-300 كلمة):**"""
     
-    return context
+    return budget.compose(header, [context, history], footer)
 
 
 def clean_ai_response(ai_response, original_message):
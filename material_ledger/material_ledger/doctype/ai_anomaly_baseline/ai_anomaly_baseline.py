@@ -0,0 +1,19 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class AIAnomalyBaseline(Document):
+	"""AI Anomaly Baseline DocType holding running anomaly statistics per company, account and user"""
+	
+	def autoname(self):
+		"""One row per company, scope and key"""
+		from material_ledger.material_ledger.services.anomaly_state import baseline_name
+		self.name = baseline_name(self.company, self.scope, self.scope_key)
+	
+	def get_state(self):
+		"""Get parsed state"""
+		import json
+		return json.loads(self.state or "{}")
@@ -0,0 +1,19 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class AIAnomalyFinding(Document):
+	"""AI Anomaly Finding DocType: one detected anomaly, referencing its GL Entry"""
+	
+	def autoname(self):
+		"""One row per GL Entry and anomaly type (job findings are named when bulk inserted)"""
+		from material_ledger.material_ledger.services.realtime_anomaly import finding_name
+		self.name = finding_name(self.gl_entry, self.anomaly_type)
+
+
+def on_doctype_update():
+	"""Findings of a job are read a page at a time in priority order"""
+	frappe.db.add_index("AI Anomaly Finding", ["job", "priority_score"])
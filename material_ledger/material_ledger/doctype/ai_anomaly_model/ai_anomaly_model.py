@@ -0,0 +1,13 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class AIAnomalyModel(Document):
+	"""AI Anomaly Model DocType: one trained outlier model version per company"""
+	
+	def autoname(self):
+		"""One row per company and version"""
+		self.name = f"{self.company}-v{self.version}"
@@ -0,0 +1,19 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class AIDimensionForecast(Document):
+	"""AI Dimension Forecast DocType: one forecast month of one metric of a cost center or project"""
+	
+	def autoname(self):
+		"""One row per company, dimension value, metric and month"""
+		from material_ledger.material_ledger.services.dimension_forecast import forecast_name
+		self.name = forecast_name(self.company, self.dimension, self.dimension_value, self.metric, self.forecast_month)
+
+
+def on_doctype_update():
+	"""Forecasts are read per company and dimension, ordered by value, metric and month"""
+	frappe.db.add_index("AI Dimension Forecast", ["company", "dimension", "dimension_value", "metric", "forecast_month"])
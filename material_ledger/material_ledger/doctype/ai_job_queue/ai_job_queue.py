@@ -1,7 +1,7 @@
 # Copyright (c) 2026, Ahmad
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
@@ -18,12 +18,21 @@ class AIJobQueue(Document):
 			from frappe.utils import now
 			self.created_at = now()
 	
+	def on_trash(self):
+		"""Delete the job's findings and free the slot and claim of a job deleted before it ended"""
+		frappe.db.delete("AI Anomaly Finding", {"job": self.name})
+		
+		if self.status in ["queued", "processing"]:
+			from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+			from material_ledger.material_ledger.services.job_scheduler import FairScheduler
+			InFlightRegistry().release(self.cache_key, self.job_id)
+			FairScheduler().release(self.job_id)
+	
 	def cancel_job(self):
-		"""Cancel a queued or processing job"""
+		"""Cancel a queued or processing job (running jobs stop at their next check)"""
 		if self.status in ["queued", "processing"]:
-			self.status = "cancelled"
-			self.save()
-			return True
+			from material_ledger.material_ledger.services.queue_service import cancel_ai_job
+			return cancel_ai_job(self.job_id).get("cancelled")
 		return False
 	
 	def is_expired(self):
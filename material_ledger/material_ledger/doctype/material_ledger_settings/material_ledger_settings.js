@@ -61,6 +61,8 @@ frappe.ui.form.on("Material Ledger Settings", {
             frm.set_value('ai_model', 'deepseek-reasoner');
         } else if (frm.doc.ai_provider === 'OpenAI') {
             frm.set_value('ai_model', 'gpt-4');
+        } else if (frm.doc.ai_provider === 'Stub') {
+            frm.set_value('ai_model', 'stub');
         } else {
             frm.set_value('ai_model', 'local');
         }
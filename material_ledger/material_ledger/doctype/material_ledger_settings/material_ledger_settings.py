@@ -33,6 +33,21 @@ class MaterialLedgerSettings(Document):
                 frappe.msgprint(_("DeepSeek API Key is required for AI analysis"), indicator="orange")
             elif self.ai_provider == "OpenAI" and not self.openai_api_key:
                 frappe.msgprint(_("OpenAI API Key is required for AI analysis"), indicator="orange")
+            
+            if self.ai_request_timeout is not None and self.ai_request_timeout < 1:
+                frappe.throw(_("AI request timeout must be at least 1 second"))
+            if self.ai_base_url and not self.ai_base_url.startswith(("http://", "https://")):
+                frappe.throw(_("API Base URL must start with http:// or https://"))
+            if self.ai_job_deadline_minutes and self.ai_job_deadline_minutes < 0:
+                frappe.throw(_("AI job deadline cannot be negative"))
+            if self.ai_max_concurrency is not None and self.ai_max_concurrency < 1:
+                frappe.throw(_("Max concurrent AI calls must be at least 1"))
+            if self.ai_rate_limit_per_minute and self.ai_rate_limit_per_minute < 0:
+                frappe.throw(_("AI calls per minute cannot be negative"))
+            if self.anomaly_rapid_sequence_count is not None and self.anomaly_rapid_sequence_count < 2:
+                frappe.throw(_("A rapid sequence needs at least 2 postings"))
+            if self.anomaly_rapid_sequence_window is not None and self.anomaly_rapid_sequence_window < 1:
+                frappe.throw(_("Rapid sequence window must be at least 1 second"))
     
     def on_update(self):
         """Clear cache when settings are updated"""
@@ -55,6 +70,18 @@ class MaterialLedgerSettings(Document):
                     "enable_ai_analysis": doc.enable_ai_analysis,
                     "ai_provider": doc.ai_provider,
                     "ai_model": doc.ai_model,
+                    "ai_base_url": doc.ai_base_url,
+                    "ai_request_timeout": doc.ai_request_timeout or 120,
+                    "ai_stub_latency_ms": doc.ai_stub_latency_ms or 0,
+                    "ai_max_concurrency": doc.ai_max_concurrency or 4,
+                    "ai_rate_limit_per_minute": doc.ai_rate_limit_per_minute or 0,
+                    "ai_map_reduce": doc.ai_map_reduce,
+                    "ai_job_deadline_minutes": doc.ai_job_deadline_minutes or 0,
+                    "ai_nightly_anomaly_detection": doc.ai_nightly_anomaly_detection,
+                    "anomaly_rapid_sequence_count": doc.anomaly_rapid_sequence_count or 2,
+                    "anomaly_rapid_sequence_window": doc.anomaly_rapid_sequence_window or 60,
+                    "ai_anomaly_model": doc.ai_anomaly_model,
+                    "ai_realtime_anomaly_alerts": doc.ai_realtime_anomaly_alerts,
                     "enable_rate_limiting": doc.enable_rate_limiting,
                     "rate_limit_requests": doc.rate_limit_requests or 50,
                     "rate_limit_window": doc.rate_limit_window or 60,
@@ -75,6 +102,18 @@ class MaterialLedgerSettings(Document):
                     "enable_ai_analysis": True,
                     "ai_provider": "DeepSeek",
                     "ai_model": "deepseek-reasoner",
+                    "ai_base_url": None,
+                    "ai_request_timeout": 120,
+                    "ai_stub_latency_ms": 0,
+                    "ai_max_concurrency": 4,
+                    "ai_rate_limit_per_minute": 60,
+                    "ai_map_reduce": True,
+                    "ai_job_deadline_minutes": 30,
+                    "ai_nightly_anomaly_detection": False,
+                    "anomaly_rapid_sequence_count": 2,
+                    "anomaly_rapid_sequence_window": 60,
+                    "ai_anomaly_model": False,
+                    "ai_realtime_anomaly_alerts": False,
                     "enable_rate_limiting": True,
                     "rate_limit_requests": 50,
                     "rate_limit_window": 60,
@@ -97,7 +136,7 @@ class MaterialLedgerSettings(Document):
         Get decrypted API key for the specified provider
         
         Args:
-            provider: 'DeepSeek' or 'OpenAI'. If None, uses configured provider.
+            provider: 'DeepSeek', 'OpenAI' or 'Local'. If None, uses configured provider.
             
         Returns:
             str: Decrypted API key or None
@@ -118,6 +157,14 @@ class MaterialLedgerSettings(Document):
                     "Material Ledger Settings",
                     "openai_api_key"
                 )
+            elif provider == "Local":
+                # Local servers usually run without authentication
+                return get_decrypted_password(
+                    "Material Ledger Settings",
+                    "Material Ledger Settings",
+                    "local_api_key",
+                    raise_exception=False
+                )
         except Exception as e:
             frappe.log_error(f"Error getting API key: {str(e)}", "Material Ledger")
             return None
@@ -134,72 +181,31 @@ def get_settings():
 @frappe.whitelist()
 def test_ai_connection():
     """Test AI provider connection"""
-    import requests
+    from material_ledger.material_ledger.services.llm_providers import build_provider
     
     settings = MaterialLedgerSettings.get_settings()
-    api_key = MaterialLedgerSettings.get_api_key()
+    provider_name = settings.get("ai_provider", "DeepSeek")
     
-    if not api_key:
+    try:
+        provider = build_provider(
+            provider_name,
+            settings.get("ai_model"),
+            MaterialLedgerSettings.get_api_key(provider_name),
+            settings
+        )
+        
+        if not provider.is_available():
+            return {
+                "success": False,
+                "message": _("API key not configured")
+            }
+        
+        provider.complete("Hello", max_tokens=10)
         return {
-            "success": False,
-            "message": _("API key not configured")
+            "success": True,
+            "message": _("Connection successful! AI is ready.")
         }
     
-    provider = settings.get("ai_provider", "DeepSeek")
-    
-    try:
-        if provider == "DeepSeek":
-            response = requests.post(
-                "https://api.deepseek.com/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": settings.get("ai_model", "deepseek-reasoner"),
-                    "messages": [{"role": "user", "content": "Hello"}],
-                    "max_tokens": 10
-                },
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                return {
-                    "success": True,
-                    "message": _("Connection successful! AI is ready.")
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": _("Connection failed: {0}").format(response.text)
-                }
-                
-        elif provider == "OpenAI":
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": settings.get("ai_model", "gpt-4"),
-                    "messages": [{"role": "user", "content": "Hello"}],
-                    "max_tokens": 10
-                },
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                return {
-                    "success": True,
-                    "message": _("Connection successful! AI is ready.")
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": _("Connection failed: {0}").format(response.text)
-                }
-    
     except Exception as e:
         return {
             "success": False,
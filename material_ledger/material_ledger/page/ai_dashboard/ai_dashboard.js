@@ -20,6 +20,7 @@ class AIDashboard {
         this.activeJobs = {};
         this.currentCompany = null;
         this.chatHistory = [];
+        this.pendingChats = {};
     }
     
     init() {
@@ -648,7 +649,15 @@ class AIDashboard {
     }
     
     setupRealTime() {
-        // Listen for AI job completion events
+        // AI job lifecycle events pushed by the server - no status polling
+        frappe.realtime.on("ai_job_queued", (message) => {
+            this.handleJobQueued(message);
+        });
+        
+        frappe.realtime.on("ai_job_progress", (message) => {
+            this.handleJobProgress(message);
+        });
+        
         frappe.realtime.on("ai_job_complete", (message) => {
             this.handleJobCompletion(message);
         });
@@ -656,6 +665,28 @@ class AIDashboard {
         frappe.realtime.on("ai_job_error", (message) => {
             this.handleJobError(message);
         });
+        
+        frappe.realtime.on("ai_job_cancelled", (message) => {
+            this.handleJobCancelled(message);
+        });
+        
+        // Streamed AI assistant answers
+        frappe.realtime.on("ai_chat_token", (message) => {
+            this.handleChatToken(message);
+        });
+        
+        frappe.realtime.on("ai_chat_complete", (message) => {
+            this.handleChatComplete(message);
+        });
+        
+        frappe.realtime.on("ai_chat_error", (message) => {
+            this.handleChatError(message);
+        });
+        
+        // High-severity anomalies scored as GL Entries are submitted
+        frappe.realtime.on("ai_anomaly_alert", (message) => {
+            this.handleAnomalyAlert(message);
+        });
     }
     
     bindEvents() {
@@ -679,6 +710,16 @@ class AIDashboard {
             self.startAIService(serviceName, serviceCard);
         });
         
+        // Cancel a running AI job from the jobs monitor
+        $(document).on('click', '.job-cancel-btn', function() {
+            self.cancelJob($(this).data('job-id'));
+        });
+        
+        // Page through every finding of an anomaly detection job
+        $(document).on('click', '.findings-more-btn', function() {
+            self.loadAnomalyFindings($(this).data('job-id'), $(this).data('page'));
+        });
+        
         // Chat functionality
         $(document).on('click', '#chat-send', function() {
             self.sendChatMessage();
@@ -855,7 +896,8 @@ class AIDashboard {
                     this.activeJobs[jobId] = {
                         service: serviceName,
                         card: serviceCard,
-                        startTime: new Date()
+                        startTime: new Date(),
+                        progress: r.message.progress || 0
                     };
                     
                     if (r.message.status === 'completed') {
@@ -863,14 +905,16 @@ class AIDashboard {
                         this.handleJobCompletion({
                             job_id: jobId,
                             job_type: serviceName,
-                            status: 'completed'
+                            status: 'completed',
+                            from_cache: true
                         });
                         this.showResults(serviceName, r.message.data);
                     } else {
                         // Job queued for background processing
                         statusDiv.removeClass().addClass('service-status status-processing').text('⚙️ قيد المعالجة...');
                         this.showJobMonitor();
-                        this.updateJobProgress(jobId);
+                        // Catch up once on anything that happened before the events were followed
+                        this.syncJobStatus(jobId);
                     }
                     
                     serviceBtn.prop('disabled', false).text('✅ تم البدء');
@@ -888,52 +932,68 @@ class AIDashboard {
         });
     }
     
-    updateJobProgress(jobId) {
+    syncJobStatus(jobId) {
         if (!this.activeJobs[jobId]) return;
         
+        // Light status only; the result body is fetched once, on completion
         frappe.call({
             method: 'material_ledger.material_ledger.services.queue_service.get_ai_job_status',
             args: { job_id: jobId },
             callback: (r) => {
-                if (r.message) {
-                    const job = this.activeJobs[jobId];
-                    const status = r.message.status;
-                    const progress = r.message.progress || 0;
-                    
-                    if (status === 'completed') {
-                        this.handleJobCompletion({
-                            job_id: jobId,
-                            job_type: job.service,
-                            status: 'completed'
-                        });
-                        if (r.message.result) {
-                            this.showResults(job.service, r.message.result);
-                        }
-                    } else if (status === 'failed') {
-                        this.handleJobError({
-                            job_id: jobId,
-                            job_type: job.service,
-                            status: 'failed',
-                            error: r.message.error
-                        });
-                    } else if (status === 'processing') {
-                        // Update progress in UI
-                        this.updateJobProgressUI(jobId, progress);
-                        
-                        // Continue polling
-                        setTimeout(() => {
-                            this.updateJobProgress(jobId);
-                        }, 2000);
-                    }
+                const job = this.activeJobs[jobId];
+                if (!r.message || !job) return;
+                
+                const status = r.message.status;
+                if (status === 'completed') {
+                    this.handleJobCompletion({ job_id: jobId, job_type: job.service, status: status });
+                } else if (status === 'failed') {
+                    this.handleJobError({ job_id: jobId, job_type: job.service, status: status, error: r.message.error });
+                } else if (status === 'cancelled') {
+                    this.handleJobCancelled({ job_id: jobId, job_type: job.service, status: status, reason: r.message.error });
+                } else if (status === 'processing') {
+                    this.updateJobProgressUI(jobId, r.message.progress || 0);
+                }
+            }
+        });
+    }
+    
+    fetchJobResult(jobId, serviceName) {
+        frappe.call({
+            method: 'material_ledger.material_ledger.services.queue_service.get_ai_job_status',
+            args: { job_id: jobId, include_result: 1 },
+            callback: (r) => {
+                if (r.message && r.message.result) {
+                    this.showResults(serviceName, r.message.result);
                 }
             }
         });
     }
     
+    cancelJob(jobId) {
+        frappe.call({
+            method: 'material_ledger.material_ledger.services.queue_service.cancel_ai_job',
+            args: { job_id: jobId }
+        });
+    }
+    
+    handleJobQueued(message) {
+        const job = this.activeJobs[message.job_id];
+        if (!job) return;
+        
+        const text = message.stage === 'retrying' ? '🔁 إعادة المحاولة قريباً...' : '⏳ في الطابور...';
+        job.card.find('.service-status').removeClass().addClass('service-status status-queued').text(text);
+    }
+    
+    handleJobProgress(message) {
+        if (!this.activeJobs[message.job_id]) return;
+        this.updateJobProgressUI(message.job_id, message.progress || 0);
+    }
+    
     updateJobProgressUI(jobId, progress) {
         const job = this.activeJobs[jobId];
         if (!job) return;
         
+        job.progress = progress;
         const statusDiv = job.card.find('.service-status');
         statusDiv.removeClass().addClass('service-status status-processing')
                .html(`⚙️ معالجة... ${progress}%<div class="progress-bar"><div class="progress-fill" style="width: ${progress}%"></div></div>`);
@@ -956,6 +1016,11 @@ class AIDashboard {
             statusDiv.removeClass().addClass('service-status status-completed').text('✅ تم بنجاح');
             serviceBtn.text('عرض النتائج').prop('disabled', false);
             
+            // Fetch the full result once, now that it exists (cached results arrive with the response)
+            if (!message.from_cache) {
+                this.fetchJobResult(jobId, job.service);
+            }
+            
             // Remove from active jobs
             delete this.activeJobs[jobId];
             
@@ -983,12 +1048,38 @@ class AIDashboard {
         }
     }
     
+    handleJobCancelled(message) {
+        const jobId = message.job_id;
+        const job = this.activeJobs[jobId];
+        
+        if (job) {
+            job.card.find('.service-status').removeClass().addClass('service-status status-failed').text('⛔ تم الإلغاء');
+            job.card.find('.service-btn').text('إعادة التشغيل').prop('disabled', false);
+            
+            // Remove from active jobs
+            delete this.activeJobs[jobId];
+            
+            this.showMessage(`تم إلغاء ${this.getServiceNameAr(message.job_type)}: ${message.reason || ''}`, 'warning');
+            this.updateJobsMonitor();
+        }
+    }
+    
+    handleAnomalyAlert(message) {
+        if (this.currentCompany && message.company !== this.currentCompany) {
+            return;
+        }
+        
+        const voucher = frappe.utils.escape_html(`${message.voucher_type} ${message.voucher_no}`);
+        this.showMessage(`🚨 ${frappe.utils.escape_html(message.description)} - ${voucher}`, 'error');
+    }
+    
     getServiceNameAr(serviceType) {
         const names = {
             'financial_prediction': 'التنبؤ المالي',
             'anomaly_detection': 'كشف الشذوذ',
             'investment_analysis': 'تحليل الاستثمار',
-            'comprehensive_analysis': 'التحليل الشامل'
+            'comprehensive_analysis': 'التحليل الشامل',
+            'dimension_forecast': 'التنبؤ حسب مراكز التكلفة والمشاريع'
         };
         return names[serviceType] || serviceType;
     }
@@ -1017,8 +1108,9 @@ class AIDashboard {
                         <small style="display: block; color: #666;">${elapsed}s مضى</small>
                     </div>
                     <div class="progress-bar">
-                        <div class="progress-fill" style="width: 0%"></div>
+                        <div class="progress-fill" style="width: ${job.progress || 0}%"></div>
                     </div>
+                    <button class="btn btn-xs btn-default job-cancel-btn" data-job-id="${jobId}">إلغاء</button>
                 </div>
             `;
         });
@@ -1044,43 +1136,90 @@ class AIDashboard {
         // Add loading message
         const loadingId = this.addChatMessage('🤔 جاري التحليل والبحث عن الإجابة...', 'assistant', true);
         
-        // Send to AI assistant
+        // Register the chat before calling so no streamed token can arrive unclaimed
+        const chatId = frappe.utils.get_random(16);
+        this.pendingChats[chatId] = {
+            messageId: loadingId,
+            message: message,
+            text: ''
+        };
+        
+        // Send to AI assistant - the answer is streamed back over realtime events
         frappe.call({
             method: 'material_ledger.material_ledger.api.chat_with_ai_assistant',
             args: {
                 message: message,
                 company: this.currentCompany,
-                chat_history: this.chatHistory
+                chat_history: this.chatHistory,
+                chat_id: chatId
             },
             callback: (r) => {
-                // Remove loading message
+                if (r.message && r.message.chat_id) {
+                    return;
+                }
+                
+                delete this.pendingChats[chatId];
                 $(`#${loadingId}`).remove();
                 
                 if (r.message && r.message.response) {
                     this.addChatMessage(r.message.response, 'assistant');
-                    
-                    // Update chat history
-                    this.chatHistory.push({
-                        user: message,
-                        assistant: r.message.response,
-                        timestamp: new Date().toISOString()
-                    });
-                    
-                    // Keep only last 10 exchanges
-                    if (this.chatHistory.length > 10) {
-                        this.chatHistory = this.chatHistory.slice(-10);
-                    }
                 } else {
                     this.addChatMessage('عذراً، لم أتمكن من معالجة طلبك حالياً. يرجى المحاولة مرة أخرى.', 'assistant');
                 }
             },
             error: () => {
+                delete this.pendingChats[chatId];
                 $(`#${loadingId}`).remove();
                 this.addChatMessage('عذراً، حدث خطأ في الاتصال. يرجى المحاولة مرة أخرى.', 'assistant');
             }
         });
     }
     
+    handleChatToken(message) {
+        const chat = this.pendingChats[message.chat_id];
+        if (!chat) return;
+        
+        chat.text += message.token;
+        this.setChatMessageText(chat.messageId, chat.text);
+    }
+    
+    handleChatComplete(message) {
+        const chat = this.pendingChats[message.chat_id];
+        if (!chat) return;
+        
+        // Replace the streamed text with the final cleaned answer
+        this.setChatMessageText(chat.messageId, message.response);
+        delete this.pendingChats[message.chat_id];
+        
+        // Update chat history
+        this.chatHistory.push({
+            user: chat.message,
+            assistant: message.response,
+            timestamp: new Date().toISOString()
+        });
+        
+        // Keep only last 10 exchanges
+        if (this.chatHistory.length > 10) {
+            this.chatHistory = this.chatHistory.slice(-10);
+        }
+    }
+    
+    handleChatError(message) {
+        const chat = this.pendingChats[message.chat_id];
+        if (!chat) return;
+        
+        this.setChatMessageText(chat.messageId, message.response);
+        delete this.pendingChats[message.chat_id];
+    }
+    
+    setChatMessageText(messageId, text) {
+        const messagesContainer = $('#chat-messages');
+        const html = frappe.utils.escape_html(text).replace(/\n/g, '<br>');
+        
+        $(`#${messageId} .message-content p`).html(html);
+        messagesContainer.scrollTop(messagesContainer[0].scrollHeight);
+    }
+    
     addChatMessage(message, sender, isLoading = false) {
         const messagesContainer = $('#chat-messages');
         const messageId = `msg-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;
@@ -1193,6 +1332,13 @@ class AIDashboard {
             });
         }
         
+        if (data.findings_job && data.total_anomalies > 10) {
+            html += `<div class="findings-list"></div>
+                <button class="btn btn-default btn-sm findings-more-btn" data-job-id="${data.findings_job}" data-page="1">
+                    عرض جميع الحالات (${data.total_anomalies})
+                </button>`;
+        }
+        
         if (data.recommendations && data.recommendations.length > 0) {
             html += '<h4>💡 التوصيات</h4><ul>';
             data.recommendations.forEach(rec => {
@@ -1205,6 +1351,44 @@ class AIDashboard {
         return html;
     }
     
+    loadAnomalyFindings(jobId, page) {
+        const button = $('.findings-more-btn');
+        button.prop('disabled', true);
+        
+        frappe.call({
+            method: 'material_ledger.material_ledger.services.anomaly_findings.get_anomaly_findings',
+            args: {
+                job_id: jobId,
+                page: page,
+                page_length: 50
+            },
+            callback: (r) => {
+                if (!r.message) {
+                    return;
+                }
+                
+                const list = $('.findings-list');
+                if (page === 1) {
+                    list.empty();
+                }
+                
+                r.message.findings.forEach(finding => {
+                    const severityClass = finding.severity === 'high' ? 'danger' : finding.severity === 'medium' ? 'warning' : 'info';
+                    const entry = finding.gl_entry ? ` - <a href="/app/gl-entry/${finding.gl_entry}">${finding.gl_entry}</a>` : '';
+                    list.append(`<div class="alert alert-${severityClass}">
+                        <strong>${finding.anomaly_type}</strong>: ${frappe.utils.escape_html(finding.description || '')}${entry}
+                    </div>`);
+                });
+                
+                if (page * r.message.page_length < r.message.total) {
+                    button.data('page', page + 1).prop('disabled', false).text(`عرض المزيد (${list.children().length} / ${r.message.total})`);
+                } else {
+                    button.remove();
+                }
+            }
+        });
+    }
+    
     formatInvestmentResults(data) {
         let html = '<div class="investment-results">';
         
@@ -1403,12 +1587,12 @@ class AIDashboard {
     }
     
     startJobMonitoring() {
-        // Poll for job updates every 5 seconds
-        setInterval(() => {
-            if (Object.keys(this.activeJobs).length > 0) {
-                this.updateJobsMonitor();
-            }
-        }, 5000);
+        // Job updates are pushed over realtime; after a reconnect, catch up once on events missed while offline
+        if (frappe.realtime.socket) {
+            frappe.realtime.socket.on('connect', () => {
+                Object.keys(this.activeJobs).forEach((jobId) => this.syncJobStatus(jobId));
+            });
+        }
     }
     
     checkNotifications() {
@@ -8,13 +8,55 @@ Detects unusual patterns, potential fraud, and data inconsistencies
 
 import frappe
 from frappe import _
-from frappe.utils import flt, now, getdate
+from frappe.utils import flt, now
 import json
 import statistics
 import math
 from collections import defaultdict
 
 
+class TransactionRow:
+    """
+    Compact GL Entry record for anomaly detection
+    
+    Slots instead of a dict per row keep large datasets small in memory and
+    in pickled chunks; item access and get() keep it interchangeable with
+    the dict rows the detectors were written for.
+    """
+    
+    # In the column order of the transaction query
+    FIELDS = (
+        "name", "posting_date", "account", "debit", "credit", "net_amount", "abs_amount",
+        "voucher_type", "voucher_no", "party_type", "party", "cost_center", "project",
+        "remarks", "creation", "modified", "owner", "modified_by", "creation_hour",
+        "day_of_week", "is_opening", "account_type", "root_type", "is_group",
+        "is_weekend", "is_after_hours"
+    )
+    __slots__ = FIELDS
+    
+    def __init__(self, *values):
+        for field, value in zip(self.FIELDS, values, strict=True):
+            setattr(self, field, value)
+        self.is_weekend = bool(self.is_weekend)
+        self.is_after_hours = bool(self.is_after_hours)
+    
+    def __getitem__(self, field):
+        return getattr(self, field)
+    
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+    
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+    
+    def __setstate__(self, state):
+        for field, value in zip(self.FIELDS, state, strict=True):
+            setattr(self, field, value)
+    
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
 class AIAnomalyService:
     """Service for detecting financial anomalies using AI and statistical methods"""
     
@@ -22,14 +64,18 @@ class AIAnomalyService:
         self.chunk_size = 1000
         self.anomaly_threshold = 2.5  # Standard deviations for statistical anomaly
         self.high_risk_threshold = 3.0
+        self.duplicate_time_window = 3600  # Seconds within which similar postings are near duplicates
+        self.duplicate_amount_tolerance = 0.01  # Relative amount difference of near duplicates
         
-    def get_transaction_data(self, company, filters):
+    def get_transaction_data(self, company, filters, since=None):
         """
         Get transaction data for anomaly detection
         
         Args:
             company: Company name  
             filters: Dictionary with date ranges, accounts, etc.
+            since: Optional creation time; only entries created at or after
+                it are returned, regardless of posting date
             
         Returns:
             list: Transaction data for analysis
@@ -37,61 +83,58 @@ class AIAnomalyService:
         from_date = filters.get('from_date', '2023-01-01')
         to_date = filters.get('to_date', now().split(' ')[0])
         
-        # Get GL entries with detailed information
-        gl_entries = frappe.db.sql("""
+        if since:
+            date_condition = "gle.creation >= %(since)s"
+        else:
+            date_condition = "gle.posting_date BETWEEN %(from_date)s AND %(to_date)s"
+        
+        # One joined query: account attributes and time flags come from the database,
+        # rows are streamed from an unbuffered cursor into compact TransactionRow objects
+        query = f"""
             SELECT 
-                name,
-                posting_date,
-                account,
-                debit,
-                credit,
-                (debit - credit) as net_amount,
-                ABS(debit - credit) as abs_amount,
-                voucher_type,
-                voucher_no,
-                party_type,
-                party,
-                cost_center,
-                project,
-                remarks,
-                creation,
-                modified,
-                owner,
-                modified_by,
-                HOUR(creation) as creation_hour,
-                DAYOFWEEK(posting_date) as day_of_week,
-                is_opening
-            FROM `tabGL Entry`
+                gle.name,
+                gle.posting_date,
+                gle.account,
+                gle.debit,
+                gle.credit,
+                (gle.debit - gle.credit) as net_amount,
+                ABS(gle.debit - gle.credit) as abs_amount,
+                gle.voucher_type,
+                gle.voucher_no,
+                gle.party_type,
+                gle.party,
+                gle.cost_center,
+                gle.project,
+                gle.remarks,
+                gle.creation,
+                gle.modified,
+                gle.owner,
+                gle.modified_by,
+                HOUR(gle.creation) as creation_hour,
+                DAYOFWEEK(gle.posting_date) as day_of_week,
+                gle.is_opening,
+                acc.account_type,
+                acc.root_type,
+                acc.is_group,
+                DAYOFWEEK(gle.posting_date) IN (1, 7) as is_weekend,
+                (HOUR(gle.creation) < 8 OR HOUR(gle.creation) > 18) as is_after_hours
+            FROM `tabGL Entry` gle
+            LEFT JOIN `tabAccount` acc ON acc.name = gle.account
             WHERE 
-                company = %(company)s 
-                AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-                AND is_cancelled = 0
-            ORDER BY posting_date, creation
-        """, {
+                gle.company = %(company)s 
+                AND {date_condition}
+                AND gle.is_cancelled = 0
+            ORDER BY gle.posting_date, gle.creation
+        """
+        values = {
             'company': company,
             'from_date': from_date,
-            'to_date': to_date
-        }, as_dict=True)
-        
-        # Enrich with additional data
-        enriched_entries = []
-        for entry in gl_entries:
-            # Add account information
-            account_info = frappe.db.get_value(
-                'Account', entry.account, 
-                ['account_type', 'root_type', 'is_group'], as_dict=True
-            ) or {}
-            
-            enriched_entry = entry.copy()
-            enriched_entry.update(account_info)
-            
-            # Calculate time-based features
-            enriched_entry['is_weekend'] = entry.day_of_week in [1, 7]  # Sunday=1, Saturday=7
-            enriched_entry['is_after_hours'] = entry.creation_hour < 8 or entry.creation_hour > 18
-            
-            enriched_entries.append(enriched_entry)
-            
-        return enriched_entries
+            'to_date': to_date,
+            'since': since
+        }
+        
+        with frappe.db.unbuffered_cursor():
+            return [TransactionRow(*row) for row in frappe.db.sql(query, values, as_iterator=True)]
     
     def chunk_transaction_data(self, data):
         """Split transaction data into processable chunks"""
@@ -100,35 +143,384 @@ class AIAnomalyService:
             chunks.append(data[i:i + self.chunk_size])
         return chunks
     
-    def detect_chunk_anomalies(self, chunk_data):
+    def detect_chunk_anomalies(self, chunk_data, budget=None, baseline=None, use_ai=True):
         """
         Detect anomalies in a data chunk
         
         Args:
             chunk_data: List of transaction records
+            budget: Optional RateBudget the AI call must draw from
+            baseline: Optional AnomalyBaseline of the whole dataset to score against
+            use_ai: Whether to send the chunk to the AI provider (off when a
+                local anomaly model scores the dataset instead)
             
         Returns:
             list: List of detected anomalies
         """
+        if not chunk_data or len(chunk_data) < 10:
+            return []
+        
+        anomalies = self.detect_statistical_anomalies(chunk_data, baseline)
+        if not use_ai:
+            return anomalies
+        
+        # AI-powered anomaly detection
+        if budget:
+            ai_anomalies = self._rate_limited_ai_detection(chunk_data, budget)
+        else:
+            ai_anomalies = self._ai_anomaly_detection(chunk_data)
+        anomalies.extend(ai_anomalies)
+        
+        return anomalies
+    
+    def detect_statistical_anomalies(self, chunk_data, baseline=None):
+        """
+        Run the local statistical detectors on a data chunk
+        
+        Amount, pattern and user detectors run on the columnar AnomalyEngine;
+        the _detect_* loop versions remain as its reference implementation.
+        Given a baseline (see build_baseline), amounts are scored against the
+        whole dataset's account and user statistics rather than the chunk's.
+        """
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyEngine
+        
         anomalies = []
         
         if not chunk_data or len(chunk_data) < 10:
             return anomalies
         
+        engine = AnomalyEngine(chunk_data, baseline)
+        
         # Different anomaly detection methods
-        anomalies.extend(self._detect_amount_anomalies(chunk_data))
+        anomalies.extend(engine.amount_anomalies(self.anomaly_threshold, self.high_risk_threshold))
         anomalies.extend(self._detect_timing_anomalies(chunk_data))
-        anomalies.extend(self._detect_pattern_anomalies(chunk_data))
-        anomalies.extend(self._detect_duplicate_anomalies(chunk_data))
-        anomalies.extend(self._detect_account_anomalies(chunk_data))
-        anomalies.extend(self._detect_user_behavior_anomalies(chunk_data))
+        anomalies.extend(engine.pattern_anomalies())
+        anomalies.extend(engine.user_anomalies())
         
-        # AI-powered anomaly detection
-        ai_anomalies = self._ai_anomaly_detection(chunk_data)
-        anomalies.extend(ai_anomalies)
+        return anomalies
+    
+    def build_baseline(self, data):
+        """Build the dataset-wide account and user statistics chunks are scored against"""
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyBaseline
+        return AnomalyBaseline.from_data(data)
+    
+    def detect_dataset_anomalies(self, data):
+        """Run the detectors that need the whole dataset rather than one chunk"""
+        anomalies = []
+        anomalies.extend(self._detect_account_anomalies(data))
+        anomalies.extend(self._detect_duplicate_anomalies(data))
+        anomalies.extend(self._detect_rapid_sequences(data))
+        return anomalies
+    
+    def detect_all_anomalies(self, chunks, on_chunk_done=None, checkpoint=None, baseline=None, use_ai=True):
+        """
+        Detect anomalies in all chunks with the AI calls fanned out concurrently
+        
+        AI calls for every chunk are submitted to a bounded thread pool up front
+        and draw from the shared per-minute rate budget. The statistical
+        detectors run on the calling thread while the calls are in flight.
+        Results are merged per chunk in chunk order, so the output matches
+        running detect_chunk_anomalies on each chunk in sequence.
+        
+        Args:
+            chunks: List of transaction chunks
+            on_chunk_done: Optional callback(done_count, total) after each chunk is merged
+            checkpoint: Optional ChunkStore; chunks with a stored result are not
+                recomputed and each newly finished chunk is stored
+            baseline: Optional AnomalyBaseline of the whole dataset to score against
+            use_ai: Whether chunks are sent to the AI provider
+            
+        Returns:
+            list: List of detected anomalies
+        """
+        from material_ledger.material_ledger.services.concurrency import (
+            BoundedFanOut, RateBudget, get_concurrency_settings
+        )
+        
+        max_concurrency, rate_limit = get_concurrency_settings()
+        budget = RateBudget("llm", rate_limit)
+        
+        # Results of chunks finished by an earlier attempt of the same job
+        done = {}
+        if checkpoint:
+            for i in range(len(chunks)):
+                result = checkpoint.get_result(i)
+                if result is not None:
+                    done[i] = result
+        
+        pending = [i for i in range(len(chunks)) if i not in done]
+        eligible = [i for i in pending if use_ai and chunks[i] and len(chunks[i]) >= 10]
+        
+        anomalies = []
+        with BoundedFanOut(max_concurrency) as fan_out:
+            futures = {
+                i: fan_out.submit(self._rate_limited_ai_detection, chunks[i], budget)
+                for i in eligible
+            }
+            
+            statistical = {i: self.detect_statistical_anomalies(chunks[i], baseline) for i in pending}
+            
+            for i in range(len(chunks)):
+                if i in done:
+                    chunk_anomalies = done[i]
+                else:
+                    chunk_anomalies = statistical[i]
+                    if i in futures:
+                        chunk_anomalies = chunk_anomalies + fan_out.gather([futures[i]], default=[])[0]
+                    if checkpoint:
+                        checkpoint.save_result(i, chunk_anomalies)
+                
+                anomalies.extend(chunk_anomalies)
+                
+                if on_chunk_done:
+                    on_chunk_done(i + 1, len(chunks))
         
         return anomalies
     
+    def detect_incremental_anomalies(self, company, filters=None):
+        """
+        Score only the GL Entries created since the last incremental run
+        
+        Entries are scored against the company's persisted baselines (running
+        per-account and per-user statistics, amount frequency sketches and
+        Benford counts), then folded into them. The first run has no
+        watermark and reads from `from_date` to build the baselines. Later
+        runs re-read a short window behind the watermark and skip entries
+        they already folded in (see AnomalyState).
+        
+        Returns:
+            tuple: (anomalies, number of entries scored)
+        """
+        from material_ledger.material_ledger.services.anomaly_state import AnomalyState
+        from material_ledger.material_ledger.services.realtime_anomaly import publish_snapshot
+        
+        state = AnomalyState(company)
+        data = self.get_transaction_data(company, filters or {}, since=state.read_from())
+        data = [entry for entry in data if not state.is_seen(entry)]
+        
+        anomalies = self.score_against_baseline(data, state)
+        if data:
+            anomalies.extend(self.detect_model_anomalies(company, data) or [])
+            anomalies.extend(self._detect_timing_anomalies(data))
+            anomalies.extend(self._detect_duplicate_anomalies(data))
+            anomalies.extend(self._detect_rapid_sequences(data))
+        
+        state.save()
+        publish_snapshot(state)
+        return anomalies, len(data)
+    
+    def score_against_baseline(self, data, state):
+        """
+        Score entries against running baselines, folding each entry in after it is scored
+        
+        Args:
+            data: Transaction records in posting order
+            state: AnomalyState of the company
+            
+        Returns:
+            list: Detected anomalies
+        """
+        from material_ledger.material_ledger.services.anomaly_state import BENFORD_CRITICAL
+        
+        anomalies = []
+        frequent = defaultdict(list)
+        
+        for entry in data:
+            amount = entry['abs_amount']
+            
+            stats = state.account_stats(entry['account'])
+            if stats.count >= 5 and stats.stdev > 0:
+                z_score = abs((amount - stats.mean) / stats.stdev)
+                if z_score > self.anomaly_threshold:
+                    anomalies.append({
+                        'type': 'unusual_amount',
+                        'severity': "high" if z_score > self.high_risk_threshold else "medium",
+                        'entry_name': entry['name'],
+                        'account': entry['account'],
+                        'amount': amount,
+                        'expected_range': f"{stats.mean - 2*stats.stdev:.0f} - {stats.mean + 2*stats.stdev:.0f}",
+                        'z_score': z_score,
+                        'posting_date': entry['posting_date'],
+                        'description': f"مبلغ غير عادي: {amount:,.0f} (متوسط الحساب: {stats.mean:,.0f})",
+                        'details': entry
+                    })
+            
+            user_stats = state.user_stats(entry['owner'])
+            if user_stats.count >= 3 and user_stats.stdev > 0:
+                z_score = (amount - user_stats.mean) / user_stats.stdev
+                if z_score > 2.5:
+                    anomalies.append({
+                        'type': 'unusual_user_amount',
+                        'severity': 'medium',
+                        'entry_name': entry['name'],
+                        'user': entry['owner'],
+                        'amount': amount,
+                        'user_avg': user_stats.mean,
+                        'z_score': z_score,
+                        'description': f"مبلغ غير عادي للمستخدم {entry['owner']}: {amount:,.0f} (متوسطه: {user_stats.mean:,.0f})",
+                        'details': entry
+                    })
+            
+            state.update(entry)
+            
+            count = state.amount_frequency(entry['account'], amount)
+            if count >= 5 and amount > 1000:
+                frequent[(entry['account'], amount)].append((entry, count))
+        
+        # Identical amounts: flag the latest entries of each amount seen 5+ times
+        for (_account, amount), entries in frequent.items():
+            for entry, count in entries[-3:]:
+                anomalies.append({
+                    'type': 'identical_amounts',
+                    'severity': 'medium',
+                    'entry_name': entry['name'],
+                    'amount': amount,
+                    'count': count,
+                    'description': f"مبلغ متكرر مشبوه: {amount:,.0f} ({count} مرات)",
+                    'details': entry
+                })
+        
+        chi_square = state.benford.chi_square()
+        if data and state.benford.total > 50 and chi_square > BENFORD_CRITICAL:
+            anomalies.append({
+                'type': 'benford_law_violation',
+                'severity': 'high',
+                'chi_square': chi_square,
+                'description': f"انتهاك قانون بنفورد (مؤشر احتيال محتمل) - قيمة كاي تربيع: {chi_square:.2f}",
+                'recommendation': "فحص شامل للمعاملات المالية - قد يدل على تلاعب في الأرقام"
+            })
+        
+        return anomalies
+    
+    def detect_model_anomalies(self, company, data):
+        """
+        Score entries with the company's local anomaly model
+        
+        Only the top outliers are sent to the AI provider, in one call, to be
+        explained. See anomaly_model for training and storage.
+        
+        Returns:
+            list: Outlier anomalies, or None when no model is in use (chunks
+                then go to the AI provider instead)
+        """
+        from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+        from material_ledger.material_ledger.services.anomaly_model import load_active_model
+        
+        if not MaterialLedgerSettings.get_settings().get("ai_anomaly_model"):
+            return None
+        
+        model = load_active_model(company)
+        if not model:
+            return None
+        
+        anomalies = []
+        for index, score in model.top_outliers(data):
+            entry = data[index]
+            anomalies.append({
+                'type': 'model_outlier',
+                'severity': 'medium',
+                'entry_name': entry['name'],
+                'account': entry['account'],
+                'amount': entry['abs_amount'],
+                'posting_date': entry['posting_date'],
+                'outlier_score': score,
+                'description': f"قيد شاذ وفق النموذج المحلي: {entry['abs_amount']:,.0f} - {entry['account']}",
+                'details': entry
+            })
+        
+        if anomalies:
+            self._explain_outliers(anomalies)
+        return anomalies
+    
+    def _explain_outliers(self, anomalies):
+        """Ask the AI provider to explain model outliers; adds explanation, recommendation and severity"""
+        try:
+            from material_ledger.material_ledger.services.ai_service import get_ai_service
+            
+            ai_service = get_ai_service()
+            if not ai_service.is_available():
+                return
+            
+            ai_response = ai_service.complete(self._build_outlier_prompt(anomalies))
+            explanations = self._parse_outlier_explanations(ai_response)
+        except Exception as e:
+            frappe.log_error(f"AI Outlier Explanation Error: {str(e)}", "AI Anomaly Service")
+            return
+        
+        severities = {'عالي': 'high', 'متوسط': 'medium', 'منخفض': 'low'}
+        for anomaly in anomalies:
+            explanation = explanations.get(anomaly['entry_name'])
+            if not explanation:
+                continue
+            anomaly['explanation'] = explanation.get('explanation', '')
+            anomaly['recommendation'] = explanation.get('recommendation', '')
+            severity = severities.get(explanation.get('severity'), explanation.get('severity'))
+            if severity in ('high', 'medium', 'low'):
+                anomaly['severity'] = severity
+    
+    def _build_outlier_prompt(self, anomalies):
+        """Build prompt asking the AI provider to explain model outliers"""
+        from material_ledger.material_ledger.services.prompt_budget import get_prompt_budget
+        
+        budget = get_prompt_budget()
+        
+        header = """
+كمحلل مالي متخصص في اكتشاف الاحتيال، صنّف نموذج محلي القيود التالية كقيم شاذة مقارنة بسجل الشركة:
+"""
+        
+        lines = []
+        for anomaly in anomalies:
+            entry = anomaly['details']
+            lines.append(
+                f"- {entry['name']} | {entry['posting_date']} | {entry['account']} | {entry['abs_amount']:,.0f} | "
+                f"{entry.get('voucher_type')} | {entry.get('owner')} | الساعة {entry.get('creation_hour')} | "
+                f"درجة الشذوذ {anomaly['outlier_score']:.3f}"
+            )
+        sections = [f"""🔎 **القيود الشاذة (الأعلى درجة أولاً):**
+{chr(10).join(lines)}"""]
+        
+        footer = """
+🎯 **المطلوب:**
+لكل قيد، اشرح سبب الشذوذ المحتمل وحدد مستوى الخطورة (عالي/متوسط/منخفض) والتوصية للتحقق.
+
+قدم النتائج بتنسيق JSON:
+```json
+{
+  "explanations": [
+    {
+      "entry_name": "رقم القيد",
+      "severity": "عالي/متوسط/منخفض",
+      "explanation": "سبب الشذوذ",
+      "recommendation": "التوصية"
+    }
+  ]
+}
+```
+"""
+        
+        return budget.compose(header, sections, footer)
+    
+    def _parse_outlier_explanations(self, ai_response):
+        """Parse AI outlier explanations into a dict keyed by entry name"""
+        import re
+        
+        json_match = re.search(r'```json\n(.*?)\n```', ai_response or "", re.DOTALL)
+        if not json_match:
+            return {}
+        
+        ai_data = json.loads(json_match.group(1))
+        return {
+            item.get('entry_name'): item
+            for item in ai_data.get('explanations', [])
+            if isinstance(item, dict)
+        }
+    
+    def _rate_limited_ai_detection(self, data, budget, wait_timeout=300):
+        """Run AI anomaly detection once the rate budget grants a call"""
+        if not budget.acquire(timeout=wait_timeout):
+            return self._statistical_ai_fallback(data)
+        return self._ai_anomaly_detection(data)
+    
     def _detect_amount_anomalies(self, data):
         """Detect unusual amounts using statistical analysis"""
         anomalies = []
@@ -204,31 +596,19 @@ class AIAnomalyService:
                     'details': entry
                 })
         
-        # Rapid sequence transactions
-        sorted_data = sorted(data, key=lambda x: x['creation'])
-        for i in range(1, len(sorted_data)):
-            current = sorted_data[i]
-            previous = sorted_data[i-1]
-            
-            # Check if same user, close timing, similar amounts
-            if (current['owner'] == previous['owner'] and
-                current['account'] == previous['account'] and
-                abs(current['abs_amount'] - previous['abs_amount']) < 100):
-                
-                time_diff = (getdate(current['creation']) - getdate(previous['creation'])).seconds
-                if time_diff < 60:  # Within 1 minute
-                    anomalies.append({
-                        'type': 'rapid_sequence',
-                        'severity': 'high',
-                        'entry_name': current['name'],
-                        'related_entry': previous['name'],
-                        'time_gap': time_diff,
-                        'description': f"معاملات متتابعة سريعة خلال {time_diff} ثانية",
-                        'details': current
-                    })
-        
         return anomalies
     
+    def _detect_rapid_sequences(self, data):
+        """Detect bursts of similar postings by one user to one account (see Material Ledger Settings)"""
+        from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyEngine
+        
+        settings = MaterialLedgerSettings.get_settings()
+        return AnomalyEngine(data).rapid_sequence_anomalies(
+            min_postings=settings.get("anomaly_rapid_sequence_count") or 2,
+            window=settings.get("anomaly_rapid_sequence_window") or 60
+        )
+    
     def _detect_pattern_anomalies(self, data):
         """Detect unusual patterns in transactions"""
         anomalies = []
@@ -267,69 +647,51 @@ class AIAnomalyService:
         return anomalies
     
     def _detect_duplicate_anomalies(self, data):
-        """Detect potential duplicate or reversed transactions"""
-        anomalies = []
-        
-        # Group by date and amount for duplicate detection
-        date_amount_groups = defaultdict(list)
-        for entry in data:
-            key = f"{entry['posting_date']}_{entry['abs_amount']}"
-            date_amount_groups[key].append(entry)
-        
-        for key, entries in date_amount_groups.items():
-            if len(entries) >= 2:
-                # Check for potential duplicates
-                for i in range(len(entries)):
-                    for j in range(i+1, len(entries)):
-                        entry1, entry2 = entries[i], entries[j]
-                        
-                        # Same account, same amount, same date = potential duplicate
-                        if (entry1['account'] == entry2['account'] and
-                            entry1['voucher_type'] == entry2['voucher_type']):
-                            
-                            anomalies.append({
-                                'type': 'potential_duplicate',
-                                'severity': 'high',
-                                'entry_name': entry1['name'],
-                                'related_entry': entry2['name'],
-                                'amount': entry1['abs_amount'],
-                                'description': f"معاملة مكررة محتملة: {entry1['abs_amount']:,.0f}",
-                                'details': entry1
-                            })
-        
-        return anomalies
+        """Detect duplicate and near-duplicate transaction clusters (one record per cluster)"""
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyEngine
+        return AnomalyEngine(data).duplicate_anomalies(
+            self.duplicate_time_window, self.duplicate_amount_tolerance
+        )
     
     def _detect_account_anomalies(self, data):
-        """Detect unusual account usage patterns"""
+        """
+        Detect unusual account usage patterns
+        
+        Lines are indexed by voucher once, so the detector is linear in the
+        number of rows. Pair frequencies are counted over all data passed in;
+        run it on the whole dataset (see detect_dataset_anomalies) so vouchers
+        are not split or judged rare by a chunk boundary.
+        """
         anomalies = []
         
-        # Unusual account combinations
-        account_pairs = defaultdict(int)
+        vouchers = defaultdict(list)
         for entry in data:
-            # Find related entries in same voucher
-            related_entries = [e for e in data if e['voucher_no'] == entry['voucher_no']]
-            
-            if len(related_entries) == 2:  # Simple two-account transaction
-                accounts = sorted([e['account'] for e in related_entries])
-                pair_key = f"{accounts[0]}|{accounts[1]}"
-                account_pairs[pair_key] += 1
+            vouchers[(entry['voucher_type'], entry['voucher_no'])].append(entry)
+        
+        # Account pair of every simple two-account voucher, counted once per voucher
+        voucher_pairs = {}
+        pair_counts = defaultdict(int)
+        for voucher, lines in vouchers.items():
+            if len(lines) == 2:
+                pair = tuple(sorted(line['account'] for line in lines))
+                voucher_pairs[voucher] = pair
+                pair_counts[pair] += 1
         
         # Flag rare account combinations with high amounts
-        rare_pairs = {k: v for k, v in account_pairs.items() if v == 1}
-        for entry in data:
-            related_entries = [e for e in data if e['voucher_no'] == entry['voucher_no']]
-            if len(related_entries) == 2:
-                accounts = sorted([e['account'] for e in related_entries])
-                pair_key = f"{accounts[0]}|{accounts[1]}"
-                
-                if pair_key in rare_pairs and entry['abs_amount'] > 100000:
+        for voucher, pair in voucher_pairs.items():
+            if pair_counts[pair] != 1:
+                continue
+            
+            pair_key = f"{pair[0]}|{pair[1]}"
+            for entry in vouchers[voucher]:
+                if entry['abs_amount'] > 100000:
                     anomalies.append({
                         'type': 'unusual_account_combination',
                         'severity': 'medium',
                         'entry_name': entry['name'],
                         'account_pair': pair_key,
                         'amount': entry['abs_amount'],
-                        'description': f"تركيبة حسابات غير عادية: {accounts[0]} ← {accounts[1]}",
+                        'description': f"تركيبة حسابات غير عادية: {pair[0]} ← {pair[1]}",
                         'details': entry
                     })
         
@@ -404,7 +766,7 @@ class AIAnomalyService:
             analysis_prompt = self._build_anomaly_prompt(data)
             
             # Get AI analysis
-            ai_response = ai_service._call_deepseek(analysis_prompt) if hasattr(ai_service, '_call_deepseek') else None
+            ai_response = ai_service.complete(analysis_prompt)
             
             if ai_response:
                 ai_anomalies = self._parse_ai_anomalies(ai_response, data)
@@ -419,34 +781,40 @@ class AIAnomalyService:
     
     def _build_anomaly_prompt(self, data):
         """Build prompt for AI anomaly detection"""
+        from material_ledger.material_ledger.services.prompt_budget import get_prompt_budget
+        
+        budget = get_prompt_budget()
+        
         # Summarize key statistics
         total_transactions = len(data)
         total_amount = sum(d['abs_amount'] for d in data)
         avg_amount = total_amount / total_transactions if total_transactions > 0 else 0
         
         # Get largest transactions
-        largest_transactions = sorted(data, key=lambda x: x['abs_amount'], reverse=True)[:5]
+        largest_transactions = budget.top_n(data, 3, key=lambda x: x['abs_amount'])
         
         # Get account distribution
         account_counts = defaultdict(int)
         for d in data:
             account_counts[d['account']] += 1
-        top_accounts = sorted(account_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_accounts = budget.top_n(list(account_counts.items()), 3, key=lambda x: x[1])
         
-        prompt = f"""
+        header = """
 كمحلل مالي متخصص في اكتشاف الاحتيال والشذوذ المالي، قم بتحليل البيانات التالية:
-
-📊 **إحصائيات عامة:**
+"""
+        
+        sections = [
+            f"""📊 **إحصائيات عامة:**
 - عدد المعاملات: {total_transactions:,}
 - إجمالي المبالغ: {total_amount:,.0f}
-- متوسط المبلغ: {avg_amount:,.0f}
-
-💰 **أكبر المعاملات:**
-{chr(10).join([f"- {t['posting_date']} | {t['account']} | {t['abs_amount']:,.0f} | {t['voucher_type']}" for t in largest_transactions[:3]])}
-
-🏦 **أكثر الحسابات نشاطاً:**
-{chr(10).join([f"- {acc}: {count} معاملة" for acc, count in top_accounts[:3]])}
-
+- متوسط المبلغ: {avg_amount:,.0f}""",
+            f"""💰 **أكبر المعاملات:**
+{chr(10).join([f"- {t['posting_date']} | {t['account']} | {t['abs_amount']:,.0f} | {t['voucher_type']}" for t in largest_transactions])}""",
+            f"""🏦 **أكثر الحسابات نشاطاً:**
+{chr(10).join([f"- {acc}: {count} معاملة" for acc, count in top_accounts])}"""
+        ]
+        
+        footer = """
 🔍 **ابحث عن الأنماط التالية:**
 1. معاملات مشبوهة أو غير عادية
 2. أنماط قد تشير إلى احتيال
@@ -463,21 +831,22 @@ class AIAnomalyService:
 
 قدم النتائج بتنسيق JSON:
 ```json
-{{
+{
   "anomalies": [
-    {{
+    {
       "type": "نوع الشذوذ",
       "severity": "عالي/متوسط/منخفض", 
       "description": "وصف المشكلة",
       "recommendation": "التوصية"
-    }}
+    }
   ],
   "overall_risk": "عالي/متوسط/منخفض",
   "summary": "ملخص التحليل"
-}}
+}
 ```
 """
-        return prompt
+        
+        return budget.compose(header, sections, footer)
     
     def _parse_ai_anomalies(self, ai_response, data):
         """Parse AI response into structured anomalies"""
@@ -509,6 +878,11 @@ class AIAnomalyService:
     
     def _statistical_ai_fallback(self, data):
         """Statistical fallback when AI is not available"""
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyEngine
+        return AnomalyEngine(data).benford_anomalies()
+    
+    def _detect_benford_anomalies(self, data):
+        """Benford's law first-digit test (loop reference of AnomalyEngine.benford_anomalies)"""
         anomalies = []
         
         # Advanced statistical anomaly detection
@@ -546,12 +920,18 @@ class AIAnomalyService:
         
         return anomalies
     
-    def generate_anomaly_report(self, anomalies):
+    def generate_anomaly_report(self, anomalies, job_id=None, company=None):
         """
         Generate comprehensive anomaly detection report
         
+        The report keeps counts, analysis and the top 20 anomalies; with a
+        job_id every anomaly is stored as an AI Anomaly Finding of the job,
+        to be read a page at a time with get_anomaly_findings.
+        
         Args:
             anomalies: List of all detected anomalies
+            job_id: AI job the findings belong to
+            company: Company the anomalies were detected for
             
         Returns:
             dict: Comprehensive anomaly report
@@ -593,6 +973,9 @@ class AIAnomalyService:
         
         # Prioritize anomalies
         prioritized_anomalies = self._prioritize_anomalies(anomalies)
+        if job_id:
+            from material_ledger.material_ledger.services.anomaly_findings import save_findings
+            save_findings(job_id, company, prioritized_anomalies)
         
         # Generate recommendations
         recommendations = self._generate_anomaly_recommendations(by_type, by_severity)
@@ -608,10 +991,14 @@ class AIAnomalyService:
             "by_type": {type_name: len(type_anomalies) for type_name, type_anomalies in by_type.items()},
             "overall_risk": overall_risk,
             "analysis": analysis,
-            "prioritized_anomalies": prioritized_anomalies[:20],  # Top 20 for display
+            # Top 20 for display; source rows are referenced by entry_name, not copied
+            "prioritized_anomalies": [
+                {key: value for key, value in anomaly.items() if key != 'details'}
+                for anomaly in prioritized_anomalies[:20]
+            ],
             "recommendations": recommendations,
             "generated_at": now(),
-            "full_anomalies": anomalies  # For detailed investigation
+            "findings_job": job_id  # All anomalies, as AI Anomaly Finding rows
         }
     
     def _generate_anomaly_analysis(self, anomalies, by_type, by_severity):
@@ -637,6 +1024,8 @@ class AIAnomalyService:
                 'round_amount_pattern': 'نمط مبالغ مدورة',
                 'identical_amounts': 'مبالغ متطابقة',
                 'potential_duplicate': 'معاملات مكررة محتملة',
+                'model_outlier': 'قيود شاذة وفق النموذج المحلي',
+                'near_duplicate': 'معاملات شبه مكررة',
                 'unusual_account_combination': 'تركيبات حسابات غير عادية',
                 'unusual_user_amount': 'أنماط مستخدم غير عادية',
                 'ai_detected_anomaly': 'شذوذ مكتشف بالذكاء الاصطناعي',
@@ -664,10 +1053,12 @@ class AIAnomalyService:
         severity_scores = {'high': 100, 'medium': 50, 'low': 10}
         type_scores = {
             'potential_duplicate': 90,
+            'near_duplicate': 75,
             'benford_law_violation': 95,
             'rapid_sequence': 85,
             'unusual_amount': 70,
-            'ai_detected_anomaly': 80
+            'ai_detected_anomaly': 80,
+            'model_outlier': 80
         }
         
         scored_anomalies = []
@@ -689,7 +1080,7 @@ class AIAnomalyService:
         """Generate specific recommendations based on anomaly types"""
         recommendations = []
         
-        if 'potential_duplicate' in by_type:
+        if 'potential_duplicate' in by_type or 'near_duplicate' in by_type:
             recommendations.append("🔍 **فحص المعاملات المكررة**: راجع المعاملات المكررة المحتملة وتأكد من صحتها")
         
         if 'benford_law_violation' in by_type:
@@ -723,8 +1114,25 @@ def start_anomaly_detection(company, filters=None):
     return queue_ai_analysis("anomaly_detection", company, filters)
 
 
+def run_nightly_anomaly_detection():
+    """Scheduler: queue an incremental anomaly run per company (Material Ledger Settings opt-in)"""
+    from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+    from material_ledger.material_ledger.services.queue_service import AIQueueService
+    from frappe.utils import today
+    
+    if not MaterialLedgerSettings.get_settings().get("ai_nightly_anomaly_detection"):
+        return
+    
+    queue_service = AIQueueService()
+    for company in frappe.get_all("Company", pluck="name"):
+        queue_service.create_ai_job(
+            "anomaly_detection", company, {"incremental": 1, "run_date": today()},
+            user="Administrator", priority="bulk"
+        )
+
+
 @frappe.whitelist()
 def get_anomaly_status(job_id):
     """API endpoint to get anomaly detection job status"""
     from material_ledger.material_ledger.services.queue_service import get_ai_job_status
-    return get_ai_job_status(job_id)
\ No newline at end of file
+    return get_ai_job_status(job_id, include_result=1)
\ No newline at end of file
@@ -645,7 +645,7 @@ class AIInvestmentService:
             prompt = self._build_investment_prompt(data)
             
             # Get AI insights
-            ai_response = ai_service._call_deepseek(prompt) if hasattr(ai_service, '_call_deepseek') else None
+            ai_response = ai_service.complete(prompt)
             
             if ai_response:
                 return self._parse_ai_investment_insights(ai_response)
@@ -658,6 +658,10 @@ class AIInvestmentService:
     
     def _build_investment_prompt(self, data):
         """Build prompt for AI investment analysis"""
+        from material_ledger.material_ledger.services.prompt_budget import get_prompt_budget
+        
+        budget = get_prompt_budget()
+        
         # Summarize key data
         projects = data.get('projects', [])
         financial_data = data.get('financial_statements', [])
@@ -674,21 +678,24 @@ class AIInvestmentService:
         total_project_investment = sum(p.get('total_purchase_cost', 0) for p in projects)
         completed_projects = len([p for p in projects if p.get('status') == 'Completed'])
         
-        prompt = f"""
+        header = """
 كmحلل استثماري خبير متخصص في تقييم الفرص الاستثمارية، قم بتحليل البيانات التالية:
-
-💼 **الوضع المالي الحالي:**
+"""
+        
+        sections = [
+            f"""💼 **الوضع المالي الحالي:**
 - الإيرادات الحالية: {revenue:,.0f}
 - الأرباح الحالية: {profit:,.0f}
 - إجمالي الاستثمارات في المشاريع: {total_project_investment:,.0f}
-- عدد المشاريع المكتملة: {completed_projects} من أصل {len(projects)}
-
-📊 **المؤشرات الاقتصادية:**
+- عدد المشاريع المكتملة: {completed_projects} من أصل {len(projects)}""",
+            f"""📊 **المؤشرات الاقتصادية:**
 - معدل النمو الاقتصادي: {market_data.get('gdp_growth', 0)*100:.1f}%
 - معدل التضخم: {market_data.get('inflation_rate', 0)*100:.1f}%
 - معدل الفائدة: {market_data.get('interest_rate', 0)*100:.1f}%
-- التوقعات الاقتصادية: {market_data.get('economic_outlook', 'غير محدد')}
-
+- التوقعات الاقتصادية: {market_data.get('economic_outlook', 'غير محدد')}"""
+        ]
+        
+        footer = """
 🎯 **المطلوب تحليله:**
 
 1. **تقييم الأداء الاستثماري الحالي**
@@ -733,7 +740,8 @@ class AIInvestmentService:
 
 استخدم خبرتك في التحليل المالي لتقديم رؤى عملية قابلة للتنفيذ.
 """
-        return prompt
+        
+        return budget.compose(header, sections, footer)
     
     def _parse_ai_investment_insights(self, ai_response):
         """Parse AI investment insights response"""
@@ -870,4 +878,4 @@ def start_investment_analysis(company, filters=None):
 def get_investment_status(job_id):
     """API endpoint to get investment analysis job status"""
     from material_ledger.material_ledger.services.queue_service import get_ai_job_status
-    return get_ai_job_status(job_id)
\ No newline at end of file
+    return get_ai_job_status(job_id, include_result=1)
\ No newline at end of file
@@ -12,20 +12,15 @@ from frappe.utils import flt, add_months, getdate, now
 import json
 import statistics
 import numpy as np
-from sklearn.linear_model import LinearRegression
-try:
-    from sklearn.preprocessing import StandardScaler
-    from sklearn.metrics import mean_absolute_error
-    HAS_SKLEARN = True
-except ImportError:
-    HAS_SKLEARN = False
+
+
+FORECAST_METRICS = ['revenue', 'expenses', 'cash_flow']
 
 
 class AIPredictionService:
     """Service for AI-powered financial predictions"""
     
     def __init__(self):
-        self.chunk_size = 500
         self.prediction_months = 12  # Predict 12 months ahead
         
     def get_historical_data(self, company, filters):
@@ -42,78 +37,54 @@ class AIPredictionService:
         from_date = filters.get('from_date', '2020-01-01')
         to_date = filters.get('to_date', now().split(' ')[0])
         
-        # Get GL entries for analysis
-        gl_entries = frappe.db.sql("""
+        # One grouped query: the database sums each month by account root type,
+        # so the cost depends on the number of months, not of GL Entries
+        monthly_totals = frappe.db.sql("""
             SELECT 
-                posting_date,
-                account,
-                debit,
-                credit,
-                (debit - credit) as net_amount,
-                cost_center,
-                project,
-                MONTH(posting_date) as month,
-                YEAR(posting_date) as year,
-                QUARTER(posting_date) as quarter
-            FROM `tabGL Entry`
+                YEAR(gle.posting_date) as year,
+                MONTH(gle.posting_date) as month,
+                SUM(CASE WHEN acc.root_type = 'Income' THEN gle.credit - gle.debit ELSE 0 END) as revenue,
+                SUM(CASE WHEN acc.root_type = 'Expense' THEN gle.debit - gle.credit ELSE 0 END) as expenses,
+                SUM(CASE WHEN acc.root_type = 'Asset' THEN gle.debit - gle.credit ELSE 0 END) as assets,
+                SUM(CASE WHEN acc.root_type = 'Liability' THEN gle.credit - gle.debit ELSE 0 END) as liabilities,
+                SUM(CASE WHEN acc.root_type = 'Equity' THEN gle.credit - gle.debit ELSE 0 END) as equity,
+                SUM(CASE WHEN acc.account_type IN ('Cash', 'Bank') THEN gle.debit - gle.credit ELSE 0 END) as cash_flow
+            FROM `tabGL Entry` gle
+            LEFT JOIN `tabAccount` acc ON acc.name = gle.account
             WHERE 
-                company = %(company)s 
-                AND posting_date BETWEEN %(from_date)s AND %(to_date)s
-                AND is_cancelled = 0
-            ORDER BY posting_date
+                gle.company = %(company)s 
+                AND gle.posting_date BETWEEN %(from_date)s AND %(to_date)s
+                AND gle.is_cancelled = 0
+            GROUP BY YEAR(gle.posting_date), MONTH(gle.posting_date)
+            ORDER BY year, month
         """, {
             'company': company,
             'from_date': from_date,
             'to_date': to_date
         }, as_dict=True)
         
-        return self._aggregate_monthly_data(gl_entries)
+        return [self._monthly_row(totals) for totals in monthly_totals]
     
-    def _aggregate_monthly_data(self, gl_entries):
-        """Aggregate GL entries by month for trend analysis"""
-        monthly_data = {}
-        
-        for entry in gl_entries:
-            month_key = f"{entry.year}-{entry.month:02d}"
-            
-            if month_key not in monthly_data:
-                monthly_data[month_key] = {
-                    'date': month_key,
-                    'revenue': 0,
-                    'expenses': 0,
-                    'assets': 0,
-                    'liabilities': 0,
-                    'equity': 0,
-                    'cash_flow': 0
-                }
-            
-            # Categorize accounts
-            account_type = frappe.db.get_value('Account', entry.account, 'account_type')
-            root_type = frappe.db.get_value('Account', entry.account, 'root_type')
-            
-            if root_type == 'Income':
-                monthly_data[month_key]['revenue'] += flt(entry.credit - entry.debit)
-            elif root_type == 'Expense':
-                monthly_data[month_key]['expenses'] += flt(entry.debit - entry.credit)
-            elif root_type == 'Asset':
-                monthly_data[month_key]['assets'] += flt(entry.debit - entry.credit)
-            elif root_type == 'Liability':
-                monthly_data[month_key]['liabilities'] += flt(entry.credit - entry.debit)
-            elif root_type == 'Equity':
-                monthly_data[month_key]['equity'] += flt(entry.credit - entry.debit)
-                
-            # Cash flow approximation
-            if account_type in ['Cash', 'Bank']:
-                monthly_data[month_key]['cash_flow'] += flt(entry.debit - entry.credit)
-        
-        return list(monthly_data.values())
+    def _monthly_row(self, totals):
+        """Monthly financial data row from grouped GL Entry totals"""
+        return {
+            'date': f"{totals.year}-{totals.month:02d}",
+            'revenue': flt(totals.revenue),
+            'expenses': flt(totals.expenses),
+            'assets': flt(totals.assets),
+            'liabilities': flt(totals.liabilities),
+            'equity': flt(totals.equity),
+            'cash_flow': flt(totals.cash_flow)
+        }
     
     def chunk_financial_data(self, data):
-        """Split data into processable chunks"""
-        chunks = []
-        for i in range(0, len(data), self.chunk_size):
-            chunks.append(data[i:i + self.chunk_size])
-        return chunks
+        """
+        Split data into processable chunks
+        
+        Monthly series are a few dozen points and every metric is fitted at
+        once, so the whole history is one chunk.
+        """
+        return [data] if data else []
     
     def predict_chunk(self, chunk_data):
         """
@@ -128,119 +99,109 @@ class AIPredictionService:
         if not chunk_data or len(chunk_data) < 3:
             return {"predictions": [], "confidence": 0}
         
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine, forecast_cache, monthly_matrix
+        
+        # One least-squares fit of trend and seasonality for every metric
+        series, first_month = monthly_matrix(chunk_data, FORECAST_METRICS)
+        engine = ForecastEngine(series, first_month, forecast_cache())
+        forecast = engine.forecast(self.prediction_months)
+        
         # Use both traditional and AI methods
         traditional_predictions = self._traditional_forecast(chunk_data)
-        ai_predictions = self._ai_forecast(chunk_data)
+        ai_predictions = self._ai_forecast(chunk_data, forecast)
         
         # Combine predictions with weights
         combined_predictions = self._combine_prediction_methods(
             traditional_predictions, ai_predictions
         )
+        self._add_prediction_intervals(combined_predictions, forecast)
         
         return {
             "predictions": combined_predictions,
             "confidence": self._calculate_confidence(chunk_data),
-            "trend_analysis": self._analyze_trends(chunk_data),
+            "trend_analysis": self._analyze_trends(chunk_data, engine.trends),
             "seasonality": self._detect_seasonality(chunk_data)
         }
     
     def _traditional_forecast(self, data):
-        """Traditional statistical forecasting"""
-        predictions = []
+        """Traditional statistical forecasting: moving average and trend of the last 6 months"""
+        from material_ledger.material_ledger.services.forecast_engine import linear_trends
         
-        # Extract time series data
-        revenue_series = [d['revenue'] for d in data]
-        expenses_series = [d['expenses'] for d in data]
-        cash_flow_series = [d['cash_flow'] for d in data]
-        
-        # Simple moving average and trend analysis
-        for i in range(self.prediction_months):
-            revenue_pred = self._predict_series(revenue_series, i + 1)
-            expenses_pred = self._predict_series(expenses_series, i + 1)
-            cash_flow_pred = self._predict_series(cash_flow_series, i + 1)
-            
-            # Calculate projected month
-            last_date = data[-1]['date'] if data else "2026-01"
-            projected_date = self._add_months_to_date(last_date, i + 1)
-            
-            predictions.append({
-                'date': projected_date,
-                'revenue': revenue_pred,
-                'expenses': expenses_pred,
-                'profit': revenue_pred - expenses_pred,
-                'cash_flow': cash_flow_pred,
-                'method': 'traditional'
-            })
-            
-        return predictions
+        if len(data) < 3:
+            return []
+        
+        # Moving average and trend of every metric at once
+        recent = np.array([[flt(d[metric]) for d in data[-6:]] for metric in FORECAST_METRICS])
+        months_ahead = np.arange(1, self.prediction_months + 1)
+        projected = recent.mean(axis=1)[:, None] + linear_trends(recent)[:, None] * months_ahead
+        revenue, expenses, cash_flow = np.maximum(projected, 0)  # Ensure non-negative
+        
+        last_date = data[-1]['date']
+        return [{
+            'date': self._add_months_to_date(last_date, i + 1),
+            'revenue': float(revenue[i]),
+            'expenses': float(expenses[i]),
+            'profit': float(revenue[i] - expenses[i]),
+            'cash_flow': float(cash_flow[i]),
+            'method': 'traditional'
+        } for i in range(self.prediction_months)]
     
-    def _ai_forecast(self, data):
+    def _ai_forecast(self, data, forecast=None):
         """AI-powered forecasting using available AI service"""
         try:
             from material_ledger.material_ledger.services.ai_service import get_ai_service
             
             ai_service = get_ai_service()
             if not ai_service.is_available():
-                return self._fallback_ai_forecast(data)
+                return self._fallback_ai_forecast(data, forecast)
             
             # Prepare data for AI analysis
             analysis_prompt = self._build_prediction_prompt(data)
             
             # Get AI predictions
-            ai_response = ai_service._call_deepseek(analysis_prompt) if hasattr(ai_service, '_call_deepseek') else None
+            ai_response = ai_service.complete(analysis_prompt)
             
             if ai_response:
                 return self._parse_ai_predictions(ai_response)
             else:
-                return self._fallback_ai_forecast(data)
+                return self._fallback_ai_forecast(data, forecast)
                 
         except Exception as e:
             frappe.log_error(f"AI Forecast Error: {str(e)}", "AI Prediction Service")
-            return self._fallback_ai_forecast(data)
+            return self._fallback_ai_forecast(data, forecast)
     
-    def _fallback_ai_forecast(self, data):
-        """Fallback AI-like prediction using statistical methods"""
-        if not HAS_SKLEARN or len(data) < 6:
-            return self._simple_trend_forecast(data)
-            
-        try:
-            # Prepare data for sklearn
-            X = np.array([[i] for i in range(len(data))])
-            
-            predictions = []
-            
-            for metric in ['revenue', 'expenses', 'cash_flow']:
-                y = np.array([d.get(metric, 0) for d in data])
-                
-                # Linear regression model
-                model = LinearRegression()
-                model.fit(X, y)
-                
-                # Predict future values
-                future_X = np.array([[len(data) + i] for i in range(1, self.prediction_months + 1)])
-                future_y = model.predict(future_X)
-                
-                # Store predictions
-                for i, pred_value in enumerate(future_y):
-                    if i >= len(predictions):
-                        last_date = data[-1]['date'] if data else "2026-01"
-                        projected_date = self._add_months_to_date(last_date, i + 1)
-                        predictions.append({
-                            'date': projected_date,
-                            'method': 'ml_fallback'
-                        })
-                    
-                    predictions[i][metric] = max(0, flt(pred_value))  # Ensure non-negative
-            
-            # Calculate profit
-            for pred in predictions:
-                pred['profit'] = pred.get('revenue', 0) - pred.get('expenses', 0)
-            
-            return predictions
-            
-        except Exception as e:
-            frappe.log_error(f"ML Forecast Error: {str(e)}", "AI Prediction Service")
+    def _fallback_ai_forecast(self, data, forecast=None):
+        """Fallback AI-like prediction: least-squares trend and seasonality of every metric"""
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine, forecast_cache, monthly_matrix
+        
+        if len(data) < 6:
             return self._simple_trend_forecast(data)
+        
+        if forecast is None:
+            series, first_month = monthly_matrix(data, FORECAST_METRICS)
+            forecast = ForecastEngine(series, first_month, forecast_cache()).forecast(self.prediction_months)
+        
+        revenue, expenses, cash_flow = np.maximum(forecast['point'], 0)  # Ensure non-negative
+        return [{
+            'date': date,
+            'revenue': float(revenue[i]),
+            'expenses': float(expenses[i]),
+            'profit': float(revenue[i] - expenses[i]),
+            'cash_flow': float(cash_flow[i]),
+            'method': 'ml_fallback'
+        } for i, date in enumerate(forecast['dates'])]
+    
+    def _add_prediction_intervals(self, predictions, forecast):
+        """Attach the forecast's prediction intervals to predictions of the same months"""
+        positions = {date: i for i, date in enumerate(forecast['dates'])}
+        for prediction in predictions:
+            i = positions.get(prediction.get('date'))
+            if i is None:
+                continue
+            prediction['intervals'] = {
+                metric: [float(forecast['lower'][row][i]), float(forecast['upper'][row][i])]
+                for row, metric in enumerate(FORECAST_METRICS)
+            }
     
     def _simple_trend_forecast(self, data):
         """Simple trend-based forecast as ultimate fallback"""
@@ -279,8 +240,12 @@ class AIPredictionService:
     
     def _build_prediction_prompt(self, data):
         """Build prompt for AI prediction"""
-        # Summarize recent trends
-        recent_data = data[-12:] if len(data) >= 12 else data
+        from material_ledger.material_ledger.services.prompt_budget import get_prompt_budget
+        
+        budget = get_prompt_budget()
+        
+        # Summarize recent trends; anything older than a year is reduced to summary statistics
+        older_data, recent_data = budget.compact_series(data, keep_last=12)
         
         revenue_trend = [d['revenue'] for d in recent_data]
         expenses_trend = [d['expenses'] for d in recent_data]
@@ -289,18 +254,28 @@ class AIPredictionService:
         for d in recent_data[-6:]:  # Last 6 months
             monthly_summary.append(f"📅 {d['date']}: الإيرادات {d['revenue']:,.0f}, المصروفات {d['expenses']:,.0f}, الربح {(d['revenue'] - d['expenses']):,.0f}")
         
-        prompt = f"""
+        header = """
 كمحلل مالي خبير، قم بالتنبؤ بالأداء المالي للأشهر الـ 12 القادمة بناء على البيانات التاريخية التالية:
-
-📊 **البيانات الحديثة:**
-{chr(10).join(monthly_summary)}
-
-📈 **الاتجاهات المكتشفة:**
+"""
+        
+        sections = [
+            f"""📊 **البيانات الحديثة:**
+{chr(10).join(monthly_summary)}""",
+            f"""📈 **الاتجاهات المكتشفة:**
 - متوسط الإيرادات الشهرية: {statistics.mean(revenue_trend):,.0f}
 - متوسط المصروفات الشهرية: {statistics.mean(expenses_trend):,.0f}
 - اتجاه النمو في الإيرادات: {self._calculate_trend(revenue_trend):+,.0f} شهرياً
-- اتجاه النمو في المصروفات: {self._calculate_trend(expenses_trend):+,.0f} شهرياً
-
+- اتجاه النمو في المصروفات: {self._calculate_trend(expenses_trend):+,.0f} شهرياً"""
+        ]
+        
+        if older_data:
+            older_revenue = budget.summarize_series([d['revenue'] for d in older_data])
+            older_expenses = budget.summarize_series([d['expenses'] for d in older_data])
+            sections.append(f"""🗂️ **التاريخ الأقدم ({older_revenue['count']} شهر):**
+- متوسط الإيرادات: {older_revenue['mean']:,.0f} (أدنى {older_revenue['min']:,.0f}، أعلى {older_revenue['max']:,.0f})
+- متوسط المصروفات: {older_expenses['mean']:,.0f} (أدنى {older_expenses['min']:,.0f}، أعلى {older_expenses['max']:,.0f})""")
+        
+        footer = """
 المطلوب:
 1. توقع الإيرادات والمصروفات لكل شهر من الأشهر الـ 12 القادمة
 2. تحليل المخاطر المحتملة
@@ -315,23 +290,24 @@ class AIPredictionService:
 
 قدم الرد بتنسيق JSON يحتوي على:
 ```json
-{{
+{
   "predictions": [
-    {{
+    {
       "date": "2026-04",
       "revenue": 150000,
       "expenses": 120000,
       "profit": 30000,
       "confidence": 85
-    }}
+    }
   ],
   "risks": ["..."],
   "opportunities": ["..."],
   "recommendations": ["..."]
-}}
+}
 ```
 """
-        return prompt
+        
+        return budget.compose(header, sections, footer)
     
     def _parse_ai_predictions(self, ai_response):
         """Parse AI response into structured predictions"""
@@ -348,45 +324,14 @@ class AIPredictionService:
         # If parsing fails, return empty predictions
         return []
     
-    def _predict_series(self, series, months_ahead):
-        """Predict future value using moving average and trend"""
-        if not series or len(series) < 3:
-            return 0
-            
-        # Use last 6 months for prediction
-        recent_series = series[-6:] if len(series) >= 6 else series
-        
-        # Moving average
-        moving_avg = statistics.mean(recent_series)
-        
-        # Trend calculation
-        trend = self._calculate_trend(recent_series)
-        
-        # Apply trend for future months
-        prediction = moving_avg + (trend * months_ahead)
-        
-        return max(0, prediction)  # Ensure non-negative
-    
     def _calculate_trend(self, series):
         """Calculate linear trend in a series"""
+        from material_ledger.material_ledger.services.forecast_engine import linear_trends
+        
         if len(series) < 2:
             return 0
-            
-        n = len(series)
-        x = list(range(n))
-        y = series
-        
-        # Linear regression coefficients
-        x_mean = statistics.mean(x)
-        y_mean = statistics.mean(y)
         
-        numerator = sum((x[i] - x_mean) * (y[i] - y_mean) for i in range(n))
-        denominator = sum((x[i] - x_mean) ** 2 for i in range(n))
-        
-        if denominator == 0:
-            return 0
-            
-        return numerator / denominator
+        return float(linear_trends([series])[0])
     
     def _add_months_to_date(self, date_str, months):
         """Add months to date string"""
@@ -417,16 +362,23 @@ class AIPredictionService:
         
         return max(30, int(base_confidence))
     
-    def _analyze_trends(self, data):
-        """Analyze trends in the data"""
+    def _analyze_trends(self, data, trends=None):
+        """
+        Analyze trends in the data
+        
+        Args:
+            data: Monthly financial data
+            trends: Fitted monthly change per FORECAST_METRICS series, when already computed
+        """
         if len(data) < 3:
             return {"trend": "insufficient_data"}
-            
-        revenue_series = [d['revenue'] for d in data]
-        expenses_series = [d['expenses'] for d in data]
         
-        revenue_trend = self._calculate_trend(revenue_series)
-        expenses_trend = self._calculate_trend(expenses_series)
+        if trends is None:
+            from material_ledger.material_ledger.services.forecast_engine import linear_trends
+            trends = linear_trends([[flt(d[metric]) for d in data] for metric in FORECAST_METRICS])
+        
+        revenue_trend = float(trends[0])
+        expenses_trend = float(trends[1])
         
         return {
             "revenue_trend": "increasing" if revenue_trend > 0 else "decreasing" if revenue_trend < 0 else "stable",
@@ -680,4 +632,4 @@ def start_financial_prediction(company, filters=None):
 def get_prediction_status(job_id):
     """API endpoint to get prediction job status"""
     from material_ledger.material_ledger.services.queue_service import get_ai_job_status
-    return get_ai_job_status(job_id)
\ No newline at end of file
+    return get_ai_job_status(job_id, include_result=1)
\ No newline at end of file
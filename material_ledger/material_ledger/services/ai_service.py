@@ -9,9 +9,11 @@ Handles all AI-related operations including report generation
 import frappe
 from frappe import _
 from frappe.utils import flt
-import requests
 import json
 
+from material_ledger.material_ledger.services.llm_providers import LLMProviderError, build_provider
+from material_ledger.material_ledger.services.prompt_budget import PromptBudget
+
 
 class AIService:
     """Service class for AI operations"""
@@ -21,6 +23,8 @@ class AIService:
         self.api_key = None
         self.provider = None
         self.model = None
+        self._llm_provider = None
+        self._llm_signature = None
         self._initialize()
     
     def _get_settings(self):
@@ -36,23 +40,41 @@ class AIService:
             }
     
     def _initialize(self):
-        """Initialize AI service with API key"""
+        """Initialize AI service with provider and API key"""
         if not self.settings.get("enable_ai_analysis"):
             return
         
+        self.provider = self.settings.get("ai_provider", "DeepSeek")
+        self.model = self.settings.get("ai_model", "deepseek-reasoner")
+        
         try:
             from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
-            self.api_key = MaterialLedgerSettings.get_api_key()
+            self.api_key = MaterialLedgerSettings.get_api_key(self.provider)
         except Exception:
             # Fallback to site config (but NOT hardcoded!)
             self.api_key = frappe.conf.get("deepseek_api_key")
+    
+    def get_provider(self):
+        """
+        Get the LLM provider for the current provider, model and API key
         
-        self.provider = self.settings.get("ai_provider", "DeepSeek")
-        self.model = self.settings.get("ai_model", "deepseek-reasoner")
+        Returns:
+            LLMProvider
+        """
+        signature = (self.provider, self.model, self.api_key)
+        if self._llm_provider is None or self._llm_signature != signature:
+            self._llm_provider = build_provider(self.provider, self.model, self.api_key, self.settings)
+            self._llm_signature = signature
+        return self._llm_provider
     
     def is_available(self):
         """Check if AI service is available"""
-        return bool(self.api_key and self.settings.get("enable_ai_analysis"))
+        if not self.settings.get("enable_ai_analysis"):
+            return False
+        try:
+            return self.get_provider().is_available()
+        except LLMProviderError:
+            return False
     
     def generate_financial_report(self, company, year, data):
         """
@@ -76,69 +98,45 @@ class AIService:
         prompt = self._build_financial_prompt(company, year, data)
         
         try:
-            if self.provider == "DeepSeek":
-                return self._call_deepseek(prompt)
-            elif self.provider == "OpenAI":
-                return self._call_openai(prompt)
-            else:
-                return _("AI provider not configured properly.")
+            result = self.get_provider().complete(prompt)
+            analysis = result["content"]
+            
+            if result.get("reasoning") and self.provider == "DeepSeek":
+                return f"**التحليل المتعمق:**\n\n{analysis}\n\n---\n*تم إنشاء هذا التحليل باستخدام نموذج التفكير المتقدم من DeepSeek*"
+            return analysis
         
         except Exception as e:
             frappe.log_error(f"AI Report Generation Error: {str(e)}", "Material Ledger AI")
             return _("AI analysis temporarily unavailable. Error: {0}").format(str(e))
     
-    def _call_deepseek(self, prompt):
-        """Call DeepSeek API"""
-        response = requests.post(
-            "https://api.deepseek.com/chat/completions",
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": self.model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.2,
-                "max_tokens": 4000
-            },
-            timeout=180
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            reasoning = result['choices'][0]['message'].get('reasoning_content', '')
-            analysis = result['choices'][0]['message']['content']
+    def complete(self, prompt, max_tokens=4000):
+        """
+        Run a completion on the configured provider
+        
+        Args:
+            prompt: Prompt text
+            max_tokens: Maximum tokens to generate
             
-            if reasoning:
-                return f"**التحليل المتعمق:**\n\n{analysis}\n\n---\n*تم إنشاء هذا التحليل باستخدام نموذج التفكير المتقدم من DeepSeek*"
-            return analysis
-        else:
-            frappe.log_error(f"DeepSeek API Error: {response.text}", "Material Ledger AI")
-            return _("AI analysis temporarily unavailable. Please try again later.")
+        Returns:
+            str: Response content
+            
+        Raises:
+            LLMProviderError: If the provider call fails
+        """
+        return self.get_provider().complete(prompt, max_tokens=max_tokens)["content"]
     
-    def _call_openai(self, prompt):
-        """Call OpenAI API"""
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": self.model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.2,
-                "max_tokens": 4000
-            },
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            frappe.log_error(f"OpenAI API Error: {response.text}", "Material Ledger AI")
-            return _("AI analysis temporarily unavailable. Please try again later.")
+    def stream_completion(self, prompt, max_tokens=2000):
+        """
+        Stream a chat completion from the configured provider
+        
+        Args:
+            prompt: Prompt text
+            max_tokens: Maximum tokens to generate
+            
+        Yields:
+            str: Content tokens as they arrive from the provider
+        """
+        return self.get_provider().stream(prompt, max_tokens=max_tokens)
     
     def _build_financial_prompt(self, company, year, data):
         """Build comprehensive prompt for financial analysis"""
@@ -157,48 +155,50 @@ class AIService:
         liabilities = data.get('liabilities', summary.get('liabilities', 0))
         equity = data.get('equity', summary.get('equity', 0))
         
-        prompt = f"""
+        budget = PromptBudget(self.provider)
+        
+        header = f"""
 أنت محلل مالي خبير متخصص في تحليل القوائم المالية للشركات. قم بتحليل البيانات المالية التالية لشركة {company} للفترة {period}:
-
-📊 **قائمة الدخل (Income Statement)**
+"""
+        
+        sections = [
+            f"""📊 **قائمة الدخل (Income Statement)**
 - إجمالي الإيرادات: {frappe.format(income, {'fieldtype': 'Currency'})}
 - إجمالي المصروفات: {frappe.format(expense, {'fieldtype': 'Currency'})}
 - صافي الربح/الخسارة: {frappe.format(net_profit, {'fieldtype': 'Currency'})}
 - هامش الربح الصافي: {ratios.get('net_margin', 0):.2f}%
-- هامش التشغيل: {ratios.get('operating_margin', 0):.2f}%
-
-📈 **قائمة المركز المالي (Balance Sheet)**
+- هامش التشغيل: {ratios.get('operating_margin', 0):.2f}%""",
+            f"""📈 **قائمة المركز المالي (Balance Sheet)**
 - إجمالي الأصول: {frappe.format(assets, {'fieldtype': 'Currency'})}
 - إجمالي الالتزامات: {frappe.format(liabilities, {'fieldtype': 'Currency'})}
 - حقوق الملكية: {frappe.format(equity, {'fieldtype': 'Currency'})}
-- نسبة الديون للأصول: {ratios.get('debt_ratio', 0):.2f}%
-
-💰 **قائمة التدفقات النقدية (Cash Flow Statement)**
+- نسبة الديون للأصول: {ratios.get('debt_ratio', 0):.2f}%""",
+            f"""💰 **قائمة التدفقات النقدية (Cash Flow Statement)**
 - التدفق النقدي التشغيلي: {frappe.format(cash_flow.get('operating', 0), {'fieldtype': 'Currency'})}
 - التدفق النقدي الاستثماري: {frappe.format(cash_flow.get('investing', 0), {'fieldtype': 'Currency'})}
 - التدفق النقدي التمويلي: {frappe.format(cash_flow.get('financing', 0), {'fieldtype': 'Currency'})}
-- صافي التدفق النقدي: {frappe.format(cash_flow.get('net', 0), {'fieldtype': 'Currency'})}
-
-📋 **قائمة التغيرات في حقوق الملكية**
+- صافي التدفق النقدي: {frappe.format(cash_flow.get('net', 0), {'fieldtype': 'Currency'})}""",
+            f"""📋 **قائمة التغيرات في حقوق الملكية**
 - الرصيد الافتتاحي: {frappe.format(equity_changes.get('opening_balance', 0), {'fieldtype': 'Currency'})}
 - صافي الربح: {frappe.format(equity_changes.get('net_profit', 0), {'fieldtype': 'Currency'})}
 - الإضافات الرأسمالية: {frappe.format(equity_changes.get('contributions', 0), {'fieldtype': 'Currency'})}
 - التوزيعات: {frappe.format(equity_changes.get('dividends', 0), {'fieldtype': 'Currency'})}
-- الرصيد الختامي: {frappe.format(equity_changes.get('closing_balance', 0), {'fieldtype': 'Currency'})}
-
-📊 **النسب المالية الرئيسية**
+- الرصيد الختامي: {frappe.format(equity_changes.get('closing_balance', 0), {'fieldtype': 'Currency'})}""",
+            f"""📊 **النسب المالية الرئيسية**
 - العائد على حقوق الملكية (ROE): {ratios.get('roe', 0):.2f}%
 - العائد على الأصول (ROA): {ratios.get('roa', 0):.2f}%
 - النسبة الجارية: {ratios.get('current_ratio', 0):.2f}
 - نسبة السيولة السريعة: {ratios.get('quick_ratio', 0):.2f}
 - معدل دوران الأصول: {ratios.get('asset_turnover', 0):.2f}
 - مضاعف حقوق الملكية: {ratios.get('leverage', 0):.2f}
-- Z-Score: {ratios.get('z_score', 0):.2f} {"(آمن)" if ratios.get('z_score', 0) > 2.9 else "(منطقة رمادية)" if ratios.get('z_score', 0) > 1.8 else "(خطر إفلاس)"}
-
-📅 **التحليل الدوري**
+- Z-Score: {ratios.get('z_score', 0):.2f} {"(آمن)" if ratios.get('z_score', 0) > 2.9 else "(منطقة رمادية)" if ratios.get('z_score', 0) > 1.8 else "(خطر إفلاس)"}""",
+            f"""📅 **التحليل الدوري**
 {f"البيانات الشهرية: {len(monthly)} شهر" if monthly else ""}
-{f"البيانات الربعية: {len(quarterly)} ربع" if quarterly else ""}
-
+{f"البيانات الربعية: {len(quarterly)} ربع" if quarterly else ""}""",
+            self._build_monthly_section(budget, monthly)
+        ]
+        
+        footer = f"""
 قم بإجراء تحليل شامل ومفصل يتضمن:
 
 1. **تحليل قائمة الدخل**: قم بتحليل الربحية، هامش الأرباح، كفاءة التكاليف، ومصادر الإيرادات
@@ -219,7 +219,33 @@ class AIService:
 
 استخدم تفكيرك العميق (reasoning) لتقديم رؤى ثاقبة وتحليل متعمق.
 """
+        
+        prompt = budget.compose(header, sections, footer)
         return prompt
+    
+    def _build_monthly_section(self, budget, monthly, keep_last=6):
+        """Compact monthly breakdown: older months summarized, recent months verbatim"""
+        if not monthly:
+            return ""
+        
+        older, recent = budget.compact_series(monthly, keep_last=keep_last)
+        lines = ["📆 **الأداء الشهري**"]
+        
+        if older:
+            profit = budget.summarize_series([m.get('profit', 0) for m in older])
+            income = budget.summarize_series([m.get('inc', 0) for m in older])
+            lines.append(
+                f"- الأشهر السابقة ({profit['count']} شهر): متوسط الإيرادات {income['mean']:,.0f}, "
+                f"متوسط الربح {profit['mean']:,.0f} (أدنى {profit['min']:,.0f}، أعلى {profit['max']:,.0f})"
+            )
+        
+        for m in recent:
+            lines.append(
+                f"- {m.get('month_name') or m.get('month')}: الإيرادات {flt(m.get('inc')):,.0f}, "
+                f"المصروفات {flt(m.get('exp')):,.0f}, الربح {flt(m.get('profit')):,.0f}"
+            )
+        
+        return "\n".join(lines)
 
 
 # Singleton instance
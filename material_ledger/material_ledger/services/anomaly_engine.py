@@ -0,0 +1,498 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Columnar Anomaly Engine
+Vectorized NumPy versions of the statistical anomaly detectors; transactions
+are loaded into arrays once and every detector works on grouped array operations
+"""
+
+from frappe.utils import get_datetime
+import numpy as np
+import time
+
+from material_ledger.material_ledger.services.anomaly_state import BENFORD_EXPECTED, BENFORD_CRITICAL, RunningStats
+
+
+MAX_CLUSTER_MEMBERS = 50  # Entry names listed per duplicate cluster record
+
+
+def factorize(values):
+    """
+    Encode values as integer codes numbered in order of first appearance
+
+    Returns:
+        tuple: (codes array, list of distinct values)
+    """
+    index = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values), dtype=np.int64, count=len(values))
+    return codes, list(index)
+
+
+def grouped_stats(codes, values, groups):
+    """
+    Per-group count, mean and sample standard deviation (two-pass, like statistics.stdev)
+
+    Returns:
+        tuple: (counts, means, stdevs) arrays indexed by group code
+    """
+    counts = np.bincount(codes, minlength=groups)
+    means = np.bincount(codes, weights=values, minlength=groups) / np.maximum(counts, 1)
+    deviations = values - means[codes]
+    squares = np.bincount(codes, weights=deviations * deviations, minlength=groups)
+    stdevs = np.sqrt(np.divide(squares, counts - 1, out=np.zeros(groups), where=counts > 1))
+    return counts, means, stdevs
+
+
+def first_digits(amounts):
+    """
+    Leading digit of the integer part of each positive amount, like int(str(int(amount))[0])
+
+    Amounts below 1 have leading digit 0.
+    """
+    integers = amounts.astype(np.int64)
+    digits = np.zeros(len(integers), dtype=np.int64)
+    whole = integers >= 1
+    if whole.any():
+        values = integers[whole]
+        powers = 10 ** np.floor(np.log10(values)).astype(np.int64)
+        # Correct the rare powers that log10 rounding put one decade off
+        powers = np.where(values // powers >= 10, powers * 10, powers)
+        powers = np.where(values < powers, powers // 10, powers)
+        digits[whole] = values // powers
+    return digits
+
+
+def _read_amounts(data):
+    return np.fromiter((float(entry['abs_amount'] or 0) for entry in data), dtype=float, count=len(data))
+
+
+class AnomalyBaseline:
+    """
+    Per-account and per-user amount statistics over a whole dataset
+
+    Pass one of two-pass scoring: built once over every row, then each chunk
+    is scored against it, so a row's score does not depend on which chunk it
+    lands in and chunks can be scored in any order. Baselines of disjoint
+    rows merge into the baseline of all rows.
+    """
+
+    def __init__(self, accounts=None, users=None):
+        self.accounts = accounts or {}
+        self.users = users or {}
+
+    @classmethod
+    def from_data(cls, data):
+        amounts = _read_amounts(data)
+        return cls(
+            accounts=cls._group(amounts, [entry['account'] for entry in data]),
+            users=cls._group(amounts, [entry['owner'] for entry in data])
+        )
+
+    @staticmethod
+    def _group(amounts, keys):
+        codes, distinct = factorize(keys)
+        counts, means, stdevs = grouped_stats(codes, amounts, len(distinct))
+        squares = stdevs ** 2 * np.maximum(counts - 1, 0)
+        return {
+            key: RunningStats(int(counts[code]), float(means[code]), float(squares[code]))
+            for code, key in enumerate(distinct)
+        }
+
+    def merge(self, other):
+        for mine, theirs in ((self.accounts, other.accounts), (self.users, other.users)):
+            for key, stats in theirs.items():
+                mine.setdefault(key, RunningStats()).merge(RunningStats(stats.count, stats.mean, stats.m2))
+        return self
+
+    def stats(self, scope, keys):
+        """
+        Count, mean and sample standard deviation arrays for the given keys
+
+        Args:
+            scope: "accounts" or "users"
+            keys: Group keys, in group code order
+        """
+        groups = getattr(self, scope)
+        stats = [groups.get(key) or RunningStats() for key in keys]
+        return (
+            np.array([entry.count for entry in stats], dtype=np.int64),
+            np.array([entry.mean for entry in stats], dtype=float),
+            np.array([entry.stdev for entry in stats], dtype=float)
+        )
+
+
+class AnomalyEngine:
+    """
+    Statistical anomaly detectors over one set of transactions
+
+    Without a baseline it produces the same records, in the same order, as
+    the loop detectors in AIAnomalyService (which compute account and user
+    statistics from the rows at hand); floating-point fields (z-scores,
+    means) agree to rounding error, since the loop versions use exact
+    `statistics` sums. With an AnomalyBaseline, amounts are scored against
+    its dataset-wide account and user statistics instead.
+    """
+
+    def __init__(self, data, baseline=None):
+        self.data = data
+        self.baseline = baseline
+        self.amounts = _read_amounts(data)
+        self.account_codes, self.accounts = factorize([entry['account'] for entry in data])
+        self.user_codes, self.users = factorize([entry['owner'] for entry in data])
+
+    def _group_stats(self, scope, codes, keys):
+        if self.baseline is not None:
+            return self.baseline.stats(scope, keys)
+        return grouped_stats(codes, self.amounts, len(keys))
+
+    def _in_group_order(self, indices, codes):
+        """Order indices by group (first appearance) and then by position"""
+        return indices[np.lexsort((indices, codes[indices]))]
+
+    def amount_anomalies(self, threshold=2.5, high_threshold=3.0):
+        """Amounts far from their account's mean (see _detect_amount_anomalies)"""
+        counts, means, stdevs = self._group_stats("accounts", self.account_codes, self.accounts)
+        valid = (counts >= 5) & (stdevs > 0)
+
+        row_valid = valid[self.account_codes]
+        z_scores = np.zeros(len(self.amounts))
+        codes = self.account_codes[row_valid]
+        z_scores[row_valid] = np.abs((self.amounts[row_valid] - means[codes]) / stdevs[codes])
+
+        anomalies = []
+        for i in self._in_group_order(np.flatnonzero(z_scores > threshold), self.account_codes):
+            entry = self.data[i]
+            code = self.account_codes[i]
+            mean, stdev, z_score = float(means[code]), float(stdevs[code]), float(z_scores[i])
+            anomalies.append({
+                'type': 'unusual_amount',
+                'severity': "high" if z_score > high_threshold else "medium",
+                'entry_name': entry['name'],
+                'account': self.accounts[code],
+                'amount': entry['abs_amount'],
+                'expected_range': f"{mean - 2*stdev:.0f} - {mean + 2*stdev:.0f}",
+                'z_score': z_score,
+                'posting_date': entry['posting_date'],
+                'description': f"مبلغ غير عادي: {entry['abs_amount']:,.0f} (متوسط الحساب: {mean:,.0f})",
+                'details': entry
+            })
+        return anomalies
+
+    def pattern_anomalies(self):
+        """Round-amount and identical-amount patterns (see _detect_pattern_anomalies)"""
+        anomalies = []
+        amounts = self.amounts
+
+        round_rows = np.flatnonzero((amounts % 1000 == 0) & (amounts > 10000))
+        if len(round_rows) > len(amounts) * 0.3:
+            for i in round_rows[-5:]:
+                entry = self.data[i]
+                anomalies.append({
+                    'type': 'round_amount_pattern',
+                    'severity': 'medium',
+                    'entry_name': entry['name'],
+                    'amount': entry['abs_amount'],
+                    'description': f"نمط مبالغ مدورة مشبوه: {entry['abs_amount']:,.0f}",
+                    'details': entry
+                })
+
+        if not len(amounts):
+            return anomalies
+
+        values, first_index, codes, counts = np.unique(
+            amounts, return_index=True, return_inverse=True, return_counts=True
+        )
+        eligible = np.flatnonzero((counts >= 5) & (values > 1000))
+        if not len(eligible):
+            return anomalies
+
+        # Rows grouped by amount, in position order within each group
+        order = np.lexsort((np.arange(len(amounts)), codes))
+        ends = np.cumsum(counts)
+
+        for group in eligible[np.argsort(first_index[eligible], kind="stable")]:
+            amount = self.data[first_index[group]]['abs_amount']
+            count = int(counts[group])
+            for i in order[ends[group] - 3:ends[group]]:
+                entry = self.data[i]
+                anomalies.append({
+                    'type': 'identical_amounts',
+                    'severity': 'medium',
+                    'entry_name': entry['name'],
+                    'amount': amount,
+                    'count': count,
+                    'description': f"مبلغ متكرر مشبوه: {amount:,.0f} ({count} مرات)",
+                    'details': entry
+                })
+        return anomalies
+
+    def user_anomalies(self, threshold=2.5):
+        """Amounts far above the posting user's mean (see _detect_user_behavior_anomalies)"""
+        counts, means, stdevs = self._group_stats("users", self.user_codes, self.users)
+        valid = (counts >= 3) & (stdevs > 0)
+
+        row_valid = valid[self.user_codes]
+        z_scores = np.zeros(len(self.amounts))
+        codes = self.user_codes[row_valid]
+        z_scores[row_valid] = (self.amounts[row_valid] - means[codes]) / stdevs[codes]
+
+        anomalies = []
+        for i in self._in_group_order(np.flatnonzero(z_scores > threshold), self.user_codes):
+            entry = self.data[i]
+            user = self.users[self.user_codes[i]]
+            mean = float(means[self.user_codes[i]])
+            anomalies.append({
+                'type': 'unusual_user_amount',
+                'severity': 'medium',
+                'entry_name': entry['name'],
+                'user': user,
+                'amount': entry['abs_amount'],
+                'user_avg': mean,
+                'z_score': float(z_scores[i]),
+                'description': f"مبلغ غير عادي للمستخدم {user}: {entry['abs_amount']:,.0f} (متوسطه: {mean:,.0f})",
+                'details': entry
+            })
+        return anomalies
+
+    def _timestamps(self):
+        """Creation time of each row in epoch seconds (posting date when missing)"""
+        return np.fromiter(
+            (get_datetime(entry.get('creation') or entry['posting_date']).timestamp() for entry in self.data),
+            dtype=float, count=len(self.data)
+        )
+
+    def duplicate_anomalies(self, time_window=3600, amount_tolerance=0.01):
+        """
+        Duplicate and near-duplicate clusters, one record per cluster
+
+        Exact duplicates share the canonical key (account, voucher type,
+        posting date, amount, party) and are found by hashing it. Near
+        duplicates share account, voucher type and party, with amounts within
+        `amount_tolerance` (relative) of each other and created within
+        `time_window` seconds: rows are sorted by amount within each group and
+        chained into amount runs, then each run is sorted by time and chained
+        into time runs; a run with more than one canonical key is a cluster.
+        """
+        anomalies = []
+        if len(self.data) < 2:
+            return anomalies
+
+        rounded = np.round(self.amounts, 2)
+        exact_codes, exact_keys = factorize([
+            (entry['account'], entry.get('voucher_type'), entry['posting_date'], float(amount), entry.get('party'))
+            for entry, amount in zip(self.data, rounded, strict=True)
+        ])
+        exact_counts = np.bincount(exact_codes, minlength=len(exact_keys))
+
+        # Rows grouped by canonical key, in position order within each key
+        by_key = np.argsort(exact_codes, kind="stable")
+        ends = np.cumsum(exact_counts)
+        for code in np.flatnonzero(exact_counts >= 2):
+            members = by_key[ends[code] - exact_counts[code]:ends[code]]
+            anomalies.append(self._cluster_record('potential_duplicate', members))
+
+        group_codes, _ = factorize([
+            (entry['account'], entry.get('voucher_type'), entry.get('party')) for entry in self.data
+        ])
+        timestamps = self._timestamps()
+
+        # Amount runs: consecutive amounts (per group) within the tolerance of each other
+        order = np.lexsort((rounded, group_codes))
+        amounts = rounded[order]
+        linked = (group_codes[order][1:] == group_codes[order][:-1]) & (
+            np.abs(np.diff(amounts)) <= amount_tolerance * np.maximum(amounts[1:], amounts[:-1])
+        )
+        amount_runs = np.empty(len(order), dtype=np.int64)
+        amount_runs[order] = np.concatenate(([0], np.cumsum(~linked)))
+
+        # Time runs within each amount run
+        order = np.lexsort((timestamps, amount_runs))
+        linked = (amount_runs[order][1:] == amount_runs[order][:-1]) & (np.diff(timestamps[order]) <= time_window)
+        runs = np.empty(len(order), dtype=np.int64)
+        runs[order] = np.concatenate(([0], np.cumsum(~linked)))
+
+        run_sizes = np.bincount(runs)
+
+        # Runs holding a single canonical key are already reported as exact duplicates
+        rows = np.flatnonzero(run_sizes[runs] >= 2)
+        keys_per_run = {}
+        for i in rows:
+            keys_per_run.setdefault(runs[i], set()).add(exact_codes[i])
+        members_of = {}
+        for i in rows:
+            if len(keys_per_run[runs[i]]) > 1:
+                members_of.setdefault(runs[i], []).append(i)
+
+        for members in members_of.values():
+            anomalies.append(self._cluster_record('near_duplicate', members, time_window))
+        return anomalies
+
+    def rapid_sequence_anomalies(self, min_postings=2, window=60, amount_tolerance=100):
+        """
+        Bursts of postings by one user to one account with similar amounts
+
+        Rows are grouped by (owner, account) and chained into runs of amounts
+        less than `amount_tolerance` apart. Within each run, sorted by creation
+        time, a window starting at every row is closed with a binary search;
+        windows of `window` seconds holding at least `min_postings` rows mark
+        their rows, and each stretch of marked rows is one burst. O(n log n).
+        """
+        anomalies = []
+        if len(self.data) < min_postings:
+            return anomalies
+
+        group_codes, _ = factorize([(entry['owner'], entry['account']) for entry in self.data])
+        timestamps = self._timestamps()
+
+        order = np.lexsort((self.amounts, group_codes))
+        amounts = self.amounts[order]
+        linked = (group_codes[order][1:] == group_codes[order][:-1]) & (np.abs(np.diff(amounts)) < amount_tolerance)
+        runs = np.empty(len(order), dtype=np.int64)
+        runs[order] = np.concatenate(([0], np.cumsum(~linked)))
+
+        # Offset each run's times past the previous run's so one sorted array serves every run
+        order = np.lexsort((timestamps, runs))
+        times = timestamps[order] - timestamps.min()
+        span = times.max() + window + 1
+        times = times + runs[order] * span
+
+        ends = np.searchsorted(times, times + window, side="right")
+        starts = np.flatnonzero(ends - np.arange(len(times)) >= min_postings)
+        if not len(starts):
+            return anomalies
+
+        # Mark every row inside a qualifying window
+        cover = np.zeros(len(times) + 1, dtype=np.int64)
+        np.add.at(cover, starts, 1)
+        np.add.at(cover, ends[starts], -1)
+        marked = np.cumsum(cover[:-1]) > 0
+
+        # Marked rows chained by gaps within the window form one burst
+        positions = np.flatnonzero(marked)
+        breaks = np.flatnonzero(np.diff(times[positions]) > window) + 1
+        bursts = sorted((sorted(order[burst]), burst) for burst in np.split(positions, breaks))
+        for members, burst in bursts:
+            first, second = self.data[members[0]], self.data[members[1]]
+            gap = float(timestamps[order[burst[-1]]] - timestamps[order[burst[0]]])
+            anomalies.append({
+                'type': 'rapid_sequence',
+                'severity': 'high',
+                'entry_name': first['name'],
+                'related_entry': second['name'],
+                'members': [self.data[i]['name'] for i in members[:MAX_CLUSTER_MEMBERS]],
+                'member_count': len(members),
+                'user': first['owner'],
+                'account': first['account'],
+                'amount': first['abs_amount'],
+                'time_gap': gap,
+                'description': f"معاملات متتابعة سريعة: {len(members)} قيود خلال {gap:.0f} ثانية",
+                'details': first
+            })
+        return anomalies
+
+    def _cluster_record(self, anomaly_type, members, time_window=None):
+        """Build the record of one duplicate cluster from its member rows, in position order"""
+        first = self.data[members[0]]
+        names = [self.data[i]['name'] for i in members]
+        amount = first['abs_amount']
+
+        record = {
+            'type': anomaly_type,
+            'severity': 'high' if anomaly_type == 'potential_duplicate' else 'medium',
+            'entry_name': names[0],
+            'related_entry': names[1],
+            'members': names[:MAX_CLUSTER_MEMBERS],
+            'member_count': len(names),
+            'account': first['account'],
+            'amount': amount,
+            'posting_date': first['posting_date'],
+            'details': first
+        }
+        if anomaly_type == 'potential_duplicate':
+            record['description'] = f"معاملة مكررة محتملة: {amount:,.0f} ({len(names)} قيود)"
+        else:
+            low, high = self.amounts[members].min(), self.amounts[members].max()
+            record['amount_range'] = f"{low:,.0f} - {high:,.0f}"
+            record['description'] = (
+                f"معاملات شبه مكررة: {len(names)} قيود بمبالغ {low:,.0f} - {high:,.0f} "
+                f"خلال {time_window // 60} دقيقة"
+            )
+        return record
+
+    def benford_anomalies(self):
+        """Benford's law first-digit test (see _detect_benford_anomalies)"""
+        if len(self.amounts) < 10:
+            return []
+
+        positive = self.amounts[self.amounts > 0]
+        if len(positive) <= 50:
+            return []
+
+        histogram = np.bincount(first_digits(positive), minlength=10)
+        total = len(positive)
+        chi_square = sum(
+            ((int(histogram[digit]) / total) * 100 - expected) ** 2 / expected
+            for digit, expected in zip(range(1, 10), BENFORD_EXPECTED, strict=True)
+        )
+
+        if chi_square <= BENFORD_CRITICAL:
+            return []
+        return [{
+            'type': 'benford_law_violation',
+            'severity': 'high',
+            'chi_square': chi_square,
+            'description': f"انتهاك قانون بنفورد (مؤشر احتيال محتمل) - قيمة كاي تربيع: {chi_square:.2f}",
+            'recommendation': "فحص شامل للمعاملات المالية - قد يدل على تلاعب في الأرقام"
+        }]
+
+
+def benchmark(rows=20000, accounts=200, users=20, seed=7):
+    """
+    Time the engine against the loop detectors on synthetic transactions
+
+    Run with: bench --site <site> execute material_ledger.material_ledger.services.anomaly_engine.benchmark
+
+    Returns:
+        dict: Seconds per implementation, speedup and whether both produced the same findings
+    """
+    from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+
+    rng = np.random.default_rng(seed)
+    amounts = np.round(rng.lognormal(7, 1.5, rows), 2)
+    amounts[rng.random(rows) < 0.05] = 5000  # Recurring amounts
+    data = [{
+        'name': f"GLE-{i}",
+        'account': f"Account {rng.integers(accounts)}",
+        'owner': f"user{rng.integers(users)}@example.com",
+        'abs_amount': float(amounts[i]),
+        'posting_date': "2026-01-01"
+    } for i in range(rows)]
+
+    service = AIAnomalyService()
+
+    started = time.perf_counter()
+    loops = (
+        service._detect_amount_anomalies(data) + service._detect_pattern_anomalies(data)
+        + service._detect_user_behavior_anomalies(data) + service._detect_benford_anomalies(data)
+    )
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    engine = AnomalyEngine(data)
+    vectorized = (
+        engine.amount_anomalies(service.anomaly_threshold, service.high_risk_threshold)
+        + engine.pattern_anomalies() + engine.user_anomalies() + engine.benford_anomalies()
+    )
+    engine_seconds = time.perf_counter() - started
+
+    def findings(anomalies):
+        return [(a['type'], a.get('entry_name')) for a in anomalies]
+
+    return {
+        "rows": rows,
+        "loop_seconds": round(loop_seconds, 4),
+        "engine_seconds": round(engine_seconds, 4),
+        "speedup": round(loop_seconds / engine_seconds, 1) if engine_seconds else None,
+        "identical": findings(loops) == findings(vectorized)
+    }
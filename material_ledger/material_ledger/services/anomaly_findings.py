@@ -0,0 +1,144 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Anomaly Findings
+Anomalies of a detection job stored as AI Anomaly Finding rows, so reports
+are read a page at a time instead of as one JSON blob
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, flt, now, today
+import json
+
+
+# Keys stored in their own columns, and the source row, which is referenced through gl_entry instead
+COLUMN_KEYS = {
+    "type", "severity", "entry_name", "account", "amount", "posting_date",
+    "description", "priority_score", "z_score", "score", "details"
+}
+FINDING_FILTERS = ("anomaly_type", "severity", "account", "gl_entry")  # Filterable by value
+FINDING_FIELDS = [
+    "name", "anomaly_type", "severity", "gl_entry", "account", "posting_date",
+    "amount", "score", "priority_score", "description", "info"
+]
+INSERT_BATCH = 5000  # Rows per bulk insert statement
+MAX_PAGE_LENGTH = 500
+RETENTION_DAYS = 90  # Days job and real-time findings are kept
+
+
+def _finding_row(job_id, company, index, anomaly, timestamp):
+    score = anomaly.get("z_score", anomaly.get("score"))
+    info = {key: value for key, value in anomaly.items() if key not in COLUMN_KEYS}
+
+    return (
+        f"{job_id}-{index:06d}", timestamp, timestamp, "Administrator", "Administrator",
+        job_id, company, anomaly["type"], anomaly.get("severity", "medium"), "Job",
+        anomaly.get("entry_name"), anomaly.get("account"), anomaly.get("posting_date") or None,
+        flt(anomaly.get("amount")), flt(score) if score is not None else None,
+        cint(anomaly.get("priority_score")), anomaly.get("description"),
+        json.dumps(info, default=str) if info else None
+    )
+
+
+def save_findings(job_id, company, anomalies):
+    """
+    Replace the findings of a job with its anomalies, in report order
+
+    Each finding references its GL Entry by name; the transaction row an
+    anomaly was built from (its `details`) is not stored.
+    """
+    timestamp = now()
+    rows = [_finding_row(job_id, company, index, anomaly, timestamp) for index, anomaly in enumerate(anomalies)]
+
+    frappe.db.delete("AI Anomaly Finding", {"job": job_id})
+    for start in range(0, len(rows), INSERT_BATCH):
+        frappe.db.bulk_insert(
+            "AI Anomaly Finding",
+            fields=["name", "creation", "modified", "owner", "modified_by", "job", "company",
+                    "anomaly_type", "severity", "source", "gl_entry", "account", "posting_date",
+                    "amount", "score", "priority_score", "description", "info"],
+            values=rows[start:start + INSERT_BATCH]
+        )
+
+
+def purge_old_findings():
+    """Scheduler: delete job and real-time findings older than RETENTION_DAYS"""
+    frappe.db.delete("AI Anomaly Finding", {"creation": ["<", add_days(today(), -RETENTION_DAYS)]})
+
+
+def _build_filters(job_id, filters):
+    conditions = {"job": job_id}
+    for field in FINDING_FILTERS:
+        if filters.get(field):
+            conditions[field] = filters[field]
+
+    if filters.get("from_date") and filters.get("to_date"):
+        conditions["posting_date"] = ["between", [filters["from_date"], filters["to_date"]]]
+    elif filters.get("from_date"):
+        conditions["posting_date"] = [">=", filters["from_date"]]
+    elif filters.get("to_date"):
+        conditions["posting_date"] = ["<=", filters["to_date"]]
+
+    return conditions
+
+
+# API Endpoints
+@frappe.whitelist()
+def get_anomaly_findings(job_id, filters=None, page=1, page_length=50):
+    """
+    API endpoint to get one page of a detection job's findings
+
+    Findings are ordered by priority, as in the report. Filters may hold
+    anomaly_type, severity, account, gl_entry, from_date and to_date; the
+    counts cover every finding that matches them, not just the page.
+    """
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+
+    page = max(cint(page), 1)
+    page_length = min(max(cint(page_length), 1), MAX_PAGE_LENGTH)
+    conditions = _build_filters(job_id, filters or {})
+
+    findings = frappe.get_list(
+        "AI Anomaly Finding",
+        filters=conditions,
+        fields=FINDING_FIELDS,
+        order_by="priority_score desc, name asc",
+        limit_start=(page - 1) * page_length,
+        limit_page_length=page_length
+    )
+    for finding in findings:
+        finding.info = json.loads(finding.info) if finding.info else {}
+
+    by_severity = frappe.get_list(
+        "AI Anomaly Finding",
+        filters=conditions,
+        fields=["severity", "count(name) as count"],
+        group_by="severity",
+        order_by="severity asc"
+    )
+    counts = {row.severity: row.count for row in by_severity}
+
+    return {
+        "findings": findings,
+        "total": sum(counts.values()),
+        "by_severity": counts,
+        "page": page,
+        "page_length": page_length
+    }
+
+
+@frappe.whitelist()
+def get_finding_source(finding):
+    """API endpoint to get the GL Entry a finding references"""
+    frappe.has_permission("AI Anomaly Finding", "read", finding, throw=True)
+
+    gl_entry = frappe.db.get_value("AI Anomaly Finding", finding, "gl_entry")
+    if not gl_entry:
+        frappe.throw(_("This finding does not reference a GL Entry"))
+
+    doc = frappe.get_doc("GL Entry", gl_entry)
+    doc.check_permission("read")
+    return doc.as_dict()
@@ -0,0 +1,245 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Local Anomaly Model
+Per-company IsolationForest over engineered GL Entry features, kept as
+versioned AI Anomaly Model rows and scored without any AI provider call
+"""
+
+import frappe
+from frappe.utils import add_days, cint, now, today
+import numpy as np
+import pickle
+
+try:
+    from sklearn.ensemble import IsolationForest
+    HAS_SKLEARN = True
+except ImportError:
+    HAS_SKLEARN = False
+
+
+FEATURE_VERSION = 1  # Bump when AnomalyModel.features changes; models of other versions are not loaded
+FEATURES = [
+    "log_amount", "account_amount_deviation", "creation_hour", "day_of_week", "is_weekend",
+    "is_after_hours", "is_round_amount", "is_opening", "account_rarity", "user_account_rarity"
+]
+TRAINING_DAYS = 365  # Posting days of history a model is trained on
+MIN_TRAINING_ROWS = 500
+MAX_TRAINING_ROWS = 200000  # Larger histories are sampled down to this
+OUTLIER_QUANTILE = 0.99  # Training score quantile above which an entry is an outlier
+TOP_K = 20  # Outliers reported, and explained by the AI provider, per run
+KEEP_VERSIONS = 3  # Model versions kept per company
+
+_loaded = {}  # AI Anomaly Model name -> AnomalyModel, per worker process
+
+
+class AnomalyModel:
+    """
+    Trained IsolationForest plus the encodings its features were built with
+
+    Account and user encodings are frozen at training time, so an entry
+    scores the same whichever batch it arrives in; accounts and user/account
+    pairs unseen in training count as maximally rare, and amounts on unseen
+    accounts are compared with the mean of all accounts.
+    """
+
+    def __init__(self, account_log_means, account_shares, pair_shares, total, log_mean):
+        self.account_log_means = account_log_means
+        self.account_shares = account_shares
+        self.pair_shares = pair_shares
+        self.total = total
+        self.log_mean = log_mean
+        self.forest = None
+        self.threshold = None
+        self.feature_version = FEATURE_VERSION
+
+    @classmethod
+    def fit(cls, data, seed=0):
+        amounts = np.log1p(np.fromiter((float(entry['abs_amount'] or 0) for entry in data), dtype=float, count=len(data)))
+
+        sums, counts, pairs = {}, {}, {}
+        for entry, amount in zip(data, amounts, strict=True):
+            account = entry['account']
+            sums[account] = sums.get(account, 0.0) + amount
+            counts[account] = counts.get(account, 0) + 1
+            pair = (entry['owner'], account)
+            pairs[pair] = pairs.get(pair, 0) + 1
+
+        total = len(data)
+        model = cls(
+            account_log_means={account: sums[account] / counts[account] for account in counts},
+            account_shares={account: count / total for account, count in counts.items()},
+            pair_shares={pair: count / total for pair, count in pairs.items()},
+            total=total,
+            log_mean=float(amounts.mean()) if total else 0.0
+        )
+
+        features = model.features(data)
+        model.forest = IsolationForest(n_estimators=100, random_state=seed).fit(features)
+        model.threshold = float(np.quantile(model.score_features(features), OUTLIER_QUANTILE))
+        return model
+
+    def features(self, data):
+        """Feature matrix (one row per entry, columns as FEATURES)"""
+        amounts = np.fromiter((float(entry['abs_amount'] or 0) for entry in data), dtype=float, count=len(data))
+        log_amounts = np.log1p(amounts)
+        unseen = 1 / (self.total + 1)
+
+        account_means = np.array([
+            self.account_log_means.get(entry['account'], self.log_mean) for entry in data
+        ], dtype=float)
+        account_shares = np.array([self.account_shares.get(entry['account'], unseen) for entry in data], dtype=float)
+        pair_shares = np.array([
+            self.pair_shares.get((entry['owner'], entry['account']), unseen) for entry in data
+        ], dtype=float)
+
+        return np.column_stack([
+            log_amounts,
+            log_amounts - account_means,
+            [cint(entry.get('creation_hour')) for entry in data],
+            [cint(entry.get('day_of_week')) for entry in data],
+            [1.0 if entry.get('is_weekend') else 0.0 for entry in data],
+            [1.0 if entry.get('is_after_hours') else 0.0 for entry in data],
+            (amounts >= 1000) & (amounts % 1000 == 0),
+            [1.0 if entry.get('is_opening') == "Yes" else 0.0 for entry in data],
+            -np.log(account_shares),
+            -np.log(pair_shares)
+        ]).astype(float)
+
+    def score_features(self, features):
+        """Outlier scores of a feature matrix; higher is more anomalous"""
+        return -self.forest.score_samples(features)
+
+    def score(self, data):
+        """Outlier scores of entries, in entry order"""
+        if not data:
+            return np.zeros(0)
+        return self.score_features(self.features(data))
+
+    def top_outliers(self, data, k=TOP_K):
+        """
+        The k highest-scoring entries above the training threshold
+
+        Returns:
+            list: (entry index, score) pairs, highest score first
+        """
+        scores = self.score(data)
+        ranked = np.argsort(-scores, kind="stable")[:k]
+        return [(int(i), float(scores[i])) for i in ranked if scores[i] > self.threshold]
+
+
+def save_model(company, model, training_rows):
+    """
+    Store a trained model as the company's new active version
+
+    The pickled model is a private File attached to its AI Anomaly Model row;
+    earlier versions are archived and only the last KEEP_VERSIONS are kept.
+    """
+    latest = frappe.db.sql(
+        "SELECT MAX(version) FROM `tabAI Anomaly Model` WHERE company = %s", company
+    )
+    version = cint(latest[0][0] if latest else 0) + 1
+
+    doc = frappe.get_doc({
+        "doctype": "AI Anomaly Model",
+        "company": company,
+        "version": version,
+        "status": "Active",
+        "feature_version": model.feature_version,
+        "trained_at": now(),
+        "training_rows": training_rows,
+        "threshold": model.threshold
+    })
+    doc.insert(ignore_permissions=True)
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": f"anomaly-model-{doc.name}.pkl",
+        "attached_to_doctype": "AI Anomaly Model",
+        "attached_to_name": doc.name,
+        "attached_to_field": "model_file",
+        "is_private": 1,
+        "content": pickle.dumps(model)
+    })
+    file_doc.insert(ignore_permissions=True)
+    doc.db_set("model_file", file_doc.file_url)
+
+    older = frappe.get_all(
+        "AI Anomaly Model",
+        filters={"company": company, "name": ["!=", doc.name]},
+        fields=["name", "status"],
+        order_by="version desc"
+    )
+    for index, row in enumerate(older):
+        if index + 1 >= KEEP_VERSIONS:
+            frappe.delete_doc("AI Anomaly Model", row.name, ignore_permissions=True, force=True)
+        elif row.status == "Active":
+            frappe.db.set_value("AI Anomaly Model", row.name, "status", "Archived")
+
+    return doc.name
+
+
+def load_active_model(company):
+    """Get the company's active model of the current feature version, or None"""
+    rows = frappe.get_all(
+        "AI Anomaly Model",
+        filters={"company": company, "status": "Active", "feature_version": FEATURE_VERSION},
+        fields=["name", "model_file"],
+        order_by="version desc",
+        limit=1
+    )
+    if not rows or not rows[0].model_file:
+        return None
+
+    name = rows[0].name
+    if name not in _loaded:
+        content = frappe.get_doc("File", {"file_url": rows[0].model_file}).get_content()
+        _loaded[name] = pickle.loads(content)
+    return _loaded[name]
+
+
+def train_anomaly_model(company):
+    """
+    Train and store a new model version on the company's recent GL Entries
+
+    Returns:
+        str: AI Anomaly Model name, or None when there is too little history
+    """
+    from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+
+    if not HAS_SKLEARN:
+        frappe.log_error("scikit-learn is not installed; anomaly model not trained", "AI Anomaly Model")
+        return None
+
+    data = AIAnomalyService().get_transaction_data(company, {
+        "from_date": add_days(today(), -TRAINING_DAYS),
+        "to_date": today()
+    })
+    if len(data) < MIN_TRAINING_ROWS:
+        return None
+
+    training_rows = len(data)
+    if training_rows > MAX_TRAINING_ROWS:
+        keep = np.sort(np.random.default_rng(0).choice(training_rows, MAX_TRAINING_ROWS, replace=False))
+        data = [data[i] for i in keep]
+
+    return save_model(company, AnomalyModel.fit(data), training_rows)
+
+
+def retrain_anomaly_models():
+    """Scheduler: retrain every company's anomaly model (Material Ledger Settings opt-in)"""
+    from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+
+    if not MaterialLedgerSettings.get_settings().get("ai_anomaly_model"):
+        return
+
+    for company in frappe.get_all("Company", pluck="name"):
+        frappe.enqueue(
+            "material_ledger.material_ledger.services.anomaly_model.train_anomaly_model",
+            queue="long",
+            timeout=3600,
+            job_id=f"anomaly_model::{company}",
+            deduplicate=True,
+            company=company
+        )
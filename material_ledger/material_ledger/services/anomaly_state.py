@@ -0,0 +1,263 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Anomaly Baseline State
+Running per-account and per-user statistics persisted in AI Anomaly Baseline,
+so anomaly runs only read GL Entries posted since the last run
+"""
+
+import frappe
+from frappe.utils import add_to_date, cint, flt, get_datetime, now
+import hashlib
+import json
+import math
+
+
+BENFORD_EXPECTED = [30.1, 17.6, 12.5, 9.7, 7.9, 6.7, 5.8, 5.1, 4.6]  # First digit 1-9, percent
+BENFORD_CRITICAL = 15.51  # Chi-square critical value, 8 degrees of freedom at 95%
+SKETCH_CAPACITY = 64  # Amounts tracked per account frequency sketch
+WATERMARK_OVERLAP = 600  # Seconds re-read behind the watermark, for entries committed after a run that created earlier
+
+
+class RunningStats:
+    """
+    Welford running count, mean and variance
+
+    Two instances built over different rows merge into the statistics of
+    all rows (Chan et al.), so partial statistics can be combined freely.
+    """
+
+    __slots__ = ("count", "m2", "mean")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = cint(count)
+        self.mean = flt(mean)
+        self.m2 = flt(m2)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        if not self.count:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def stdev(self):
+        """Sample standard deviation, like statistics.stdev"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**(values or {}))
+
+
+class FrequencySketch:
+    """
+    Misra-Gries heavy-hitter sketch of amounts
+
+    Keeps at most `capacity` counters; amounts that occur often are kept
+    with counts that undercount by at most rows / capacity.
+    """
+
+    def __init__(self, counts=None, capacity=SKETCH_CAPACITY):
+        self.counts = {flt(amount): cint(count) for amount, count in (counts or {}).items()}
+        self.capacity = capacity
+
+    def add(self, amount):
+        if amount in self.counts:
+            self.counts[amount] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[amount] = 1
+        else:
+            # Decrement every counter and drop the ones that reach zero
+            self.counts = {key: count - 1 for key, count in self.counts.items() if count > 1}
+
+    def estimate(self, amount):
+        return self.counts.get(amount, 0)
+
+    def to_dict(self):
+        # JSON object keys are strings; repr keeps floats exact
+        return {repr(amount): count for amount, count in self.counts.items()}
+
+
+class BenfordCounts:
+    """First-digit counts of amounts for Benford's law tests"""
+
+    def __init__(self, counts=None, total=0):
+        self.counts = list(counts or [0] * 9)
+        self.total = cint(total)
+
+    def add(self, amount):
+        if amount <= 0:
+            return
+        self.total += 1
+        digit = int(str(int(amount))[0])
+        if digit:
+            self.counts[digit - 1] += 1
+
+    def chi_square(self):
+        if not self.total:
+            return 0.0
+        return sum(
+            (count / self.total * 100 - expected) ** 2 / expected
+            for count, expected in zip(self.counts, BENFORD_EXPECTED, strict=True)
+        )
+
+    def to_dict(self):
+        return {"counts": self.counts, "total": self.total}
+
+
+def baseline_name(company, scope, key):
+    """Deterministic AI Anomaly Baseline name for a company, scope and key"""
+    return hashlib.md5(f"{company}|{scope}|{key}".encode()).hexdigest()
+
+
+class AnomalyState:
+    """
+    Persisted anomaly baselines of one company
+
+    One AI Anomaly Baseline row per account (running amount statistics and
+    amount frequency sketch), per user (running amount statistics) and one
+    company row (Benford counts and the watermark of the last scored entry).
+    Only rows touched since loading are written back.
+
+    A transaction can commit after a run although its entries were created
+    before entries that run saw. Incremental reads therefore start
+    WATERMARK_OVERLAP seconds behind the watermark, and the company row keeps
+    the names folded in within that window so re-read entries are skipped.
+    """
+
+    def __init__(self, company):
+        self.company = company
+        self.accounts = {}
+        self.sketches = {}
+        self.users = {}
+        self.benford = BenfordCounts()
+        self.watermark = None
+        self.recent = {}  # Entry name -> creation of entries within the overlap window
+        self._dirty = set()
+        self._load()
+
+    def _load(self):
+        rows = frappe.get_all(
+            "AI Anomaly Baseline",
+            filters={"company": self.company},
+            fields=["scope", "scope_key", "state", "last_creation", "last_entry"]
+        )
+        for row in rows:
+            state = json.loads(row.state or "{}")
+            if row.scope == "Account":
+                self.accounts[row.scope_key] = RunningStats.from_dict(state.get("stats"))
+                self.sketches[row.scope_key] = FrequencySketch(state.get("amounts"))
+            elif row.scope == "User":
+                self.users[row.scope_key] = RunningStats.from_dict(state.get("stats"))
+            elif row.scope == "Company":
+                self.benford = BenfordCounts(**(state.get("benford") or {}))
+                self.recent = state.get("recent") or {}
+                if row.last_creation:
+                    self.watermark = (row.last_creation, row.last_entry)
+
+    def account_stats(self, account):
+        return self.accounts.get(account) or RunningStats()
+
+    def user_stats(self, user):
+        return self.users.get(user) or RunningStats()
+
+    def amount_frequency(self, account, amount):
+        sketch = self.sketches.get(account)
+        return sketch.estimate(amount) if sketch else 0
+
+    def read_from(self):
+        """Creation time incremental reads start at: the overlap window behind the watermark"""
+        if not self.watermark:
+            return None
+        return add_to_date(get_datetime(self.watermark[0]), seconds=-WATERMARK_OVERLAP)
+
+    def is_seen(self, entry):
+        """Check whether an entry re-read within the overlap window was already folded in"""
+        return entry["name"] in self.recent
+
+    def update(self, entry):
+        """
+        Fold one GL Entry into the baselines and advance the watermark
+
+        Returns:
+            bool: False if the entry was already folded in and was skipped
+        """
+        if self.is_seen(entry):
+            return False
+
+        account, user, amount = entry["account"], entry["owner"], flt(entry["abs_amount"])
+
+        self.accounts.setdefault(account, RunningStats()).add(amount)
+        self.sketches.setdefault(account, FrequencySketch()).add(amount)
+        self.users.setdefault(user, RunningStats()).add(amount)
+        self.benford.add(amount)
+
+        self._dirty.update({("Account", account), ("User", user), ("Company", self.company)})
+
+        self.recent[entry["name"]] = str(entry["creation"])
+        mark = (entry["creation"], entry["name"])
+        if not self.watermark or mark > self.watermark:
+            self.watermark = mark
+        return True
+
+    def _prune_recent(self):
+        # Entries older than the overlap window are never re-read, so their names can go
+        cutoff = self.read_from()
+        if cutoff:
+            self.recent = {
+                name: creation for name, creation in self.recent.items() if get_datetime(creation) >= cutoff
+            }
+
+    def save(self):
+        """Write the changed baselines back (delete and bulk insert, one statement each)"""
+        if not self._dirty:
+            return
+
+        self._prune_recent()
+        timestamp = now()
+        values = []
+        for scope, key in self._dirty:
+            last_creation = last_entry = None
+            if scope == "Account":
+                state = {"stats": self.accounts[key].to_dict(), "amounts": self.sketches[key].to_dict()}
+                count = self.accounts[key].count
+            elif scope == "User":
+                state = {"stats": self.users[key].to_dict()}
+                count = self.users[key].count
+            else:
+                state = {"benford": self.benford.to_dict(), "recent": self.recent}
+                count = self.benford.total
+                last_creation, last_entry = self.watermark or (None, None)
+
+            values.append((
+                baseline_name(self.company, scope, key), timestamp, timestamp, "Administrator", "Administrator",
+                self.company, scope, key, count, json.dumps(state), last_creation, last_entry
+            ))
+
+        frappe.db.delete("AI Anomaly Baseline", {"name": ["in", [value[0] for value in values]]})
+        frappe.db.bulk_insert(
+            "AI Anomaly Baseline",
+            fields=["name", "creation", "modified", "owner", "modified_by", "company", "scope",
+                    "scope_key", "entry_count", "state", "last_creation", "last_entry"],
+            values=values
+        )
+        self._dirty.clear()
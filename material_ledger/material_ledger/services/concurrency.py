@@ -0,0 +1,155 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+AI Concurrency Helpers
+Bounded fan-out of LLM calls and a rate budget shared by all workers
+"""
+
+import frappe
+from frappe.utils import cint
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from material_ledger.material_ledger.services import job_control
+
+
+def get_concurrency_settings():
+    """
+    Get AI fan-out limits for the configured provider
+
+    Returns:
+        tuple: (max_concurrency, rate_limit_per_minute) - a rate limit of 0 means unlimited
+    """
+    from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+    from material_ledger.material_ledger.services.llm_providers import get_provider_config
+
+    settings = MaterialLedgerSettings.get_settings()
+    provider_config = get_provider_config(settings.get("ai_provider"), settings)
+    return (
+        max(cint(provider_config.get("max_concurrency")) or 4, 1),
+        max(cint(settings.get("ai_rate_limit_per_minute")), 0)
+    )
+
+
+class RateBudget:
+    """
+    Fixed-window call budget stored in Redis
+
+    All workers and threads of the site draw from the same counter, so the
+    provider limit holds no matter how many jobs fan out at once.
+    """
+
+    def __init__(self, name, limit, period=60):
+        self.name = name
+        self.limit = cint(limit)
+        self.period = period
+
+    def _key(self, window):
+        return frappe.cache().make_key(f"ai_rate_budget:{self.name}:{window}")
+
+    def try_acquire(self):
+        """
+        Take one call from the current window
+
+        Returns:
+            float: 0 if a call was granted, otherwise seconds until the next window
+        """
+        if self.limit <= 0:
+            return 0
+
+        now_ts = time.time()
+        window = int(now_ts // self.period)
+        key = self._key(window)
+
+        cache = frappe.cache()
+        used = cache.incr(key)
+        if used == 1:
+            cache.expire(key, self.period * 2)
+
+        if used <= self.limit:
+            return 0
+        return (window + 1) * self.period - now_ts
+
+    def acquire(self, timeout=None):
+        """
+        Block until a call is granted
+
+        Args:
+            timeout: Maximum seconds to wait, None waits indefinitely
+
+        Returns:
+            bool: True if granted, False if the timeout expired first
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if deadline is not None and time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+def run_in_site_context(site, func, *args, **kwargs):
+    """Run func in a worker thread with its own site context and DB connection"""
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        frappe.destroy()
+
+
+def _run_with_job_control(control, func, *args, **kwargs):
+    """Run func with the parent job's control active, so its LLM calls honor cancellation"""
+    job_control.activate(control)
+    return func(*args, **kwargs)
+
+
+class BoundedFanOut:
+    """
+    Run site-bound calls on a bounded thread pool
+
+    Submitted calls run in their own site context with the submitting job's
+    control active. Results are returned in submission order regardless of
+    completion order; calls not yet started are dropped if the block exits
+    with an error or cancellation.
+
+    Usage:
+        with BoundedFanOut(max_workers=4) as fan_out:
+            futures = [fan_out.submit(func, arg) for arg in args]
+            ...  # other work runs while the calls are in flight
+            results = fan_out.gather(futures, default=[])
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max(cint(max_workers), 1)
+        self.site = frappe.local.site
+        self.control = job_control.current()
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ai_fanout")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._executor.shutdown(wait=True, cancel_futures=exc_type is not None)
+        self._executor = None
+
+    def submit(self, func, *args, **kwargs):
+        return self._executor.submit(
+            run_in_site_context, self.site, _run_with_job_control, self.control, func, *args, **kwargs
+        )
+
+    def gather(self, futures, default=None):
+        """Collect results in submission order, logging failures and substituting default"""
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                frappe.log_error(f"AI fan-out call failed: {str(e)}", "AI Concurrency")
+                results.append(default)
+        return results
@@ -0,0 +1,240 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Dimension Forecasts
+Monthly forecasts for every cost center or project of a company from one
+grouped query and one vectorized fit, stored as AI Dimension Forecast rows
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, now
+import hashlib
+import json
+import numpy as np
+
+
+# Forecastable dimension DocTypes and their GL Entry column
+DIMENSIONS = {
+    "Cost Center": "cost_center",
+    "Project": "project"
+}
+METRICS = ["revenue", "expenses", "cash_flow"]
+INSERT_BATCH = 5000  # Rows per bulk insert statement
+MAX_PAGE_LENGTH = 500
+
+
+def forecast_name(company, dimension, value, metric, month):
+    """Deterministic AI Dimension Forecast name for one value, metric and month"""
+    return hashlib.md5(f"{company}|{dimension}|{value}|{metric}|{month}".encode()).hexdigest()
+
+
+def _get_column(dimension):
+    if dimension not in DIMENSIONS:
+        frappe.throw(_("Forecasts are available per Cost Center or Project"))
+    return DIMENSIONS[dimension]
+
+
+def get_dimension_history(company, dimension, from_date, to_date):
+    """
+    Monthly totals of every value of a dimension, from one grouped query
+
+    Returns:
+        list: Rows with value, year, month and one total per METRICS key
+    """
+    column = _get_column(dimension)
+
+    return frappe.db.sql(f"""
+        SELECT
+            gle.`{column}` as value,
+            YEAR(gle.posting_date) as year,
+            MONTH(gle.posting_date) as month,
+            SUM(CASE WHEN acc.root_type = 'Income' THEN gle.credit - gle.debit ELSE 0 END) as revenue,
+            SUM(CASE WHEN acc.root_type = 'Expense' THEN gle.debit - gle.credit ELSE 0 END) as expenses,
+            SUM(CASE WHEN acc.account_type IN ('Cash', 'Bank') THEN gle.debit - gle.credit ELSE 0 END) as cash_flow
+        FROM `tabGL Entry` gle
+        LEFT JOIN `tabAccount` acc ON acc.name = gle.account
+        WHERE
+            gle.company = %(company)s
+            AND gle.posting_date BETWEEN %(from_date)s AND %(to_date)s
+            AND gle.is_cancelled = 0
+            AND IFNULL(gle.`{column}`, '') != ''
+        GROUP BY gle.`{column}`, YEAR(gle.posting_date), MONTH(gle.posting_date)
+    """, {
+        'company': company,
+        'from_date': from_date,
+        'to_date': to_date
+    }, as_dict=True)
+
+
+def history_matrix(history):
+    """
+    Series matrix of grouped monthly totals: one row per value and metric
+
+    Every value shares the gapless month range of the whole history; months
+    without postings count as zero. A value's series only starts at its first
+    posting, whose column is returned per value.
+
+    Returns:
+        tuple: (matrix of shape (values * len(METRICS), months), values, first
+        month index, column of each value's first posting)
+    """
+    from material_ledger.material_ledger.services.anomaly_engine import factorize
+
+    codes, values = factorize([row.value for row in history])
+    months = np.fromiter((row.year * 12 + row.month - 1 for row in history), dtype=np.int64, count=len(history))
+    first = int(months.min())
+
+    matrix = np.zeros((len(values) * len(METRICS), int(months.max()) - first + 1))
+    for position, metric in enumerate(METRICS):
+        totals = np.fromiter((flt(row[metric]) for row in history), dtype=float, count=len(history))
+        np.add.at(matrix, (codes * len(METRICS) + position, months - first), totals)
+
+    starts = np.full(len(values), matrix.shape[1], dtype=np.int64)
+    np.minimum.at(starts, codes, months - first)
+    return matrix, values, first, starts
+
+
+def forecast_dimension(company, dimension, from_date, to_date, horizon=12):
+    """
+    Forecast every value of a dimension together
+
+    Returns:
+        dict: values, projected dates and point/lower/upper arrays of shape
+        (values, len(METRICS), horizon); None without history
+    """
+    from material_ledger.material_ledger.services.forecast_engine import ForecastEngine, forecast_cache
+
+    history = get_dimension_history(company, dimension, from_date, to_date)
+    if not history:
+        return None
+
+    matrix, values, first_month, starts = history_matrix(history)
+    cache = forecast_cache()
+    shape = (len(values), len(METRICS), horizon)
+    result = {"values": values, "history_months": matrix.shape[1]}
+    for bound in ["point", "lower", "upper"]:
+        result[bound] = np.empty(shape)
+
+    # One fit per first-posting month, so zeros before a value existed are not
+    # fitted as history; values unchanged since the last run reuse their cached fit
+    for start in np.unique(starts):
+        members = np.flatnonzero(starts == start)
+        rows = (members[:, None] * len(METRICS) + np.arange(len(METRICS))).ravel()
+        forecast = ForecastEngine(matrix[rows, start:], first_month + int(start), cache).forecast(horizon)
+        for bound in ["point", "lower", "upper"]:
+            result[bound][members] = forecast[bound].reshape(len(members), len(METRICS), horizon)
+        # Every group ends at the last month of the history, so the dates agree
+        result["dates"] = forecast["dates"]
+    return result
+
+
+def save_dimension_forecasts(job_id, company, dimension, forecast):
+    """Replace the company's stored forecasts of a dimension (one statement per batch)"""
+    timestamp = now()
+    rows = []
+    for v, value in enumerate(forecast["values"]):
+        for m, metric in enumerate(METRICS):
+            for h, date in enumerate(forecast["dates"]):
+                month = f"{date}-01"
+                rows.append((
+                    forecast_name(company, dimension, value, metric, month), timestamp, timestamp,
+                    "Administrator", "Administrator", job_id, company, dimension, value, metric, month,
+                    float(forecast["point"][v, m, h]), float(forecast["lower"][v, m, h]),
+                    float(forecast["upper"][v, m, h])
+                ))
+
+    frappe.db.delete("AI Dimension Forecast", {"company": company, "dimension": dimension})
+    for start in range(0, len(rows), INSERT_BATCH):
+        frappe.db.bulk_insert(
+            "AI Dimension Forecast",
+            fields=["name", "creation", "modified", "owner", "modified_by", "job", "company", "dimension",
+                    "dimension_value", "metric", "forecast_month", "predicted", "lower_bound", "upper_bound"],
+            values=rows[start:start + INSERT_BATCH]
+        )
+    return len(rows)
+
+
+def process_dimension_forecast(company, filters, progress):
+    """AI job: forecast and store every value of filters["dimension"]"""
+    from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
+    from material_ledger.material_ledger.services.job_scheduler import DEFAULT_FROM_DATES
+
+    dimension = filters.get("dimension") or "Cost Center"
+    from_date = filters.get("from_date") or DEFAULT_FROM_DATES["dimension_forecast"]
+    to_date = filters.get("to_date") or now().split(" ")[0]
+
+    progress.update(20)
+    forecast = forecast_dimension(company, dimension, from_date, to_date, AIPredictionService().prediction_months)
+    if not forecast:
+        return {"dimension": dimension, "values": 0, "rows": 0, "generated_at": now()}
+
+    progress.update(70)
+    rows = save_dimension_forecasts(progress.job_id, company, dimension, forecast)
+
+    # Headline figures only; the forecasts themselves are read with get_dimension_forecasts
+    revenue = forecast["point"][:, METRICS.index("revenue"), :].sum(axis=1)
+    top = np.argsort(-revenue, kind="stable")[:10]
+    return {
+        "dimension": dimension,
+        "values": len(forecast["values"]),
+        "rows": rows,
+        "history_months": forecast["history_months"],
+        "forecast_months": forecast["dates"],
+        "top_revenue": [
+            {"value": forecast["values"][i], "revenue": float(revenue[i])} for i in top
+        ],
+        "generated_at": now()
+    }
+
+
+# API Endpoints
+@frappe.whitelist()
+def start_dimension_forecast(company, dimension, filters=None):
+    """API endpoint to start a batch forecast of every Cost Center or Project"""
+    from material_ledger.material_ledger.services.queue_service import queue_ai_analysis
+
+    if not filters:
+        filters = {}
+    if isinstance(filters, str):
+        filters = json.loads(filters)
+
+    _get_column(dimension)
+    filters["dimension"] = dimension
+    return queue_ai_analysis("dimension_forecast", company, filters)
+
+
+@frappe.whitelist()
+def get_dimension_forecasts(company, dimension, dimension_value=None, metric=None, page=1, page_length=100):
+    """
+    API endpoint to get stored forecasts of a dimension, one page at a time
+
+    Rows are ordered by value, metric and month; total counts every match.
+    """
+    _get_column(dimension)
+    page = max(cint(page), 1)
+    page_length = min(max(cint(page_length), 1), MAX_PAGE_LENGTH)
+
+    conditions = {"company": company, "dimension": dimension}
+    if dimension_value:
+        conditions["dimension_value"] = dimension_value
+    if metric:
+        conditions["metric"] = metric
+
+    forecasts = frappe.get_list(
+        "AI Dimension Forecast",
+        filters=conditions,
+        fields=["dimension_value", "metric", "forecast_month", "predicted", "lower_bound", "upper_bound"],
+        order_by="dimension_value asc, metric asc, forecast_month asc",
+        limit_start=(page - 1) * page_length,
+        limit_page_length=page_length
+    )
+    total = frappe.get_list("AI Dimension Forecast", filters=conditions, fields=["count(name) as total"])
+
+    return {
+        "forecasts": forecasts,
+        "total": cint(total[0].total) if total else 0,
+        "page": page,
+        "page_length": page_length
+    }
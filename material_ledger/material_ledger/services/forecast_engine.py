@@ -0,0 +1,159 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Vectorized Forecast Engine
+Fits trend plus month-of-year seasonality to many monthly series at once with
+one NumPy least-squares solve, and projects them with prediction intervals
+"""
+
+import numpy as np
+from statistics import NormalDist
+
+
+FORECAST_VERSION = 1  # Bump when the model changes; fits cached under other versions are not reused
+SEASON_LENGTH = 12  # Months per seasonal cycle
+MIN_SEASONAL_PERIODS = 2 * SEASON_LENGTH  # Seasonality is only fitted with two full years of history
+
+
+def month_index(date):
+    """Months since year 0 of a "YYYY-MM" date"""
+    year, month = date.split('-')[:2]
+    return int(year) * 12 + int(month) - 1
+
+
+def month_label(index):
+    """"YYYY-MM" date of a month index"""
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+
+def monthly_matrix(rows, metrics):
+    """
+    Stack metrics of monthly rows as series over a gapless month range
+
+    Months missing from rows (no postings) count as zero.
+
+    Args:
+        rows: Dicts with a "YYYY-MM" date and one value per metric
+        metrics: Metric keys, one series per metric
+
+    Returns:
+        tuple: (series matrix of shape (metrics, months), first month index)
+    """
+    indexes = np.array([month_index(row['date']) for row in rows], dtype=np.int64)
+    first = int(indexes.min())
+    matrix = np.zeros((len(metrics), int(indexes.max()) - first + 1))
+    for position, metric in enumerate(metrics):
+        np.add.at(matrix[position], indexes - first, [float(row.get(metric) or 0) for row in rows])
+    return matrix, first
+
+
+def linear_trends(series):
+    """Least-squares slope per unit step of each row of a series matrix"""
+    series = np.atleast_2d(np.asarray(series, dtype=float))
+    periods = series.shape[1]
+    if periods < 2:
+        return np.zeros(series.shape[0])
+
+    steps = np.arange(periods) - (periods - 1) / 2
+    return (series - series.mean(axis=1, keepdims=True)) @ steps / (steps @ steps)
+
+
+def forecast_cache():
+    """FittedModelCache of ForecastEngine fits under the current FORECAST_VERSION"""
+    from material_ledger.material_ledger.services.model_cache import FittedModelCache
+    return FittedModelCache("forecast", FORECAST_VERSION)
+
+
+class ForecastEngine:
+    """
+    Trend and seasonality model fitted to every row of a series matrix together
+
+    All series share the months they cover, so they share one design matrix:
+    intercept, linear trend and, with two full years of history, 11
+    month-of-year indicators. One lstsq call fits every series, and the
+    interval widths of a horizon are the same for all of them up to each
+    series' residual scale.
+
+    With a FittedModelCache, series fitted before with the same history are
+    read from the cache and only the rest are fitted.
+    """
+
+    def __init__(self, series, first_month=0, cache=None):
+        """
+        Args:
+            series: Matrix of shape (series, months), or one series
+            first_month: Month index (see month_index) of the first column
+            cache: FittedModelCache for this engine's fits, optional
+        """
+        self.series = np.atleast_2d(np.asarray(series, dtype=float))
+        self.periods = self.series.shape[1]
+        self.first_month = first_month
+        self.seasonal = self.periods >= MIN_SEASONAL_PERIODS
+        self.cache = cache
+        self.refitted = 0
+        self._fit()
+
+    def _design(self, steps):
+        columns = [np.ones(len(steps)), steps.astype(float)]
+        if self.seasonal:
+            phases = (steps + self.first_month) % SEASON_LENGTH
+            columns.extend((phases == phase).astype(float) for phase in range(1, SEASON_LENGTH))
+        return np.column_stack(columns)
+
+    def _fit(self):
+        design = self._design(np.arange(self.periods))
+        self._covariance = np.linalg.pinv(design.T @ design)
+        self.coefficients = np.zeros((design.shape[1], len(self.series)))
+        self.sigma = np.zeros(len(self.series))
+
+        # Seasonal phase is part of the fit context: the same values starting in another month fit differently
+        context = (self.first_month % SEASON_LENGTH,)
+        fingerprints = [self.cache.fingerprint(row, *context) for row in self.series] if self.cache else []
+        cached = self.cache.get_many(fingerprints) if self.cache else [None] * len(self.series)
+
+        stale = np.array([i for i, params in enumerate(cached) if params is None], dtype=np.int64)
+        for i, params in enumerate(cached):
+            if params is not None:
+                self.coefficients[:, i], self.sigma[i] = params
+
+        if len(stale):
+            coefficients = np.linalg.lstsq(design, self.series[stale].T, rcond=None)[0]
+            residuals = self.series[stale].T - design @ coefficients
+            dof = max(self.periods - design.shape[1], 1)
+            self.coefficients[:, stale] = coefficients
+            self.sigma[stale] = np.sqrt((residuals ** 2).sum(axis=0) / dof)
+            self.refitted = len(stale)
+
+            if self.cache:
+                self.cache.set_many({
+                    fingerprints[i]: (self.coefficients[:, i].copy(), float(self.sigma[i])) for i in stale
+                })
+
+    @property
+    def trends(self):
+        """Fitted change per month of each series"""
+        return self.coefficients[1]
+
+    def forecast(self, horizon, level=0.95):
+        """
+        Project every series `horizon` months past its history
+
+        Returns:
+            dict: point, lower and upper matrices of shape (series, horizon),
+            and the "YYYY-MM" dates of the projected months
+        """
+        steps = np.arange(self.periods, self.periods + horizon)
+        design = self._design(steps)
+        point = (design @ self.coefficients).T
+
+        leverage = np.einsum("ij,jk,ik->i", design, self._covariance, design)
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        spread = z * self.sigma[:, None] * np.sqrt(1 + leverage)[None, :]
+
+        return {
+            "point": point,
+            "lower": point - spread,
+            "upper": point + spread,
+            "dates": [month_label(self.first_month + step) for step in steps]
+        }
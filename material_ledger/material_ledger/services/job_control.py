@@ -0,0 +1,95 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+AI Job Control
+Cooperative cancellation and deadlines for running AI jobs
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+import time
+
+
+CONTROL_TTL = 86400  # Seconds a job's control hash is kept
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a running AI job once it was cancelled or ran past its deadline
+
+    Derives from BaseException, like asyncio.CancelledError, so the broad
+    `except Exception` fallbacks in the AI services do not swallow it.
+    """
+
+    def __init__(self, job_id, reason):
+        super().__init__(reason)
+        self.job_id = job_id
+        self.reason = reason
+
+
+class JobControl:
+    """
+    Cancellation flag and deadline of one AI job, shared through Redis
+
+    Running jobs call `check()` between chunks and before every LLM call;
+    any process can call `cancel()`.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def _name(self):
+        return f"ai_job_control:{self.job_id}"
+
+    def _set(self, field, value):
+        cache = frappe.cache()
+        cache.hset(self._name(), field, value)
+        cache.expire(cache.make_key(self._name()), CONTROL_TTL)
+
+    def set_deadline(self, seconds):
+        """Give the job `seconds` from now to finish"""
+        if seconds:
+            self._set("deadline", time.time() + seconds)
+
+    def cancel(self):
+        """Ask the job to stop at its next check"""
+        self._set("cancelled", 1)
+
+    def is_cancelled(self):
+        return bool(frappe.cache().hget(self._name(), "cancelled"))
+
+    def check(self):
+        """
+        Stop the job if it was cancelled or ran past its deadline
+
+        Raises:
+            JobCancelled
+        """
+        values = frappe.cache().hgetall(self._name()) or {}
+        values = {(k.decode() if isinstance(k, bytes) else k): v for k, v in values.items()}
+
+        if values.get("cancelled"):
+            raise JobCancelled(self.job_id, _("Cancelled by user"))
+
+        deadline = flt(values.get("deadline"))
+        if deadline and time.time() > deadline:
+            raise JobCancelled(self.job_id, _("Deadline exceeded"))
+
+
+def activate(control):
+    """Make control the job control checked by code running in this site context"""
+    frappe.local.ai_job_control = control
+
+
+def current():
+    """Get the job control of the AI job running in this site context, if any"""
+    return getattr(frappe.local, "ai_job_control", None)
+
+
+def check_current():
+    """Check the running AI job, if any; no-op outside AI jobs"""
+    control = current()
+    if control:
+        control.check()
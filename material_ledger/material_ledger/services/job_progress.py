@@ -0,0 +1,106 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+AI Job Progress Channel
+Progress lives in a Redis hash, is pushed over realtime and only
+occasionally persisted to AI Job Queue
+"""
+
+import frappe
+from frappe.utils import cint, now
+import time
+
+
+PROGRESS_TTL = 86400  # Seconds a job's progress hash is kept after the last update
+
+
+class JobProgress:
+    """
+    Progress reporter for one AI job
+
+    Every update is written to a Redis hash and pushed to the job's watchers.
+    Watchers may be given as a callable, which is read on every push so users
+    who attach to the job while it runs get its progress too. The AI Job
+    Queue document is only written when progress advanced by `persist_step`
+    percent or `persist_interval` seconds passed since the last write, so
+    chunked jobs no longer save the document per chunk.
+    """
+
+    def __init__(self, job_id, users=None, persist_step=10, persist_interval=30):
+        self.job_id = job_id
+        self.users = users if callable(users) else list(users or [])
+        self.persist_step = persist_step
+        self.persist_interval = persist_interval
+        self._last_progress = None
+        self._last_persisted = None
+        self._last_persisted_at = 0
+
+    def update(self, progress, status=None, stage=None, force=False, persist=True):
+        """
+        Report job progress
+
+        Args:
+            progress: Percentage complete (0-100)
+            status: Job status, if it changed
+            stage: Optional short label of the current step
+            force: Persist to the database regardless of throttling
+            persist: Set to False to only update Redis and realtime
+        """
+        progress = max(0, min(cint(progress), 100))
+        if progress == self._last_progress and not status and not force:
+            return
+        self._last_progress = progress
+
+        values = {"progress": progress, "updated_at": now()}
+        if status:
+            values["status"] = status
+        if stage:
+            values["stage"] = stage
+        set_progress(self.job_id, values)
+
+        message = {"job_id": self.job_id, "progress": progress, "status": status or "processing", "stage": stage}
+        for user in (self.users() if callable(self.users) else self.users):
+            frappe.publish_realtime(event="ai_job_progress", message=message, user=user)
+
+        if persist and (force or self._should_persist(progress)):
+            self._persist(progress)
+
+    def _should_persist(self, progress):
+        if self._last_persisted is None:
+            return True
+        if progress - self._last_persisted >= self.persist_step:
+            return True
+        return time.time() - self._last_persisted_at >= self.persist_interval
+
+    def _persist(self, progress):
+        frappe.db.set_value("AI Job Queue", self.job_id, "progress", progress, update_modified=False)
+        # Commit so status readers on other connections see it before the job ends
+        frappe.db.commit()
+        self._last_persisted = progress
+        self._last_persisted_at = time.time()
+
+
+def _hash_name(job_id):
+    return f"ai_job_progress:{job_id}"
+
+
+def set_progress(job_id, values):
+    """Write fields to a job's progress hash"""
+    cache = frappe.cache()
+    for field, value in values.items():
+        cache.hset(_hash_name(job_id), field, value)
+    cache.expire(cache.make_key(_hash_name(job_id)), PROGRESS_TTL)
+
+
+def get_progress(job_id):
+    """
+    Read a job's progress hash
+
+    Returns:
+        dict: progress, status, stage and updated_at, or None if the job has no hash
+    """
+    values = frappe.cache().hgetall(_hash_name(job_id)) or {}
+    values = {(k.decode() if isinstance(k, bytes) else k): v for k, v in values.items()}
+    return values or None
+
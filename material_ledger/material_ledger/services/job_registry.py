@@ -0,0 +1,96 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+In-flight Job Registry
+Tracks running AI work by cache key so identical requests share one job
+"""
+
+import frappe
+
+
+class InFlightRegistry:
+    """
+    Registry of in-flight AI work keyed by cache key
+
+    The first request for a cache key claims it with its job id; later
+    identical requests get the running job id back instead of starting
+    a new job. Entries expire after `ttl` seconds so a killed worker
+    cannot block a cache key forever.
+    """
+
+    def __init__(self, key_prefix="ai_inflight", ttl=3600):
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def _name(self, cache_key, suffix=None):
+        """Build registry key name (unprefixed, for RedisWrapper helpers)"""
+        name = f"{self.key_prefix}:{cache_key}"
+        if suffix:
+            name = f"{name}:{suffix}"
+        return name
+
+    def _key(self, cache_key, suffix=None):
+        """Build site-scoped Redis key for raw redis commands"""
+        return frappe.cache().make_key(self._name(cache_key, suffix))
+
+    def claim(self, cache_key, job_id, ttl=None, is_stale=None):
+        """
+        Register job_id as the owner of cache_key unless another job already runs it
+
+        Args:
+            cache_key: Key identifying identical work
+            job_id: Job id of the caller
+            ttl: Seconds before the claim expires (defaults to registry ttl)
+            is_stale: Optional callable(job_id) returning True if the existing
+                owner is no longer running and may be replaced
+
+        Returns:
+            tuple: (owner_job_id, is_new) - is_new is True when the caller owns the work
+        """
+        cache = frappe.cache()
+        key = self._key(cache_key)
+        ttl = ttl or self.ttl
+
+        if cache.set(key, job_id, nx=True, ex=ttl):
+            return job_id, True
+
+        owner = self.get(cache_key)
+        if owner and not (is_stale and is_stale(owner)):
+            return owner, False
+
+        # Owner expired between calls or finished without releasing - take over
+        cache.set(key, job_id, ex=ttl)
+        cache.delete(self._key(cache_key, "watchers"))
+        return job_id, True
+
+    def get(self, cache_key):
+        """Get the job id currently running cache_key, if any"""
+        owner = frappe.cache().get(self._key(cache_key))
+        if isinstance(owner, bytes):
+            owner = owner.decode()
+        return owner
+
+    def release(self, cache_key, job_id=None):
+        """
+        Release cache_key once its job has finished
+
+        Args:
+            cache_key: Key identifying the work
+            job_id: If given, only release when this job still owns the key
+        """
+        if job_id and self.get(cache_key) != job_id:
+            return False
+
+        frappe.cache().delete(self._key(cache_key), self._key(cache_key, "watchers"))
+        return True
+
+    def add_watcher(self, cache_key, user):
+        """Register a user interested in the outcome of the in-flight work"""
+        frappe.cache().sadd(self._name(cache_key, "watchers"), user)
+        frappe.cache().expire(self._key(cache_key, "watchers"), self.ttl)
+
+    def get_watchers(self, cache_key):
+        """Get all users attached to the in-flight work"""
+        members = frappe.cache().smembers(self._name(cache_key, "watchers")) or []
+        return [m.decode() if isinstance(m, bytes) else m for m in members]
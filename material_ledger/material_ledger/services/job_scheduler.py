@@ -0,0 +1,262 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+AI Job Scheduler
+Priority lanes and per-tenant fair scheduling in front of the RQ queues
+"""
+
+import frappe
+from frappe.utils import cint, flt, now
+import time
+
+
+# Lanes in dispatch order; each maps to an RQ queue and has its own running slots
+LANES = {
+    "interactive": {"queue": "short", "slots": 4},
+    "standard": {"queue": "default", "slots": 2},
+    "bulk": {"queue": "long", "slots": 1}
+}
+LANE_ORDER = ["interactive", "standard", "bulk"]
+
+# Estimated rows up to which a job still fits a lane; larger jobs go to bulk
+LANE_MAX_COST = {
+    "interactive": 2000,
+    "standard": 50000
+}
+
+# Start date used by each job type when the filters give none
+DEFAULT_FROM_DATES = {
+    "financial_prediction": "2020-01-01",
+    "dimension_forecast": "2020-01-01"
+}
+
+LOCK_TTL = 10  # Seconds a dispatcher may hold the dispatch lock
+RUN_GRACE = 300  # Seconds a started job may run past its timeout before it counts as lost
+LOST_STATUSES = ("failed", "stopped", "canceled")  # RQ states of a job that ended without releasing its slot
+
+
+def estimate_job_cost(job_type, company, filters):
+    """
+    Estimate the cost of an AI job as the number of GL Entries it reads
+
+    Returns:
+        int: Estimated row count (at least 1)
+    """
+    if job_type == "comprehensive_analysis":
+        year = cint(filters.get("year")) or cint(now()[:4])
+        from_date, to_date = f"{year}-01-01", f"{year}-12-31"
+    else:
+        from_date = filters.get("from_date") or DEFAULT_FROM_DATES.get(job_type, "2023-01-01")
+        to_date = filters.get("to_date") or now().split(" ")[0]
+
+    rows = frappe.db.count("GL Entry", {
+        "company": company,
+        "posting_date": ["between", [from_date, to_date]],
+        "is_cancelled": 0
+    })
+    return max(cint(rows), 1)
+
+
+def classify_lane(cost, requested=None):
+    """
+    Pick the lane for a job of the given cost
+
+    A requested lane can only move a job to a slower lane, never faster,
+    so cheap lanes stay cheap.
+    """
+    lane = "bulk"
+    for candidate in ("interactive", "standard"):
+        if cost <= LANE_MAX_COST[candidate]:
+            lane = candidate
+            break
+
+    if requested in LANES and LANE_ORDER.index(requested) > LANE_ORDER.index(lane):
+        lane = requested
+    return lane
+
+
+def get_lane_queue(lane):
+    """Get the RQ queue a lane's jobs (and their chunk jobs) run on"""
+    return LANES.get(lane, LANES["bulk"])["queue"]
+
+
+def get_lane_slots(lane):
+    """Get the number of jobs a lane may run at once (site config `ai_lane_slots` overrides)"""
+    overrides = frappe.conf.get("ai_lane_slots") or {}
+    return max(cint(overrides.get(lane, LANES[lane]["slots"])), 1)
+
+
+def is_rq_job_lost(job_id, timeout, dispatched_at):
+    """
+    Check whether an enqueued RQ job can no longer end by itself
+
+    Its RQ job failed, was stopped or no longer exists, or it has been
+    running longer than its timeout plus RUN_GRACE since dispatch (a
+    hard-killed worker leaves the job "started" for good).
+
+    Args:
+        job_id: RQ job id
+        timeout: RQ job timeout in seconds
+        dispatched_at: time.time() when the job was enqueued
+    """
+    from frappe.utils.background_jobs import get_job
+
+    rq_job = get_job(job_id)
+    if not rq_job:
+        return True
+
+    status = rq_job.get_status()
+    if status in LOST_STATUSES:
+        return True
+    return status == "started" and bool(dispatched_at) and time.time() > dispatched_at + cint(timeout) + RUN_GRACE
+
+
+class FairScheduler:
+    """
+    Admission queue for AI jobs
+
+    Jobs wait in a Redis sorted set per lane until the lane has a free slot.
+    Within a lane, tenants (company + user) share the slots by start-time
+    fair queueing: a job's tag is the later of the lane's virtual time and
+    the tenant's previous tag plus the previous job's cost, and the lowest
+    tag runs next. A tenant with many or large jobs therefore cannot hold
+    back other tenants' jobs.
+    Lanes are served in order, so interactive jobs always go first.
+    """
+
+    def __init__(self, key_prefix="ai_scheduler"):
+        self.key_prefix = key_prefix
+
+    def _name(self, suffix):
+        return f"{self.key_prefix}:{suffix}"
+
+    def _key(self, suffix):
+        return frappe.cache().make_key(self._name(suffix))
+
+    def submit(self, job_id, lane, tenant, cost, method, timeout, **kwargs):
+        """
+        Queue a job in its lane; it is enqueued to RQ by `dispatch`
+
+        Args:
+            job_id: Job id (also used as the RQ job id)
+            lane: Key of LANES
+            tenant: Fairness group, e.g. "company|user"
+            cost: Estimated cost of the job
+            method: Dotted path of the job function
+            timeout: RQ job timeout in seconds
+            kwargs: Job function arguments
+        """
+        cache = frappe.cache()
+        virtual_time = flt(cache.hget(self._name("virtual_time"), lane))
+        tag = max(virtual_time, flt(cache.hget(self._name(f"tenants:{lane}"), tenant)))
+
+        cache.hset(self._name(f"tenants:{lane}"), tenant, tag + max(flt(cost), 1))
+        cache.hset(self._name("jobs"), job_id, {
+            "lane": lane,
+            "method": method,
+            "timeout": timeout,
+            "kwargs": kwargs
+        })
+        cache.zadd(self._key(f"pending:{lane}"), {job_id: tag})
+
+    def dispatch(self):
+        """
+        Enqueue waiting jobs into their lane's RQ queue while the lane has free slots
+
+        Returns:
+            int: Number of jobs enqueued
+        """
+        if not self._lock():
+            return 0
+
+        dispatched = 0
+        try:
+            for lane in LANE_ORDER:
+                while len(self.get_running(lane)) < get_lane_slots(lane):
+                    job_id = self._pop(lane)
+                    if not job_id:
+                        break
+                    self._start(job_id, lane)
+                    dispatched += 1
+        finally:
+            frappe.cache().delete(self._key("lock"))
+
+        return dispatched
+
+    def release(self, job_id):
+        """Free the job's slot (or drop it from its lane if it never started) and dispatch waiting jobs"""
+        cache = frappe.cache()
+        for lane in LANE_ORDER:
+            cache.srem(self._name(f"running:{lane}"), job_id)
+            cache.zrem(self._key(f"pending:{lane}"), job_id)
+        cache.hdel(self._name("jobs"), job_id)
+
+        self.dispatch()
+
+    def get_running(self, lane):
+        """Get the job ids holding a slot of the lane"""
+        return [
+            job_id.decode() if isinstance(job_id, bytes) else job_id
+            for job_id in frappe.cache().smembers(self._name(f"running:{lane}"))
+        ]
+
+    def reconcile(self, is_finished, on_lost=None):
+        """
+        Free slots held by jobs that ended without releasing them (e.g. a killed worker)
+
+        Args:
+            is_finished: Callable(job_id) returning True once a job no longer runs
+            on_lost: Callable(job_id) for a job whose worker is gone (see is_lost);
+                it finalizes the job and returns True to free the slot
+        """
+        cache = frappe.cache()
+        for lane in LANE_ORDER:
+            for job_id in self.get_running(lane):
+                if is_finished(job_id) or (on_lost and self.is_lost(job_id) and on_lost(job_id)):
+                    cache.srem(self._name(f"running:{lane}"), job_id)
+                    cache.hdel(self._name("jobs"), job_id)
+
+    def is_lost(self, job_id):
+        """Check whether a dispatched job can no longer end by itself (see is_rq_job_lost)"""
+        entry = frappe.cache().hget(self._name("jobs"), job_id) or {}
+        return is_rq_job_lost(job_id, entry.get("timeout"), flt(entry.get("dispatched_at")))
+
+    def _lock(self, wait=2):
+        """Take the dispatch lock; dispatch holds it only briefly, so wait for it rather than skip"""
+        cache = frappe.cache()
+        give_up = time.time() + wait
+        while not cache.set(self._key("lock"), 1, nx=True, ex=LOCK_TTL):
+            if time.time() > give_up:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _pop(self, lane):
+        """Take the job with the lowest tag from a lane, advancing the lane's virtual time"""
+        cache = frappe.cache()
+        key = self._key(f"pending:{lane}")
+
+        for member, tag in cache.zrange(key, 0, 0, withscores=True):
+            cache.zrem(key, member)
+            cache.hset(self._name("virtual_time"), lane, tag)
+            return member.decode() if isinstance(member, bytes) else member
+        return None
+
+    def _start(self, job_id, lane):
+        cache = frappe.cache()
+        entry = cache.hget(self._name("jobs"), job_id)
+        if not entry:
+            return
+
+        entry["dispatched_at"] = time.time()
+        cache.hset(self._name("jobs"), job_id, entry)
+        # The slot is taken once the RQ job exists, so is_lost never sees a slot without one
+        frappe.enqueue(
+            method=entry["method"],
+            queue=get_lane_queue(lane),
+            timeout=entry["timeout"],
+            job_id=job_id,
+            **entry["kwargs"]
+        )
+        cache.sadd(self._name(f"running:{lane}"), job_id)
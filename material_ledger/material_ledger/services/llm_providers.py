@@ -0,0 +1,317 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+LLM Provider Layer
+One interface for every LLM backend: hosted APIs, self-hosted OpenAI-compatible
+servers and a deterministic offline stub
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt
+import hashlib
+import json
+import requests
+import time
+
+from material_ledger.material_ledger.services.job_control import check_current
+from material_ledger.material_ledger.services.prompt_budget import count_tokens, record_llm_usage
+
+
+# Defaults per provider; Material Ledger Settings and site config `ai_providers` override them
+PROVIDER_DEFAULTS = {
+    "DeepSeek": {
+        "base_url": "https://api.deepseek.com",
+        "model": "deepseek-reasoner",
+        "timeout": 180,
+        "max_concurrency": 4
+    },
+    "OpenAI": {
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-4",
+        "timeout": 120,
+        "max_concurrency": 4
+    },
+    "Local": {
+        "base_url": "http://localhost:8000/v1",
+        "model": "local",
+        "timeout": 60,
+        "max_concurrency": 2
+    },
+    "Stub": {
+        "model": "stub",
+        "timeout": 0,
+        "max_concurrency": 8,
+        "latency_ms": 0
+    }
+}
+
+
+class LLMProviderError(Exception):
+    """Raised when a provider call fails"""
+    pass
+
+
+class LLMProvider:
+    """
+    Base LLM provider
+
+    Subclasses implement `_complete` and `_stream`; token usage and latency
+    are recorded here for every call.
+    """
+
+    requires_api_key = True
+
+    def __init__(self, name, model, api_key=None, base_url=None, timeout=120,
+                 connect_timeout=10, stream_timeout=60, max_concurrency=4, **options):
+        self.name = name
+        self.model = model
+        self.api_key = api_key
+        self.base_url = (base_url or "").rstrip("/")
+        self.timeout = cint(timeout)
+        self.connect_timeout = cint(connect_timeout)
+        self.stream_timeout = cint(stream_timeout)
+        self.max_concurrency = max(cint(max_concurrency), 1)
+        self.options = options
+
+    def is_available(self):
+        """Check if the provider can be called"""
+        return bool(self.api_key) or not self.requires_api_key
+
+    def complete(self, prompt, max_tokens=4000, temperature=0.2):
+        """
+        Run a chat completion
+
+        Args:
+            prompt: Prompt text
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+
+        Returns:
+            dict: content, reasoning (if the model returns it) and usage
+        """
+        # Stop here rather than spend quota on a cancelled or overdue job
+        check_current()
+        started = time.time()
+        result = self._complete(prompt, max_tokens, temperature)
+        record_llm_usage(self.name, self.model, prompt, result.get("content"), result.get("usage"), time.time() - started)
+        return result
+
+    def stream(self, prompt, max_tokens=2000, temperature=0.2):
+        """
+        Stream a chat completion
+
+        Yields:
+            str: Content tokens as they arrive
+        """
+        check_current()
+        started = time.time()
+        tokens = []
+        state = {}
+
+        for token in self._stream(prompt, max_tokens, temperature, state):
+            tokens.append(token)
+            yield token
+
+        record_llm_usage(
+            self.name, self.model, prompt, "".join(tokens), state.get("usage"), time.time() - started, streamed=True
+        )
+
+    def _complete(self, prompt, max_tokens, temperature):
+        raise NotImplementedError
+
+    def _stream(self, prompt, max_tokens, temperature, state):
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Provider for any server implementing the OpenAI chat completions API"""
+
+    def __init__(self, name, model, **kwargs):
+        super().__init__(name, model, **kwargs)
+        self.requires_api_key = name != "Local"
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _payload(self, prompt, max_tokens, temperature, stream=False):
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _complete(self, prompt, max_tokens, temperature):
+        response = requests.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            json=self._payload(prompt, max_tokens, temperature),
+            timeout=(self.connect_timeout, self.timeout)
+        )
+
+        if response.status_code != 200:
+            frappe.log_error(f"{self.name} API Error: {response.text}", "Material Ledger AI")
+            raise LLMProviderError(_("AI analysis temporarily unavailable. Please try again later."))
+
+        result = response.json()
+        message = result['choices'][0]['message']
+        return {
+            "content": message.get('content') or "",
+            "reasoning": message.get('reasoning_content') or "",
+            "usage": result.get('usage')
+        }
+
+    def _stream(self, prompt, max_tokens, temperature, state):
+        # Read timeout applies between streamed chunks, not to the whole answer
+        with requests.post(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            json=self._payload(prompt, max_tokens, temperature, stream=True),
+            stream=True,
+            timeout=(self.connect_timeout, self.stream_timeout)
+        ) as response:
+            if response.status_code != 200:
+                frappe.log_error(f"{self.name} Streaming API Error: {response.text}", "Material Ledger AI")
+                raise LLMProviderError(_("AI analysis temporarily unavailable. Please try again later."))
+
+            for line in response.iter_lines(decode_unicode=True):
+                # Server-sent events: "data: {...}" lines, terminated by "data: [DONE]"
+                if not line or not line.startswith("data:"):
+                    continue
+
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+
+                try:
+                    chunk = json.loads(payload)
+                except ValueError:
+                    continue
+
+                # Providers report usage on the final chunk when they support it
+                state["usage"] = chunk.get("usage") or state.get("usage")
+
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+
+                # Reasoning models also stream reasoning_content; only the answer is forwarded
+                token = (choices[0].get("delta") or {}).get("content")
+                if token:
+                    yield token
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic offline provider for benchmarking the AI pipeline
+
+    Waits `latency_ms` and returns the same response for the same prompt.
+    The default response is a JSON block every AI parser accepts with no
+    findings; set `response` in site config `ai_providers.Stub` to override it.
+    """
+
+    requires_api_key = False
+
+    def respond(self, prompt):
+        """Build the deterministic response for a prompt"""
+        if self.options.get("response"):
+            return self.options["response"]
+
+        body = {
+            "stub": True,
+            "digest": hashlib.sha1((prompt or "").encode("utf-8")).hexdigest()[:12],
+            "prompt_tokens": count_tokens(prompt),
+            "anomalies": [],
+            "predictions": [],
+            "summary": "Stub response"
+        }
+        return f"```json\n{json.dumps(body)}\n```"
+
+    def _sleep(self):
+        latency = flt(self.options.get("latency_ms"))
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def _complete(self, prompt, max_tokens, temperature):
+        self._sleep()
+        content = self.respond(prompt)
+        return {
+            "content": content,
+            "reasoning": "",
+            "usage": {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(content)}
+        }
+
+    def _stream(self, prompt, max_tokens, temperature, state):
+        # Latency is spent before the first token, like time-to-first-token of a real server
+        self._sleep()
+        content = self.respond(prompt)
+        state["usage"] = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(content)}
+        for word in content.split(" "):
+            yield word + " "
+
+
+PROVIDER_CLASSES = {
+    "DeepSeek": OpenAICompatibleProvider,
+    "OpenAI": OpenAICompatibleProvider,
+    "Local": OpenAICompatibleProvider,
+    "Stub": StubProvider
+}
+
+
+def get_provider_config(provider, settings=None):
+    """
+    Resolve configuration for a provider
+
+    Precedence: provider defaults, then Material Ledger Settings (which
+    configure the active provider), then site config `ai_providers[provider]`.
+
+    Returns:
+        dict: Provider constructor keyword arguments (without api_key)
+    """
+    config = dict(PROVIDER_DEFAULTS.get(provider, PROVIDER_DEFAULTS["Local"]))
+
+    if settings and settings.get("ai_provider") == provider:
+        overrides = {
+            "model": settings.get("ai_model"),
+            "base_url": settings.get("ai_base_url"),
+            "timeout": settings.get("ai_request_timeout"),
+            "max_concurrency": settings.get("ai_max_concurrency"),
+            "latency_ms": settings.get("ai_stub_latency_ms")
+        }
+        config.update({key: value for key, value in overrides.items() if value})
+
+    site_overrides = (frappe.conf.get("ai_providers") or {}).get(provider) or {}
+    config.update(site_overrides)
+    return config
+
+
+def build_provider(provider, model=None, api_key=None, settings=None):
+    """
+    Create a provider instance
+
+    Args:
+        provider: Provider name (DeepSeek, OpenAI, Local, Stub)
+        model: Model override
+        api_key: API key, if the provider needs one
+        settings: Material Ledger Settings dict
+
+    Returns:
+        LLMProvider
+    """
+    if provider not in PROVIDER_CLASSES:
+        raise LLMProviderError(_("AI provider not configured properly."))
+
+    config = get_provider_config(provider, settings)
+    if model:
+        config["model"] = model
+    config.setdefault("api_key", api_key)
+
+    return PROVIDER_CLASSES[provider](provider, **config)
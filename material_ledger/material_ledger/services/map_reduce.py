@@ -0,0 +1,442 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Map-Reduce Execution for Chunked AI Jobs
+The parent job stores chunks in Redis and enqueues one job per chunk; the
+last chunk to finish enqueues the reduce job that merges partial results
+"""
+
+import frappe
+from frappe.utils import cint
+from functools import partial
+import json
+import pickle
+import time
+import zlib
+
+from material_ledger.material_ledger.services import job_control
+from material_ledger.material_ledger.services.job_control import JobCancelled, JobControl
+from material_ledger.material_ledger.services.job_progress import JobProgress
+from material_ledger.material_ledger.services.job_scheduler import get_lane_queue, is_rq_job_lost
+
+
+STORE_TTL = 7200  # Seconds chunk inputs and partial results (checkpoints) are kept
+CHUNK_TIMEOUT = 900
+CHUNK_RETRY_QUEUE = "ai_chunk_retries"  # Sorted set of chunk retries scored by due time
+
+
+def _map_anomaly_chunk(chunk, context=None):
+    from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+    from material_ledger.material_ledger.services.concurrency import RateBudget, get_concurrency_settings
+
+    _, rate_limit = get_concurrency_settings()
+    context = context or {}
+    return AIAnomalyService().detect_chunk_anomalies(
+        chunk, budget=RateBudget("llm", rate_limit),
+        baseline=context.get("baseline"), use_ai=context.get("use_ai", True)
+    )
+
+
+def _reduce_anomalies(partials, context=None):
+    from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+
+    context = context or {}
+    anomalies = []
+    for part in partials:
+        anomalies.extend(part)
+    return AIAnomalyService().generate_anomaly_report(anomalies, context.get("job_id"), context.get("company"))
+
+
+def _map_prediction_chunk(chunk, context=None):
+    from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
+
+    return AIPredictionService().predict_chunk(chunk)
+
+
+def _reduce_predictions(partials, context=None):
+    from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
+
+    return AIPredictionService().combine_predictions(partials)
+
+
+# Map and reduce steps per job type, plus the progress range the chunks cover
+MAP_REDUCE_JOBS = {
+    "anomaly_detection": {
+        "map": _map_anomaly_chunk,
+        "reduce": _reduce_anomalies,
+        "progress": (50, 40)
+    },
+    "financial_prediction": {
+        "map": _map_prediction_chunk,
+        "reduce": _reduce_predictions,
+        "progress": (40, 50)
+    }
+}
+
+
+def _sadd_count(cache, key, member):
+    """
+    SADD returning the number of members added
+
+    RedisWrapper.sadd prefixes the key itself and discards the reply, so the
+    command is sent as is on the made key.
+    """
+    return cache.execute_command("SADD", key, member)
+
+
+class ChunkStore:
+    """
+    Redis storage for the chunk inputs, partial results and bookkeeping of one job
+
+    Partial results double as checkpoints: a retried job or chunk skips
+    every chunk whose result is already stored.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def _name(self, suffix):
+        return f"ai_map_reduce:{self.job_id}:{suffix}"
+
+    def _key(self, suffix):
+        return frappe.cache().make_key(self._name(suffix))
+
+    def _put(self, suffix, value):
+        # Chunks keep their Python types (dates, Decimals); zlib keeps them compact
+        frappe.cache().set(self._key(suffix), zlib.compress(pickle.dumps(value)), ex=STORE_TTL)
+
+    def _load(self, suffix):
+        raw = frappe.cache().get(self._key(suffix))
+        return pickle.loads(zlib.decompress(raw)) if raw else None
+
+    def save_meta(self, meta):
+        self._put("meta", meta)
+
+    def get_meta(self):
+        return self._load("meta")
+
+    def save_input(self, index, chunk):
+        self._put(f"input:{index}", chunk)
+
+    def get_input(self, index):
+        return self._load(f"input:{index}")
+
+    def save_result(self, index, result):
+        self._put(f"result:{index}", result)
+
+    def get_result(self, index):
+        return self._load(f"result:{index}")
+
+    def get_results(self, total):
+        return [self._load(f"result:{index}") for index in range(total)]
+
+    def save_prelude(self, result):
+        """Store the partial result computed by the parent job over the whole dataset"""
+        self._put("prelude", result)
+
+    def get_prelude(self):
+        return self._load("prelude")
+
+    def save_context(self, context):
+        """Store the data the parent job computed for every chunk's map step"""
+        self._put("context", context)
+
+    def get_context(self):
+        return self._load("context")
+
+    def mark_done(self, index):
+        """
+        Record a finished chunk
+
+        Returns:
+            int: Number of finished chunks, or None if this chunk was already counted
+        """
+        cache = frappe.cache()
+        if not _sadd_count(cache, self._key("done"), index):
+            return None
+        cache.expire(self._key("done"), STORE_TTL)
+        done = cache.incr(self._key("done_count"))
+        cache.expire(self._key("done_count"), STORE_TTL)
+        return done
+
+    def get_done(self):
+        """Get the indexes of the finished chunks"""
+        return {int(index) for index in frappe.cache().smembers(self._name("done"))}
+
+    def record_run(self, step, attempt):
+        """Record the enqueue time and attempt of a chunk index or the "reduce" step"""
+        cache = frappe.cache()
+        cache.hset(self._name("runs"), step, {"attempt": attempt, "dispatched_at": time.time()})
+        cache.expire(self._key("runs"), STORE_TTL)
+
+    def get_run(self, step):
+        return frappe.cache().hget(self._name("runs"), step)
+
+    def mark_failed(self):
+        frappe.cache().set(self._key("failed"), 1, ex=STORE_TTL)
+
+    def is_failed(self):
+        return bool(frappe.cache().get(self._key("failed")))
+
+    def clear(self, total):
+        suffixes = ["meta", "prelude", "context", "done", "done_count", "failed", "runs"]
+        suffixes += [f"input:{index}" for index in range(total)]
+        suffixes += [f"result:{index}" for index in range(total)]
+        frappe.cache().delete(*[self._key(suffix) for suffix in suffixes])
+
+
+def use_map_reduce(chunks):
+    """Check whether a chunked job should fan out to chunk workers"""
+    from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+
+    return len(chunks) > 1 and bool(MaterialLedgerSettings.get_settings().get("ai_map_reduce"))
+
+
+def dispatch_chunks(ai_job_id, job_type, chunks, prelude=None, context=None):
+    """
+    Store chunks and enqueue one chunk job per chunk
+
+    Args:
+        ai_job_id: AI Job Queue job id
+        job_type: Key of MAP_REDUCE_JOBS
+        chunks: List of data chunks
+        prelude: Optional partial result the parent job computed over all
+            chunks; it is reduced ahead of the chunk results
+        context: Optional data the parent job computed over all chunks that
+            every map step receives, e.g. a dataset-wide baseline
+    """
+    job_doc = frappe.db.get_value("AI Job Queue", ai_job_id, ["user", "cache_key", "priority_lane"], as_dict=True)
+
+    # Chunk jobs run on the RQ queue of the parent job's lane
+    queue = get_lane_queue(job_doc.priority_lane)
+    store = ChunkStore(ai_job_id)
+    store.save_meta({
+        "job_type": job_type,
+        "total": len(chunks),
+        "user": job_doc.user,
+        "cache_key": job_doc.cache_key,
+        "queue": queue
+    })
+    for index, chunk in enumerate(chunks):
+        store.save_input(index, chunk)
+    if prelude is not None:
+        store.save_prelude(prelude)
+    if context is not None:
+        store.save_context(context)
+
+    for index in range(len(chunks)):
+        _enqueue_chunk(ai_job_id, index, attempt=0, queue=queue)
+
+
+def _schedule_chunk_retry(ai_job_id, index, attempt, queue):
+    """Queue a chunk retry for the retry sweep once its backoff has passed"""
+    from material_ledger.material_ledger.services.queue_service import get_retry_delay
+
+    cache = frappe.cache()
+    member = json.dumps({"ai_job_id": ai_job_id, "index": index, "attempt": attempt, "queue": queue})
+    cache.zadd(cache.make_key(CHUNK_RETRY_QUEUE), {member: time.time() + get_retry_delay(attempt - 1)})
+
+
+def enqueue_due_chunk_retries():
+    """Enqueue chunk retries whose backoff has passed (called by the retry sweep)"""
+    cache = frappe.cache()
+    key = cache.make_key(CHUNK_RETRY_QUEUE)
+
+    for member in cache.zrangebyscore(key, 0, time.time()):
+        # Only the sweep that removes the entry enqueues it
+        if not cache.zrem(key, member):
+            continue
+        retry = json.loads(member)
+        _enqueue_chunk(retry["ai_job_id"], retry["index"], retry["attempt"], retry["queue"])
+
+
+def recover_lost_chunks():
+    """
+    Re-enqueue chunk and reduce jobs whose worker died (called by the retry sweep)
+
+    A chunk killed by its timeout or with its worker never marks itself done
+    or failed, so the job would wait for it forever. Once the RQ job of an
+    unfinished chunk is lost (see is_rq_job_lost) and no retry of it is
+    pending, it runs again as its next attempt; after max_retries attempts
+    the whole job fails. A lost reduce job runs again.
+    """
+    from material_ledger.material_ledger.services.queue_service import AIQueueService, fail_ai_job
+
+    cache = frappe.cache()
+    pending = {
+        (retry["ai_job_id"], retry["index"])
+        for retry in map(json.loads, cache.zrange(cache.make_key(CHUNK_RETRY_QUEUE), 0, -1))
+    }
+    max_retries = AIQueueService().max_retries
+
+    for ai_job_id in frappe.get_all("AI Job Queue", filters={"status": "processing"}, pluck="job_id"):
+        store = ChunkStore(ai_job_id)
+        meta = store.get_meta()
+        # In-process chunked jobs store a meta for their checkpoints too, without a job type
+        if not meta or not meta.get("job_type") or store.is_failed():
+            continue
+
+        total = cint(meta["total"])
+        done = store.get_done()
+        if len(done) == total:
+            run = store.get_run("reduce")
+            if run and is_rq_job_lost(_reduce_job_id(ai_job_id), CHUNK_TIMEOUT, run["dispatched_at"]):
+                _enqueue_reduce(ai_job_id, meta["queue"])
+            continue
+
+        for index in range(total):
+            run = store.get_run(index)
+            if index in done or (ai_job_id, index) in pending or not run:
+                continue
+            if not is_rq_job_lost(_chunk_job_id(ai_job_id, index), CHUNK_TIMEOUT, run["dispatched_at"]):
+                continue
+
+            if run["attempt"] < max_retries:
+                frappe.log_error(
+                    f"AI chunk {index} of job {ai_job_id} was lost (attempt {run['attempt'] + 1}), retrying",
+                    "AI Map Reduce"
+                )
+                _enqueue_chunk(ai_job_id, index, run["attempt"] + 1, meta["queue"])
+                continue
+
+            store.mark_failed()
+            fail_ai_job(
+                ai_job_id, meta["job_type"], meta["user"],
+                f"Chunk {index + 1} of {total} was lost after {run['attempt'] + 1} attempts"
+            )
+            store.clear(total)
+            break
+
+
+def _chunk_job_id(ai_job_id, index):
+    return f"{ai_job_id}:chunk:{index}"
+
+
+def _reduce_job_id(ai_job_id):
+    return f"{ai_job_id}:reduce"
+
+
+def _enqueue_chunk(ai_job_id, index, attempt, queue):
+    # A fixed RQ job id per chunk lets the watchdog look up the chunk's latest attempt
+    ChunkStore(ai_job_id).record_run(index, attempt)
+    frappe.enqueue(
+        method="material_ledger.material_ledger.services.map_reduce.process_ai_chunk",
+        queue=queue,
+        timeout=CHUNK_TIMEOUT,
+        job_id=_chunk_job_id(ai_job_id, index),
+        ai_job_id=ai_job_id,
+        index=index,
+        attempt=attempt
+    )
+
+
+def _enqueue_reduce(ai_job_id, queue):
+    ChunkStore(ai_job_id).record_run("reduce", 0)
+    frappe.enqueue(
+        method="material_ledger.material_ledger.services.map_reduce.process_ai_reduce",
+        queue=queue,
+        timeout=CHUNK_TIMEOUT,
+        job_id=_reduce_job_id(ai_job_id),
+        ai_job_id=ai_job_id
+    )
+
+
+def process_ai_chunk(ai_job_id, index, attempt=0):
+    """
+    Chunk worker: run the map step for one chunk
+
+    A chunk that fails transiently is retried on its own with backoff, up to
+    the queue service's max_retries; after that, or on any other error, the
+    whole job fails. A chunk whose result is already stored is not
+    recomputed. The chunk that completes the set enqueues the reduce job.
+    Once the job is cancelled, remaining chunks exit without doing any work.
+    """
+    from material_ledger.material_ledger.services.queue_service import (
+        AIQueueService, _get_job_watchers, cancel_ai_job_run, fail_ai_job, is_transient_error
+    )
+
+    store = ChunkStore(ai_job_id)
+    meta = store.get_meta()
+    if not meta or store.is_failed():
+        return
+
+    spec = MAP_REDUCE_JOBS[meta["job_type"]]
+    control = JobControl(ai_job_id)
+    job_control.activate(control)
+
+    try:
+        control.check()
+        if store.get_result(index) is None:
+            result = spec["map"](store.get_input(index), store.get_context())
+            store.save_result(index, result)
+    except JobCancelled as e:
+        store.mark_failed()
+        cancel_ai_job_run(ai_job_id, meta["job_type"], meta["user"], e.reason)
+        store.clear(meta["total"])
+        return
+    except Exception as e:
+        if is_transient_error(e) and attempt < AIQueueService().max_retries:
+            frappe.log_error(
+                f"AI chunk {index} of job {ai_job_id} failed (attempt {attempt + 1}), retrying: {str(e)}",
+                "AI Map Reduce"
+            )
+            _schedule_chunk_retry(ai_job_id, index, attempt + 1, meta["queue"])
+            return
+
+        store.mark_failed()
+        fail_ai_job(
+            ai_job_id, meta["job_type"], meta["user"],
+            f"Chunk {index + 1} of {meta['total']} failed after {attempt + 1} attempts: {str(e)}"
+        )
+        store.clear(meta["total"])
+        return
+
+    done = store.mark_done(index)
+    if done is None:
+        return
+
+    total = meta["total"]
+    start, span = spec["progress"]
+    # Persist to the database only when crossing a 10% step of the chunk range
+    crossed = (done * 10) // total != ((done - 1) * 10) // total
+    progress = JobProgress(ai_job_id, partial(_get_job_watchers, meta["cache_key"], meta["user"]))
+    progress.update(start + span * done / total, force=crossed, persist=crossed)
+
+    if done == total:
+        _enqueue_reduce(ai_job_id, meta["queue"])
+
+
+def process_ai_reduce(ai_job_id):
+    """Reduce worker: merge partial results in chunk order and complete the job"""
+    from material_ledger.material_ledger.services.queue_service import (
+        cancel_ai_job_run, complete_ai_job, fail_ai_job
+    )
+
+    store = ChunkStore(ai_job_id)
+    meta = store.get_meta()
+    if not meta:
+        return
+
+    total = cint(meta["total"])
+    control = JobControl(ai_job_id)
+    job_control.activate(control)
+    try:
+        control.check()
+        partials = store.get_results(total)
+        if any(part is None for part in partials):
+            raise ValueError("Partial results expired before the reduce step")
+
+        prelude = store.get_prelude()
+        if prelude is not None:
+            partials = [prelude, *partials]
+
+        result = MAP_REDUCE_JOBS[meta["job_type"]]["reduce"](partials, store.get_context())
+    except JobCancelled as e:
+        cancel_ai_job_run(ai_job_id, meta["job_type"], meta["user"], e.reason)
+    except Exception as e:
+        fail_ai_job(ai_job_id, meta["job_type"], meta["user"], str(e))
+    else:
+        complete_ai_job(ai_job_id, meta["job_type"], meta["user"], result)
+    finally:
+        store.clear(total)
@@ -0,0 +1,57 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Fitted Model Cache
+Fitted parameters of forecasting models kept in Redis under a fingerprint of
+the input series and the method version, so unchanged series are not refit
+"""
+
+import frappe
+import hashlib
+import numpy as np
+import pickle
+
+
+MODEL_CACHE_TTL = 30 * 24 * 3600  # Seconds fitted parameters are kept
+
+
+class FittedModelCache:
+    """
+    Fitted parameters of one forecasting method, per input series
+
+    A series' fingerprint hashes its values together with the method name
+    and version and any fit context (such as the calendar month the series
+    starts at). Any change to the history, including a new or revised
+    latest month, gives a new fingerprint and a refit; bumping the version
+    retires every cached fit of the method.
+    """
+
+    def __init__(self, method, version, ttl=MODEL_CACHE_TTL):
+        self.method = method
+        self.version = version
+        self.ttl = ttl
+
+    def fingerprint(self, series, *context):
+        digest = hashlib.sha1(f"{self.method}|{self.version}|{context}".encode())
+        digest.update(np.ascontiguousarray(series, dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def _key(self, fingerprint):
+        return frappe.cache().make_key(f"ml_fitted_model:{self.method}:{fingerprint}")
+
+    def get_many(self, fingerprints):
+        """Cached parameters per fingerprint, None where missing (one round trip)"""
+        if not fingerprints:
+            return []
+        raw = frappe.cache().mget([self._key(fingerprint) for fingerprint in fingerprints])
+        return [pickle.loads(value) if value else None for value in raw]
+
+    def set_many(self, fitted):
+        """Store parameters per fingerprint (one round trip)"""
+        if not fitted:
+            return
+        pipeline = frappe.cache().pipeline()
+        for fingerprint, params in fitted.items():
+            pipeline.set(self._key(fingerprint), pickle.dumps(params), ex=self.ttl)
+        pipeline.execute()
@@ -0,0 +1,258 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Prompt Budget Service
+Token counting, per-provider prompt budgets and deterministic prompt compaction
+"""
+
+import frappe
+from frappe.utils import cint, flt, now
+import json
+import math
+import statistics
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+
+# Prompt token budgets per provider (excluding the response)
+PROVIDER_PROMPT_BUDGETS = {
+    "DeepSeek": 6000,
+    "OpenAI": 6000,
+    "Local": 3000
+}
+DEFAULT_PROMPT_BUDGET = 4000
+
+# Number of recent LLM calls kept for latency tuning
+USAGE_LOG_SIZE = 1000
+
+
+def count_tokens(text):
+    """
+    Count prompt tokens
+
+    Uses tiktoken when installed; otherwise estimates from the UTF-8 size
+    (about 4 bytes per token, which also holds for Arabic at ~2 chars per token).
+    """
+    if not text:
+        return 0
+    if _ENCODING:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text.encode("utf-8")) / 4)
+
+
+class PromptBudget:
+    """Deterministic prompt compaction within a per-provider token budget"""
+
+    def __init__(self, provider=None, max_prompt_tokens=None):
+        self.provider = provider
+        self.max_prompt_tokens = max_prompt_tokens or self._get_budget(provider)
+
+    def _get_budget(self, provider):
+        """Get prompt budget for provider (site config `ai_prompt_budgets` overrides defaults)"""
+        overrides = frappe.conf.get("ai_prompt_budgets") or {}
+        if provider in overrides:
+            return cint(overrides[provider])
+        return PROVIDER_PROMPT_BUDGETS.get(provider, DEFAULT_PROMPT_BUDGET)
+
+    def count_tokens(self, text):
+        """Count tokens in text"""
+        return count_tokens(text)
+
+    def truncate_text(self, text, max_tokens, marker="…"):
+        """Truncate text to at most max_tokens, cutting at a line or word boundary"""
+        text = text or ""
+        if max_tokens <= 0:
+            return ""
+        if count_tokens(text) <= max_tokens:
+            return text
+
+        # Binary search the longest prefix that fits
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if count_tokens(text[:mid]) + 1 <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+
+        cut = text[:low]
+        boundary = max(cut.rfind("\n"), cut.rfind(" "))
+        if boundary > len(cut) // 2:
+            cut = cut[:boundary]
+        return cut.rstrip() + marker
+
+    def truncate_history(self, history, max_turns=3, max_tokens_per_message=150):
+        """
+        Keep the last max_turns chat exchanges, each message truncated
+
+        Args:
+            history: List of {"user": ..., "assistant": ...} dicts
+            max_turns: Number of recent exchanges to keep
+            max_tokens_per_message: Token cap for each message
+
+        Returns:
+            list: Compacted history
+        """
+        if not history:
+            return []
+
+        compacted = []
+        for turn in history[-max_turns:]:
+            if not isinstance(turn, dict):
+                continue
+            compacted.append({
+                "user": self.truncate_text(str(turn.get("user") or ""), max_tokens_per_message),
+                "assistant": self.truncate_text(str(turn.get("assistant") or ""), max_tokens_per_message)
+            })
+        return compacted
+
+    def top_n(self, items, n, key):
+        """Keep the n largest items by key, ties broken by original order"""
+        indexed = sorted(enumerate(items), key=lambda pair: (-key(pair[1]), pair[0]))
+        return [item for _, item in indexed[:n]]
+
+    def summarize_series(self, values):
+        """
+        Summarize a numeric series into a fixed-size dict
+
+        Returns:
+            dict: count, mean, min, max, first, last and linear trend per step
+        """
+        values = [flt(v) for v in values or []]
+        if not values:
+            return {"count": 0, "mean": 0, "min": 0, "max": 0, "first": 0, "last": 0, "trend": 0}
+
+        n = len(values)
+        trend = 0
+        if n > 1:
+            x_mean = (n - 1) / 2
+            y_mean = statistics.mean(values)
+            denominator = sum((i - x_mean) ** 2 for i in range(n))
+            trend = sum((i - x_mean) * (v - y_mean) for i, v in enumerate(values)) / denominator
+
+        return {
+            "count": n,
+            "mean": statistics.mean(values),
+            "min": min(values),
+            "max": max(values),
+            "first": values[0],
+            "last": values[-1],
+            "trend": trend
+        }
+
+    def compact_series(self, rows, keep_last=6):
+        """
+        Split a long series into the recent rows kept verbatim and the older rows to summarize
+
+        Returns:
+            tuple: (older_rows, recent_rows)
+        """
+        rows = rows or []
+        if len(rows) <= keep_last:
+            return [], list(rows)
+        return list(rows[:-keep_last]), list(rows[-keep_last:])
+
+    def compose(self, header, sections, footer):
+        """
+        Assemble a prompt within budget
+
+        The header and footer (role and instructions) are always kept. Data
+        sections are added in priority order; the first one that does not fit
+        is truncated and the rest are dropped.
+
+        Args:
+            header: Leading text, always kept
+            sections: List of data section strings, most important first
+            footer: Trailing instructions, always kept
+
+        Returns:
+            str: Prompt text
+        """
+        remaining = self.max_prompt_tokens - count_tokens(header) - count_tokens(footer)
+        parts = [header]
+
+        for section in sections:
+            if not section:
+                continue
+            if remaining <= 0:
+                break
+
+            cost = count_tokens(section)
+            if cost > remaining:
+                section = self.truncate_text(section, remaining)
+                cost = remaining
+
+            parts.append(section)
+            remaining -= cost
+
+        parts.append(footer)
+        return "\n".join(parts)
+
+
+def get_prompt_budget():
+    """Get prompt budget for the configured AI provider"""
+    from material_ledger.material_ledger.services.ai_service import get_ai_service
+
+    return PromptBudget(get_ai_service().provider)
+
+
+def record_llm_usage(provider, model, prompt, response_text=None, usage=None, latency=None, streamed=False):
+    """
+    Record prompt and response token counts for one LLM call
+
+    Provider-reported usage is used when available, otherwise tokens are counted locally.
+    Failures never affect the caller.
+    """
+    try:
+        usage = usage or {}
+        entry = {
+            "provider": provider,
+            "model": model,
+            "prompt_tokens": cint(usage.get("prompt_tokens")) or count_tokens(prompt),
+            "response_tokens": cint(usage.get("completion_tokens")) or count_tokens(response_text),
+            "latency_ms": int(flt(latency) * 1000) if latency is not None else None,
+            "streamed": streamed,
+            "timestamp": now()
+        }
+
+        cache = frappe.cache()
+        cache.lpush("ai_llm_usage", json.dumps(entry))
+        cache.ltrim("ai_llm_usage", 0, USAGE_LOG_SIZE - 1)
+    except Exception:
+        pass
+
+
+@frappe.whitelist()
+def get_llm_usage_stats(limit=200):
+    """
+    Get token and latency statistics for recent LLM calls
+
+    Returns:
+        dict: Per-provider averages plus the raw recent calls
+    """
+    frappe.only_for("System Manager")
+
+    raw = frappe.cache().lrange("ai_llm_usage", 0, cint(limit) - 1) or []
+    calls = [json.loads(r) for r in raw]
+
+    by_provider = {}
+    for call in calls:
+        by_provider.setdefault(call.get("provider") or "unknown", []).append(call)
+
+    stats = {}
+    for provider, provider_calls in by_provider.items():
+        latencies = [c["latency_ms"] for c in provider_calls if c.get("latency_ms") is not None]
+        stats[provider] = {
+            "calls": len(provider_calls),
+            "avg_prompt_tokens": statistics.mean(c["prompt_tokens"] for c in provider_calls),
+            "avg_response_tokens": statistics.mean(c["response_tokens"] for c in provider_calls),
+            "max_prompt_tokens": max(c["prompt_tokens"] for c in provider_calls),
+            "avg_latency_ms": statistics.mean(latencies) if latencies else None
+        }
+
+    return {"providers": stats, "calls": calls}
@@ -8,17 +8,35 @@ Handles data chunking, queue management, and background jobs
 
 import frappe
 from frappe import _
-from frappe.utils import now, now_datetime, add_days, cint, flt
+from frappe.utils import now, now_datetime, add_days, add_to_date, cint, flt
 import json
 import uuid
 import hashlib
 import datetime
+import pickle
+from functools import partial
+
+from material_ledger.material_ledger.services import job_control
+from material_ledger.material_ledger.services.job_control import JobCancelled, JobControl
+from material_ledger.material_ledger.services.job_progress import JobProgress, get_progress, set_progress
+from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+from material_ledger.material_ledger.services.job_scheduler import FairScheduler, classify_lane, estimate_job_cost
+
+
+# Returned by a job processor that handed its chunks to chunk workers
+DISTRIBUTED = object()
+
+RETRY_BACKOFF_BASE = 30  # Seconds before the first retry; doubles with every attempt
+JOB_TIMEOUT = 3600
 
 
 def _json_serial(obj):
     """JSON serializer for objects not serializable by default"""
     if isinstance(obj, (datetime.date, datetime.datetime)):
         return obj.isoformat()
+    if hasattr(obj, "as_dict"):
+        # Compact records such as anomaly TransactionRow
+        return obj.as_dict()
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
@@ -29,7 +47,7 @@ class AIQueueService:
         self.chunk_size = 1000  # Records per chunk
         self.max_retries = 3
     
-    def create_ai_job(self, job_type, company, filters, user=None):
+    def create_ai_job(self, job_type, company, filters, user=None, priority=None):
         """
         Create a new AI processing job
         
@@ -38,6 +56,8 @@ class AIQueueService:
             company: Company name
             filters: Dictionary of filters
             user: User requesting the job
+            priority: Optional lane (interactive, standard, bulk); can only
+                lower the lane picked from the estimated cost
             
         Returns:
             dict: Job details with job_id
@@ -60,6 +80,27 @@ class AIQueueService:
                 "from_cache": True
             }
         
+        # Attach to an identical job that is already queued or running
+        registry = InFlightRegistry()
+        owner_job_id, is_new = registry.claim(
+            cache_key, job_id, ttl=3600, is_stale=self._is_job_finished
+        )
+        if not is_new:
+            registry.add_watcher(cache_key, user)
+            status = self.get_job_status(owner_job_id)
+            return {
+                "status": status.get("status", "queued"),
+                "job_id": owner_job_id,
+                "progress": status.get("progress", 0),
+                "attached": True,
+                "message": _("An identical AI analysis is already running. You will be notified when complete.")
+            }
+        registry.add_watcher(cache_key, user)
+        
+        # Cheap jobs go to faster lanes; the estimate is a row count, not a data fetch
+        cost = estimate_job_cost(job_type, company, filters)
+        lane = classify_lane(cost, priority)
+        
         # Create job document
         job_doc = frappe.get_doc({
             "doctype": "AI Job Queue",
@@ -70,25 +111,25 @@ class AIQueueService:
             "user": user,
             "status": "queued",
             "cache_key": cache_key,
+            "priority_lane": lane,
+            "estimated_cost": cost,
             "created_at": now()
         })
         job_doc.insert()
+        set_progress(job_id, {"status": "queued", "progress": 0})
         
-        # Queue the job for background processing
-        frappe.enqueue(
-            method="material_ledger.material_ledger.services.queue_service.process_ai_job",
-            queue="long",
-            timeout=3600,  # 1 hour
-            ai_job_id=job_id,
-            job_type=job_type,
-            company=company,
-            filters=filters,
+        # Queue the job in its lane; the scheduler enqueues it once the lane has a free slot
+        submit_ai_job(job_id, job_type, company, filters, user, lane, cost)
+        frappe.publish_realtime(
+            event="ai_job_queued",
+            message={"job_id": job_id, "job_type": job_type, "status": "queued", "lane": lane},
             user=user
         )
         
         return {
             "status": "queued",
             "job_id": job_id,
+            "lane": lane,
             "message": _("AI analysis started in background. You will be notified when complete.")
         }
     
@@ -97,6 +138,23 @@ class AIQueueService:
         key_data = f"{job_type}:{company}:{json.dumps(filters, sort_keys=True)}"
         return hashlib.md5(key_data.encode()).hexdigest()
     
+    def _get_deadline_seconds(self):
+        """Get the per-job deadline from Material Ledger Settings (0 = no deadline)"""
+        from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+        
+        return cint(MaterialLedgerSettings.get_settings().get("ai_job_deadline_minutes")) * 60
+    
+    def _is_job_finished(self, job_id):
+        """
+        Check whether a registered job is no longer queued or processing
+        
+        A job without a document counts as running: its insert is not
+        committed yet. A request that died before committing holds its claim
+        only until the claim's TTL runs out.
+        """
+        status = frappe.db.get_value("AI Job Queue", {"job_id": job_id}, "status")
+        return status is not None and status not in ("queued", "processing")
+    
     def _get_cached_result(self, cache_key):
         """Get cached result if exists and not expired"""
         if frappe.db.exists("AI Result Cache", cache_key):
@@ -124,18 +182,37 @@ class AIQueueService:
             })
             cache_doc.insert(ignore_permissions=True)
     
-    def get_job_status(self, job_id):
-        """Get current job status"""
-        job_name = frappe.db.get_value("AI Job Queue", {"job_id": job_id}, "name")
-        if not job_name:
+    def get_job_status(self, job_id, include_result=False):
+        """
+        Get current job status
+        
+        Status comes from the Redis progress hash while it exists; the
+        database is only read for the result body or once the hash expired.
+        
+        Args:
+            job_id: AI job id
+            include_result: Also return the parsed result of a completed job
+        """
+        fast = get_progress(job_id)
+        if fast and not (include_result and fast.get("status") == "completed"):
+            return {
+                "status": fast.get("status"),
+                "progress": cint(fast.get("progress")),
+                "stage": fast.get("stage"),
+                "result": None,
+                "error": fast.get("error")
+            }
+        
+        fields = ["status", "progress", "error"] + (["result"] if include_result else [])
+        job = frappe.db.get_value("AI Job Queue", {"job_id": job_id}, fields, as_dict=True)
+        if not job:
             return {"status": "not_found"}
-            
-        job_doc = frappe.get_doc("AI Job Queue", job_name)
+        
         return {
-            "status": job_doc.status,
-            "progress": job_doc.progress or 0,
-            "result": json.loads(job_doc.result) if job_doc.result else None,
-            "error": job_doc.error
+            "status": job.status,
+            "progress": job.progress or 0,
+            "result": json.loads(job.result) if include_result and job.result else None,
+            "error": job.error
         }
     
     def chunk_data(self, data, chunk_size=None):
@@ -162,182 +239,469 @@ def process_ai_job(ai_job_id, job_type, company, filters, user):
     """
     Background job processor for AI analysis
     
-    This function runs in the background and processes the AI job
+    This function runs in the background and processes the AI job.
+    Chunked jobs may be handed off to chunk workers, in which case the
+    reduce job completes them.
     """
+    control = JobControl(ai_job_id)
+    job_control.activate(control)
+    
+    # The deadline runs from dispatch, not submission: jobs may wait long for a bulk lane slot.
+    # Jobs nobody waits for any more stop at their deadline instead of holding a worker
+    control.set_deadline(AIQueueService()._get_deadline_seconds())
+    
     try:
+        # A job cancelled while still queued never starts
+        control.check()
+        
         # Update job status
         job_doc = frappe.get_doc("AI Job Queue", {"job_id": ai_job_id})
         job_doc.status = "processing"
         job_doc.started_at = now()
         job_doc.save()
+        frappe.db.commit()
         
-        # Get queue service
-        queue_service = AIQueueService()
+        # Watchers are re-read per update: users attach through the in-flight registry while the job runs
+        progress = JobProgress(ai_job_id, partial(_get_job_watchers, job_doc.cache_key, user))
+        progress.update(0, status="processing")
         
         # Process based on job type
         if job_type == "financial_prediction":
-            result = process_financial_prediction(company, filters, job_doc)
+            result = process_financial_prediction(company, filters, progress)
         elif job_type == "anomaly_detection":
-            result = process_anomaly_detection(company, filters, job_doc)
+            result = process_anomaly_detection(company, filters, progress)
         elif job_type == "investment_analysis":
-            result = process_investment_analysis(company, filters, job_doc)
+            result = process_investment_analysis(company, filters, progress)
         elif job_type == "comprehensive_analysis":
-            result = process_comprehensive_analysis(company, filters, job_doc)
+            result = process_comprehensive_analysis(company, filters, progress)
+        elif job_type == "dimension_forecast":
+            from material_ledger.material_ledger.services.dimension_forecast import process_dimension_forecast
+            result = process_dimension_forecast(company, filters, progress)
         else:
             raise ValueError(f"Unknown job type: {job_type}")
         
-        # Update job completion
+        if result is DISTRIBUTED:
+            return
+        
+        complete_ai_job(ai_job_id, job_type, user, result)
+        
+    except JobCancelled as e:
+        cancel_ai_job_run(ai_job_id, job_type, user, e.reason)
+        
+    except Exception as e:
+        if not (is_transient_error(e) and schedule_ai_job_retry(ai_job_id, str(e))):
+            fail_ai_job(ai_job_id, job_type, user, str(e))
+
+
+def submit_ai_job(ai_job_id, job_type, company, filters, user, lane, cost):
+    """Hand an AI job to the fair scheduler (RQ job id = AI job id, so it can be cancelled)"""
+    scheduler = FairScheduler()
+    scheduler.submit(
+        ai_job_id, lane, f"{company}|{user}", cost,
+        method="material_ledger.material_ledger.services.queue_service.process_ai_job",
+        timeout=JOB_TIMEOUT,
+        ai_job_id=ai_job_id,
+        job_type=job_type,
+        company=company,
+        filters=filters,
+        user=user
+    )
+    scheduler.dispatch()
+
+
+def dispatch_ai_jobs():
+    """Scheduler: free lane slots of jobs that ended without releasing them and dispatch waiting jobs"""
+    scheduler = FairScheduler()
+    scheduler.reconcile(AIQueueService()._is_job_finished, _fail_lost_ai_job)
+    scheduler.dispatch()
+
+
+def _fail_lost_ai_job(ai_job_id):
+    """
+    Fail a dispatched job whose worker is gone (see FairScheduler.is_lost)
+    
+    The RQ job of a map-reduce job ends once its chunks are enqueued, so
+    those jobs are left to the chunk watchdog.
+    
+    Returns:
+        bool: True once the job is failed and its slot and claim released
+    """
+    from material_ledger.material_ledger.services.map_reduce import ChunkStore
+    
+    meta = ChunkStore(ai_job_id).get_meta()
+    if meta and meta.get("job_type"):
+        return False
+    
+    job = frappe.db.get_value("AI Job Queue", {"job_id": ai_job_id}, ["job_type", "user"], as_dict=True)
+    if not job:
+        return False
+    
+    fail_ai_job(ai_job_id, job.job_type, job.user, _("The worker running the job stopped before it finished"))
+    return True
+
+
+def is_transient_error(error):
+    """
+    Check whether a failure may pass on a later attempt
+    
+    Provider, network, timeout and lock errors are retried; anything else
+    (unknown job type, validation or permission errors) fails the job at once.
+    """
+    import requests
+    from material_ledger.material_ledger.services.llm_providers import LLMProviderError
+    
+    return isinstance(error, (
+        LLMProviderError, requests.RequestException, ConnectionError, TimeoutError,
+        frappe.QueryTimeoutError, frappe.QueryDeadlockError
+    ))
+
+
+def get_retry_delay(attempt):
+    """Backoff in seconds before retry number attempt + 1"""
+    return RETRY_BACKOFF_BASE * (2 ** attempt)
+
+
+def schedule_ai_job_retry(ai_job_id, error):
+    """
+    Put a failed AI job back in the queue for a later attempt
+    
+    The retry sweep re-enqueues it once next_retry_at has passed; completed
+    chunks are resumed from their checkpoints.
+    
+    Returns:
+        bool: False once max_retries attempts have been used
+    """
+    job_doc = frappe.get_doc("AI Job Queue", {"job_id": ai_job_id})
+    if job_doc.status == "cancelled" or cint(job_doc.retry_count) >= AIQueueService().max_retries:
+        return False
+    
+    delay = get_retry_delay(cint(job_doc.retry_count))
+    job_doc.retry_count = cint(job_doc.retry_count) + 1
+    job_doc.status = "queued"
+    job_doc.error = f"Attempt {job_doc.retry_count} failed: {error}"
+    job_doc.next_retry_at = add_to_date(now_datetime(), seconds=delay)
+    job_doc.save(ignore_permissions=True)
+    set_progress(ai_job_id, {"status": "queued", "stage": "retrying"})
+    
+    for watcher in _get_job_watchers(job_doc.cache_key, job_doc.user):
+        frappe.publish_realtime(
+            event="ai_job_queued",
+            message={
+                "job_id": ai_job_id,
+                "job_type": job_doc.job_type,
+                "status": "queued",
+                "stage": "retrying",
+                "retry_count": job_doc.retry_count
+            },
+            user=watcher
+        )
+    
+    # The lane slot goes to the next job during the backoff
+    FairScheduler().release(ai_job_id)
+    
+    frappe.log_error(
+        f"AI Job {ai_job_id} failed (attempt {job_doc.retry_count}), retrying in {delay}s: {error}",
+        "AI Queue Service"
+    )
+    return True
+
+
+def retry_due_ai_jobs():
+    """
+    Scheduler: re-enqueue AI jobs and map-reduce chunks whose retry backoff has passed,
+    and chunks whose worker died
+    """
+    from material_ledger.material_ledger.services.map_reduce import (
+        enqueue_due_chunk_retries, recover_lost_chunks
+    )
+    
+    due_jobs = frappe.get_all(
+        "AI Job Queue",
+        filters={"status": "queued", "next_retry_at": ["<=", now_datetime()]},
+        fields=["job_id", "job_type", "company", "filters", "user", "priority_lane", "estimated_cost"]
+    )
+    
+    for job in due_jobs:
+        frappe.db.set_value("AI Job Queue", job.job_id, "next_retry_at", None, update_modified=False)
+        submit_ai_job(
+            job.job_id, job.job_type, job.company, json.loads(job.filters or "{}"), job.user,
+            job.priority_lane or "bulk", job.estimated_cost
+        )
+    
+    enqueue_due_chunk_retries()
+    recover_lost_chunks()
+
+
+def _open_checkpoint(ai_job_id, chunks):
+    """
+    Get the checkpoint store of an in-process chunked job
+    
+    Checkpoints of an earlier attempt are only reused when the chunks are
+    identical; otherwise they are discarded.
+    """
+    from material_ledger.material_ledger.services.map_reduce import ChunkStore
+    
+    store = ChunkStore(ai_job_id)
+    fingerprint = hashlib.md5(pickle.dumps(chunks)).hexdigest()
+    meta = store.get_meta()
+    
+    if not meta or meta.get("fingerprint") != fingerprint:
+        if meta:
+            store.clear(cint(meta.get("total")))
+        store.save_meta({"fingerprint": fingerprint, "total": len(chunks)})
+    
+    return store
+
+
+def _is_cancelled(ai_job_id):
+    return frappe.db.get_value("AI Job Queue", {"job_id": ai_job_id}, "status") == "cancelled"
+
+
+def complete_ai_job(ai_job_id, job_type, user, result):
+    """Store the result of a finished AI job, cache it and notify watchers"""
+    if _is_cancelled(ai_job_id):
+        _release_ai_job(ai_job_id)
+        return
+    
+    try:
+        job_doc = frappe.get_doc("AI Job Queue", {"job_id": ai_job_id})
         job_doc.status = "completed"
         job_doc.progress = 100
         job_doc.result = json.dumps(result, default=_json_serial)
         job_doc.completed_at = now()
         job_doc.save()
+        set_progress(ai_job_id, {"status": "completed", "progress": 100})
         
         # Cache the result
-        queue_service._cache_result(job_doc.cache_key, result)
-        
-        # Send notification
-        send_completion_notification(user, job_type, ai_job_id, result)
+        AIQueueService()._cache_result(job_doc.cache_key, result)
         
+        # Send notification to everyone attached to this job
+        for watcher in _get_job_watchers(job_doc.cache_key, user):
+            send_completion_notification(watcher, job_type, ai_job_id, result)
+    
     except Exception as e:
+        fail_ai_job(ai_job_id, job_type, user, str(e))
+        return
+    
+    _release_ai_job(ai_job_id)
+
+
+def fail_ai_job(ai_job_id, job_type, user, error):
+    """Mark an AI job as failed and notify watchers"""
+    if _is_cancelled(ai_job_id):
+        _release_ai_job(ai_job_id)
+        return
+    
+    try:
         # Update job with error
         job_doc = frappe.get_doc("AI Job Queue", {"job_id": ai_job_id})
         job_doc.status = "failed"
-        job_doc.error = str(e)
+        job_doc.error = error
         job_doc.save()
+        set_progress(ai_job_id, {"status": "failed", "error": error})
         
         # Send error notification
-        send_error_notification(user, job_type, ai_job_id, str(e))
+        for watcher in _get_job_watchers(job_doc.cache_key, user):
+            send_error_notification(watcher, job_type, ai_job_id, error)
         
         # Log error
-        frappe.log_error(f"AI Job Failed: {str(e)}", "AI Queue Service")
+        frappe.log_error(f"AI Job Failed: {error}", "AI Queue Service")
+    
+    finally:
+        _release_ai_job(ai_job_id)
+
+
+def cancel_ai_job_run(ai_job_id, job_type, user, reason):
+    """Record "cancelled" as the final state of an AI job and notify watchers"""
+    try:
+        job_doc = frappe.get_doc("AI Job Queue", {"job_id": ai_job_id})
+        if job_doc.status != "cancelled":
+            job_doc.status = "cancelled"
+            job_doc.error = reason
+            job_doc.completed_at = now()
+            job_doc.save(ignore_permissions=True)
+        set_progress(ai_job_id, {"status": "cancelled", "error": reason})
+        
+        for watcher in _get_job_watchers(job_doc.cache_key, user):
+            frappe.publish_realtime(
+                event="ai_job_cancelled",
+                message={
+                    "job_id": ai_job_id,
+                    "job_type": job_type,
+                    "status": "cancelled",
+                    "reason": reason
+                },
+                user=watcher
+            )
+    
+    finally:
+        _release_ai_job(ai_job_id)
+
+
+def _release_ai_job(ai_job_id):
+    """
+    Release the in-flight claim so later identical requests start a new job (or hit the result cache),
+    and free the job's lane slot for the next waiting job
+    """
+    cache_key = frappe.db.get_value("AI Job Queue", {"job_id": ai_job_id}, "cache_key")
+    if cache_key:
+        InFlightRegistry().release(cache_key, ai_job_id)
+    FairScheduler().release(ai_job_id)
+
 
+def _get_job_watchers(cache_key, user):
+    """Get the job owner plus every user who attached to the same in-flight job"""
+    watchers = InFlightRegistry().get_watchers(cache_key) if cache_key else []
+    return list(dict.fromkeys([user, *watchers]))
 
-def process_financial_prediction(company, filters, job_doc):
+
+def process_financial_prediction(company, filters, progress):
     """Process financial prediction analysis"""
     from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
     
     prediction_service = AIPredictionService()
     
     # Update progress
-    job_doc.progress = 20
-    job_doc.save()
+    progress.update(20)
     
     # Get historical data in chunks
     data = prediction_service.get_historical_data(company, filters)
     chunks = prediction_service.chunk_financial_data(data)
     
     # Update progress
-    job_doc.progress = 40
-    job_doc.save()
+    progress.update(40)
+    
+    from material_ledger.material_ledger.services.map_reduce import dispatch_chunks, use_map_reduce
+    if use_map_reduce(chunks):
+        dispatch_chunks(progress.job_id, "financial_prediction", chunks)
+        return DISTRIBUTED
     
-    # Process chunks
+    # Process chunks, resuming from the checkpoints of an earlier attempt
+    checkpoint = _open_checkpoint(progress.job_id, chunks)
     predictions = []
     for i, chunk in enumerate(chunks):
-        chunk_prediction = prediction_service.predict_chunk(chunk)
+        job_control.check_current()
+        chunk_prediction = checkpoint.get_result(i)
+        if chunk_prediction is None:
+            chunk_prediction = prediction_service.predict_chunk(chunk)
+            checkpoint.save_result(i, chunk_prediction)
         predictions.append(chunk_prediction)
         
         # Update progress
-        progress = 40 + (50 * (i + 1) / len(chunks))
-        job_doc.progress = int(progress)
-        job_doc.save()
+        progress.update(40 + (50 * (i + 1) / len(chunks)))
     
     # Combine predictions
     final_result = prediction_service.combine_predictions(predictions)
+    checkpoint.clear(len(chunks))
     
     # Update progress
-    job_doc.progress = 95
-    job_doc.save()
+    progress.update(95)
     
     return final_result
 
 
-def process_anomaly_detection(company, filters, job_doc):
+def process_anomaly_detection(company, filters, progress):
     """Process anomaly detection analysis"""
     from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
     
     anomaly_service = AIAnomalyService()
     
     # Update progress
-    job_doc.progress = 25
-    job_doc.save()
+    progress.update(25)
+    
+    # Incremental runs score only entries posted since the last run, against persisted baselines
+    if filters.get("incremental"):
+        anomalies, scored = anomaly_service.detect_incremental_anomalies(company, filters)
+        progress.update(90)
+        final_result = anomaly_service.generate_anomaly_report(anomalies, progress.job_id, company)
+        final_result.update({"mode": "incremental", "entries_scored": scored})
+        return final_result
     
     # Get transaction data
     data = anomaly_service.get_transaction_data(company, filters)
     chunks = anomaly_service.chunk_transaction_data(data)
     
-    # Update progress  
-    job_doc.progress = 50
-    job_doc.save()
+    # Detectors that must see every row run once, before the per-chunk detectors;
+    # chunks are scored against the dataset-wide baseline so chunk boundaries don't matter
+    dataset_anomalies = anomaly_service.detect_dataset_anomalies(data)
+    baseline = anomaly_service.build_baseline(data)
     
-    # Detect anomalies in chunks
-    anomalies = []
-    for i, chunk in enumerate(chunks):
-        chunk_anomalies = anomaly_service.detect_chunk_anomalies(chunk)
-        anomalies.extend(chunk_anomalies)
-        
-        # Update progress
-        progress = 50 + (40 * (i + 1) / len(chunks))
-        job_doc.progress = int(progress)
-        job_doc.save()
+    # With a local anomaly model, only its top outliers go to the AI provider, not every chunk
+    model_anomalies = anomaly_service.detect_model_anomalies(company, data)
+    use_ai = model_anomalies is None
+    dataset_anomalies.extend(model_anomalies or [])
+    
+    # Update progress
+    progress.update(50)
+    
+    from material_ledger.material_ledger.services.map_reduce import dispatch_chunks, use_map_reduce
+    if use_map_reduce(chunks):
+        dispatch_chunks(progress.job_id, "anomaly_detection", chunks, prelude=dataset_anomalies,
+                        context={"baseline": baseline, "use_ai": use_ai, "job_id": progress.job_id, "company": company})
+        return DISTRIBUTED
+    
+    # Detect anomalies in chunks (AI calls fan out concurrently)
+    def update_progress(done, total):
+        job_control.check_current()
+        progress.update(50 + (40 * done / total))
+    
+    checkpoint = _open_checkpoint(progress.job_id, chunks)
+    anomalies = dataset_anomalies + anomaly_service.detect_all_anomalies(
+        chunks, on_chunk_done=update_progress, checkpoint=checkpoint, baseline=baseline, use_ai=use_ai
+    )
     
     # Generate final report
-    final_result = anomaly_service.generate_anomaly_report(anomalies)
+    final_result = anomaly_service.generate_anomaly_report(anomalies, progress.job_id, company)
+    checkpoint.clear(len(chunks))
     
     return final_result
 
 
-def process_investment_analysis(company, filters, job_doc):
+def process_investment_analysis(company, filters, progress):
     """Process investment analysis"""
     from material_ledger.material_ledger.services.ai_investment_service import AIInvestmentService
     
     investment_service = AIInvestmentService()
     
     # Update progress
-    job_doc.progress = 30
-    job_doc.save()
+    progress.update(30)
     
     # Get investment data
     data = investment_service.get_investment_data(company, filters)
     
     # Update progress
-    job_doc.progress = 60
-    job_doc.save()
+    progress.update(60)
     
     # Analyze investment opportunities
     result = investment_service.analyze_investments(data)
     
     # Update progress
-    job_doc.progress = 90
-    job_doc.save()
+    progress.update(90)
     
     return result
 
 
-def process_comprehensive_analysis(company, filters, job_doc):
+def process_comprehensive_analysis(company, filters, progress):
     """Process comprehensive financial analysis"""
     from material_ledger.material_ledger.services.ai_service import get_ai_service
     
     ai_service = get_ai_service()
     
     # Update progress
-    job_doc.progress = 20
-    job_doc.save()
+    progress.update(20)
     
     # Get comprehensive financial data
     from material_ledger.material_ledger.api import get_financial_analysis
     financial_data = get_financial_analysis(company, str(filters.get('year', 2026)))
     
     # Update progress
-    job_doc.progress = 50
-    job_doc.save()
+    progress.update(50)
     
     # Generate AI report
     ai_report = ai_service.generate_financial_report(company, filters.get('year', 2026), financial_data)
     
     # Update progress
-    job_doc.progress = 90
-    job_doc.save()
+    progress.update(90)
     
     return {
         "financial_data": financial_data,
@@ -407,7 +771,7 @@ def send_error_notification(user, job_type, job_id, error):
 
 # API Endpoints
 @frappe.whitelist()
-def queue_ai_analysis(job_type, company, filters=None):
+def queue_ai_analysis(job_type, company, filters=None, priority=None):
     """API endpoint to queue AI analysis"""
     if not filters:
         filters = {}
@@ -415,14 +779,82 @@ def queue_ai_analysis(job_type, company, filters=None):
         filters = json.loads(filters)
         
     queue_service = AIQueueService()
-    return queue_service.create_ai_job(job_type, company, filters)
+    return queue_service.create_ai_job(job_type, company, filters, priority=priority)
 
 
 @frappe.whitelist()
-def get_ai_job_status(job_id):
-    """API endpoint to get job status"""
+def get_ai_job_status(job_id, include_result=0):
+    """
+    API endpoint to get job status
+    
+    Clients follow jobs through realtime events (ai_job_queued, ai_job_progress,
+    ai_job_complete, ai_job_error, ai_job_cancelled) and fetch the result once,
+    with include_result, after completion.
+    """
     queue_service = AIQueueService()
-    return queue_service.get_job_status(job_id)
+    return queue_service.get_job_status(job_id, include_result=cint(include_result))
+
+
+@frappe.whitelist()
+def cancel_ai_job(job_id):
+    """
+    Cancel a queued or running AI job
+    
+    Jobs waiting in their lane are dropped, queued jobs are removed from the
+    RQ queue; running jobs stop at their next chunk boundary or LLM call,
+    and their worker records the cancellation and frees the lane slot. A
+    processing job whose worker is gone is cancelled at once.
+    """
+    job = frappe.db.get_value("AI Job Queue", {"job_id": job_id}, ["job_type", "user", "status"], as_dict=True)
+    if not job:
+        frappe.throw(_("AI job not found"), frappe.DoesNotExistError)
+    
+    if job.user != frappe.session.user and "System Manager" not in frappe.get_roles():
+        frappe.throw(_("Not permitted to cancel this AI job"), frappe.PermissionError)
+    
+    if job.status not in ("queued", "processing"):
+        return {"status": job.status, "cancelled": False}
+    
+    JobControl(job_id).cancel()
+    
+    if job.status == "processing" and _has_live_worker(job_id):
+        # The worker still holds the lane slot until its JobCancelled handler runs
+        return {"status": "cancelling", "cancelled": True}
+    
+    _remove_queued_rq_job(job_id)
+    cancel_ai_job_run(job_id, job.job_type, job.user, _("Cancelled by user"))
+    return {"status": "cancelled", "cancelled": True}
+
+
+def _has_live_worker(job_id):
+    """
+    Check whether a processing job still has a worker that will see its cancel flag
+    
+    Map-reduce jobs count as live while their chunks run (their parent RQ job
+    has ended; a lost chunk is re-enqueued and sees the flag), other jobs
+    only while their RQ job is started.
+    """
+    from frappe.utils.background_jobs import get_job
+    from material_ledger.material_ledger.services.map_reduce import ChunkStore
+    
+    meta = ChunkStore(job_id).get_meta()
+    if meta and meta.get("job_type"):
+        return True
+    
+    rq_job = get_job(job_id)
+    return bool(rq_job) and rq_job.get_status() == "started"
+
+
+def _remove_queued_rq_job(job_id):
+    """Remove a job from its RQ queue if it has not started (best effort; it also checks the flag on start)"""
+    from frappe.utils.background_jobs import get_job
+    
+    try:
+        rq_job = get_job(job_id)
+        if rq_job and rq_job.get_status() == "queued":
+            rq_job.cancel()
+    except Exception as e:
+        frappe.log_error(f"Could not remove queued AI job {job_id}: {str(e)}", "AI Queue Service")
 
 
 @frappe.whitelist()
@@ -431,7 +863,7 @@ def get_user_ai_jobs():
     jobs = frappe.get_all(
         "AI Job Queue",
         filters={"user": frappe.session.user},
-        fields=["job_id", "job_type", "company", "status", "progress", "created_at", "completed_at"],
+        fields=["job_id", "job_type", "company", "status", "progress", "priority_lane", "created_at", "completed_at"],
         order_by="created_at desc",
         limit=50
     )
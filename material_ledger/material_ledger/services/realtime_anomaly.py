@@ -0,0 +1,183 @@
+# Copyright (c) 2026, Ahmad
+# For license information, please see license.txt
+
+"""
+Real-time Anomaly Alerts
+Scores each GL Entry as it is submitted against a precomputed snapshot of
+the company's anomaly baselines, pushes high-severity hits to the AI
+dashboard and persists them in batches from the scheduler
+"""
+
+import frappe
+from frappe.utils import flt, now
+from frappe.utils.user import get_users_with_role
+import hashlib
+import json
+import time
+
+
+# Outside the "material_ledger*" keys that saving the settings flushes, so queued alerts survive it
+SNAPSHOT_KEY = "ai_anomaly_snapshot::{}"  # Per company, published by incremental runs
+ALERT_QUEUE = "ai_anomaly_alerts"  # Redis list of alerts waiting to be persisted
+SNAPSHOT_TTL = 300  # Seconds a worker keeps a snapshot before re-reading it from Redis
+MIN_ACCOUNT_ENTRIES = 5  # Same minimum history as AIAnomalyService.score_against_baseline
+ALERT_Z_SCORE = 3.0  # AIAnomalyService.high_risk_threshold
+FLUSH_BATCH = 500  # Alerts persisted per insert statement
+DASHBOARD_ROLES = ("System Manager", "Accounts Manager")
+
+_snapshots = {}  # company -> (loaded at, snapshot), per worker process
+
+
+def finding_name(gl_entry, anomaly_type):
+    """Deterministic AI Anomaly Finding name for a GL Entry and anomaly type"""
+    return hashlib.md5(f"{gl_entry}|{anomaly_type}".encode()).hexdigest()
+
+
+def build_snapshot(state):
+    """
+    Lookup tables of an AnomalyState for the submit hook
+
+    Only accounts with enough history to be scored are kept, as
+    account -> (mean, stdev), so scoring is one dict lookup.
+    """
+    accounts = {
+        account: (stats.mean, stats.stdev)
+        for account, stats in state.accounts.items()
+        if stats.count >= MIN_ACCOUNT_ENTRIES and stats.stdev > 0
+    }
+    recipients = sorted({
+        user for role in DASHBOARD_ROLES for user in get_users_with_role(role)
+        if user not in ("Administrator", "Guest")
+    })
+    return {"accounts": accounts, "recipients": recipients, "built_at": now()}
+
+
+def publish_snapshot(state):
+    """Share a company's baselines with the submit hook of every worker"""
+    frappe.cache().set_value(SNAPSHOT_KEY.format(state.company), build_snapshot(state))
+    _snapshots.pop(state.company, None)
+
+
+def refresh_snapshot(company):
+    """Background job: build and publish a company's snapshot from its stored baselines"""
+    from material_ledger.material_ledger.services.anomaly_state import AnomalyState
+    publish_snapshot(AnomalyState(company))
+
+
+def get_snapshot(company):
+    """
+    The company's snapshot, from the worker's memory when fresh
+
+    A missing snapshot is rebuilt in the background rather than during the
+    posting, and the entry goes unscored.
+    """
+    cached = _snapshots.get(company)
+    if cached and time.monotonic() - cached[0] < SNAPSHOT_TTL:
+        return cached[1]
+
+    snapshot = frappe.cache().get_value(SNAPSHOT_KEY.format(company))
+    if snapshot is None:
+        frappe.enqueue(
+            "material_ledger.material_ledger.services.realtime_anomaly.refresh_snapshot",
+            queue="short",
+            job_id=f"anomaly_snapshot::{company}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            company=company
+        )
+        # Don't retry on every posting while the job runs
+        snapshot = {"accounts": {}, "recipients": []}
+
+    _snapshots[company] = (time.monotonic(), snapshot)
+    return snapshot
+
+
+def score_entry(doc, snapshot):
+    """
+    Alert for a GL Entry whose amount is far outside its account's baseline
+
+    Returns:
+        dict: Alert, or None
+    """
+    baseline = snapshot["accounts"].get(doc.account)
+    if not baseline:
+        return None
+
+    mean, stdev = baseline
+    amount = abs(flt(doc.debit) - flt(doc.credit))
+    z_score = abs(amount - mean) / stdev
+    if z_score <= ALERT_Z_SCORE:
+        return None
+
+    return {
+        "type": "unusual_amount",
+        "severity": "high",
+        "company": doc.company,
+        "entry_name": doc.name,
+        "account": doc.account,
+        "amount": amount,
+        "z_score": z_score,
+        "posting_date": str(doc.posting_date),
+        "voucher_type": doc.voucher_type,
+        "voucher_no": doc.voucher_no,
+        "description": f"مبلغ غير عادي: {amount:,.0f} (متوسط الحساب: {mean:,.0f})"
+    }
+
+
+def on_gl_entry_submit(doc, method=None):
+    """
+    GL Entry on_submit hook (Material Ledger Settings opt-in)
+
+    Costs a settings lookup, a snapshot lookup and a z-score; alerts are
+    only published and queued for persistence once the posting commits.
+    """
+    from material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings import MaterialLedgerSettings
+
+    if doc.is_cancelled or not MaterialLedgerSettings.get_settings().get("ai_realtime_anomaly_alerts"):
+        return
+
+    snapshot = get_snapshot(doc.company)
+    alert = score_entry(doc, snapshot)
+    if alert:
+        frappe.db.after_commit.add(lambda: send_alert(alert, snapshot["recipients"]))
+
+
+def send_alert(alert, recipients):
+    """Push an alert to the AI dashboard and queue it for persistence"""
+    frappe.cache().rpush(ALERT_QUEUE, json.dumps(alert, default=str))
+    for user in recipients:
+        frappe.publish_realtime(event="ai_anomaly_alert", message=alert, user=user)
+
+
+def flush_anomaly_alerts():
+    """Scheduler: persist queued alerts as AI Anomaly Finding rows, one insert per batch"""
+    cache = frappe.cache()
+    while True:
+        batch = cache.lrange(ALERT_QUEUE, 0, FLUSH_BATCH - 1)
+        if not batch:
+            return
+
+        timestamp = now()
+        values = {}
+        for raw in batch:
+            alert = json.loads(raw)
+            # Deterministic names make a retried batch replace rather than duplicate its rows
+            name = finding_name(alert["entry_name"], alert["type"])
+            values[name] = (
+                name, timestamp, timestamp, "Administrator", "Administrator",
+                alert["company"], alert["type"], alert["severity"], "Real-time",
+                alert["entry_name"], alert["account"], alert["posting_date"],
+                alert["amount"], alert["z_score"], alert["description"]
+            )
+
+        frappe.db.delete("AI Anomaly Finding", {"name": ["in", list(values)]})
+        frappe.db.bulk_insert(
+            "AI Anomaly Finding",
+            fields=["name", "creation", "modified", "owner", "modified_by", "company", "anomaly_type",
+                    "severity", "source", "gl_entry", "account", "posting_date", "amount", "score",
+                    "description"],
+            values=list(values.values())
+        )
+        frappe.db.commit()
+        # Alerts pushed meanwhile were appended after the batch and are kept
+        cache.ltrim(ALERT_QUEUE, len(batch), -1)
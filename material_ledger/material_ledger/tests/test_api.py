@@ -282,7 +282,7 @@ class TestAIService(FrappeTestCase):
         service = AIService()
         self.assertIsNotNone(service.settings)
     
-    @patch('material_ledger.material_ledger.services.ai_service.requests.post')
+    @patch('material_ledger.material_ledger.services.llm_providers.requests.post')
     def test_generate_report_success(self, mock_post):
         """Test successful AI report generation"""
         from material_ledger.material_ledger.services.ai_service import AIService
@@ -309,7 +309,32 @@ class TestAIService(FrappeTestCase):
         )
         
         self.assertIsInstance(result, str)
-    
+
+    @patch('material_ledger.material_ledger.services.llm_providers.requests.post')
+    def test_stream_completion_yields_tokens(self, mock_post):
+        """Test streamed completion parses server-sent events into tokens"""
+        from material_ledger.material_ledger.services.ai_service import AIService
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.iter_lines.return_value = [
+            'data: {"choices": [{"delta": {"reasoning_content": "thinking"}}]}',
+            '',
+            'data: {"choices": [{"delta": {"content": "مرحبا"}}]}',
+            'data: {"choices": [{"delta": {"content": " بك"}}]}',
+            'data: [DONE]'
+        ]
+        mock_post.return_value.__enter__.return_value = mock_response
+
+        service = AIService()
+        service.api_key = "test_key"
+        service.provider = "DeepSeek"
+
+        tokens = list(service.stream_completion("test prompt"))
+
+        self.assertEqual(tokens, ["مرحبا", " بك"])
+        self.assertTrue(mock_post.call_args.kwargs["json"]["stream"])
+
     def test_ai_service_not_available_without_key(self):
         """Test AI service returns appropriate message without API key"""
         from material_ledger.material_ledger.services.ai_service import AIService
@@ -320,6 +345,1420 @@ class TestAIService(FrappeTestCase):
         self.assertFalse(service.is_available())
 
 
+class TestLLMProviders(FrappeTestCase):
+    """Test cases for the pluggable LLM provider layer"""
+    
+    def test_stub_provider_is_deterministic(self):
+        """Test that the stub provider returns the same parseable response for the same prompt"""
+        from material_ledger.material_ledger.services.llm_providers import build_provider
+        
+        provider = build_provider("Stub")
+        self.assertTrue(provider.is_available())
+        
+        first = provider.complete("same prompt")["content"]
+        second = provider.complete("same prompt")["content"]
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, provider.complete("other prompt")["content"])
+        
+        payload = json.loads(first.split("```json\n", 1)[1].rsplit("\n```", 1)[0])
+        self.assertEqual(payload["anomalies"], [])
+        self.assertEqual("".join(provider.stream("same prompt")).strip(), first)
+    
+    @patch('material_ledger.material_ledger.services.llm_providers.requests.post')
+    def test_local_provider_uses_configured_base_url(self, mock_post):
+        """Test that a local OpenAI-compatible server is called at its base URL without a key"""
+        from material_ledger.material_ledger.services.llm_providers import build_provider
+        
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {
+            "choices": [{"message": {"content": "ok"}}]
+        }
+        
+        settings = {"ai_provider": "Local", "ai_model": "qwen", "ai_base_url": "http://10.0.0.5:8000/v1/", "ai_request_timeout": 30}
+        provider = build_provider("Local", settings=settings)
+        
+        self.assertTrue(provider.is_available())
+        self.assertEqual(provider.complete("Hello")["content"], "ok")
+        self.assertEqual(mock_post.call_args.args[0], "http://10.0.0.5:8000/v1/chat/completions")
+        self.assertEqual(mock_post.call_args.kwargs["json"]["model"], "qwen")
+        self.assertEqual(mock_post.call_args.kwargs["timeout"], (10, 30))
+        self.assertNotIn("Authorization", mock_post.call_args.kwargs["headers"])
+
+
+class TestInFlightRegistry(FrappeTestCase):
+    """Test cases for in-flight AI job deduplication"""
+    
+    def test_identical_requests_attach_to_running_job(self):
+        """Test that a second claim for the same cache key gets the first job id"""
+        from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+        
+        registry = InFlightRegistry(key_prefix="test_ai_inflight")
+        registry.release("same_key")
+        
+        owner, is_new = registry.claim("same_key", "job-1")
+        self.assertEqual(owner, "job-1")
+        self.assertTrue(is_new)
+        
+        owner, is_new = registry.claim("same_key", "job-2")
+        self.assertEqual(owner, "job-1")
+        self.assertFalse(is_new)
+        
+        # Only the owner can release the key
+        self.assertFalse(registry.release("same_key", "job-2"))
+        self.assertTrue(registry.release("same_key", "job-1"))
+        
+        owner, is_new = registry.claim("same_key", "job-2")
+        self.assertEqual(owner, "job-2")
+        self.assertTrue(is_new)
+        registry.release("same_key")
+    
+    def test_stale_owner_is_replaced(self):
+        """Test that a finished owner does not block new work"""
+        from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+        
+        registry = InFlightRegistry(key_prefix="test_ai_inflight")
+        registry.release("stale_key")
+        registry.claim("stale_key", "job-1")
+        
+        owner, is_new = registry.claim("stale_key", "job-2", is_stale=lambda job_id: True)
+        self.assertEqual(owner, "job-2")
+        self.assertTrue(is_new)
+        registry.release("stale_key")
+    
+    def test_uncommitted_owner_is_not_stale(self):
+        """Test that a claim whose job document is not committed yet is not taken over"""
+        from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+        from material_ledger.material_ledger.services.queue_service import AIQueueService
+        
+        registry = InFlightRegistry(key_prefix="test_ai_inflight")
+        registry.release("pending_key")
+        registry.claim("pending_key", "job-1")
+        
+        with patch("frappe.db.get_value", return_value=None):
+            owner, is_new = registry.claim("pending_key", "job-2", is_stale=AIQueueService()._is_job_finished)
+        self.assertEqual(owner, "job-1")
+        self.assertFalse(is_new)
+        
+        with patch("frappe.db.get_value", return_value="completed"):
+            owner, is_new = registry.claim("pending_key", "job-2", is_stale=AIQueueService()._is_job_finished)
+        self.assertEqual(owner, "job-2")
+        self.assertTrue(is_new)
+        registry.release("pending_key")
+
+
+class TestPromptBudget(FrappeTestCase):
+    """Test cases for prompt budgeting and compaction"""
+    
+    def test_compose_keeps_instructions_within_budget(self):
+        """Test that data sections are truncated before header and footer"""
+        from material_ledger.material_ledger.services.prompt_budget import PromptBudget
+        
+        budget = PromptBudget(max_prompt_tokens=100)
+        prompt = budget.compose("HEADER", ["بيانات " * 500, "SECOND"], "FOOTER")
+        
+        self.assertTrue(prompt.startswith("HEADER"))
+        self.assertTrue(prompt.endswith("FOOTER"))
+        self.assertNotIn("SECOND", prompt)
+        self.assertLessEqual(budget.count_tokens(prompt), 105)
+        
+        # Compaction is deterministic
+        self.assertEqual(prompt, budget.compose("HEADER", ["بيانات " * 500, "SECOND"], "FOOTER"))
+    
+    def test_truncate_history(self):
+        """Test that chat history keeps the last turns with capped messages"""
+        from material_ledger.material_ledger.services.prompt_budget import PromptBudget
+        
+        budget = PromptBudget(max_prompt_tokens=1000)
+        history = [{"user": f"q{i} " + "x" * 2000, "assistant": f"a{i}"} for i in range(10)]
+        
+        compacted = budget.truncate_history(history, max_turns=3, max_tokens_per_message=20)
+        
+        self.assertEqual(len(compacted), 3)
+        self.assertTrue(compacted[0]["user"].startswith("q7"))
+        self.assertLessEqual(budget.count_tokens(compacted[0]["user"]), 20)
+        self.assertEqual(compacted[-1]["assistant"], "a9")
+    
+    def test_summarize_series(self):
+        """Test fixed-size summary of a long series"""
+        from material_ledger.material_ledger.services.prompt_budget import PromptBudget
+        
+        summary = PromptBudget(max_prompt_tokens=1000).summarize_series([10, 20, 30, 40])
+        
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["mean"], 25)
+        self.assertEqual(summary["max"], 40)
+        self.assertAlmostEqual(summary["trend"], 10)
+
+
+class TestAIConcurrency(FrappeTestCase):
+    """Test cases for bounded AI fan-out and the shared rate budget"""
+    
+    def test_rate_budget_limits_calls_per_window(self):
+        """Test that the rate budget grants at most `limit` calls per window"""
+        from material_ledger.material_ledger.services.concurrency import RateBudget
+        
+        budget = RateBudget(f"test_{frappe.generate_hash(length=8)}", limit=2, period=60)
+        self.assertEqual(budget.try_acquire(), 0)
+        self.assertEqual(budget.try_acquire(), 0)
+        self.assertGreater(budget.try_acquire(), 0)
+        
+        self.assertEqual(RateBudget("test_unlimited", limit=0).try_acquire(), 0)
+    
+    def test_fan_out_merges_chunks_in_order(self):
+        """Test that concurrent AI results are merged in chunk order after statistical results"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        service = AIAnomalyService()
+        chunks = [[{"id": c}] * 10 for c in range(3)] + [[{"id": 3}]]
+        
+        def statistical(chunk, baseline=None):
+            return [f"stat-{chunk[0]['id']}"] if len(chunk) >= 10 else []
+        
+        def ai(chunk, budget):
+            return [f"ai-{chunk[0]['id']}"]
+        
+        with patch.object(service, "detect_statistical_anomalies", side_effect=statistical), \
+             patch.object(service, "_rate_limited_ai_detection", side_effect=ai), \
+             patch("material_ledger.material_ledger.services.concurrency.run_in_site_context",
+                   side_effect=lambda site, func, *args: func(*args)):
+            result = service.detect_all_anomalies(chunks)
+        
+        self.assertEqual(result, ["stat-0", "ai-0", "stat-1", "ai-1", "stat-2", "ai-2"])
+
+
+class TestJobProgress(FrappeTestCase):
+    """Test cases for the AI job progress channel"""
+    
+    @patch("material_ledger.material_ledger.services.job_progress.frappe.publish_realtime")
+    @patch("material_ledger.material_ledger.services.job_progress.frappe.db.commit")
+    @patch("material_ledger.material_ledger.services.job_progress.frappe.db.set_value")
+    def test_progress_persistence_is_throttled(self, mock_set_value, mock_commit, mock_publish):
+        """Test that per-chunk updates reach Redis and realtime but rarely the database"""
+        from material_ledger.material_ledger.services.job_progress import JobProgress, get_progress
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        progress = JobProgress(job_id, users=["Administrator"], persist_step=10, persist_interval=3600)
+        
+        for i in range(200):
+            progress.update(40 + 50 * (i + 1) / 200)
+        
+        self.assertEqual(get_progress(job_id)["progress"], 90)
+        self.assertLessEqual(mock_set_value.call_count, 6)
+        self.assertEqual(mock_publish.call_count, 51)  # once per distinct percentage 40..90
+    
+    @patch("material_ledger.material_ledger.services.job_progress.frappe.publish_realtime")
+    def test_users_attaching_mid_run_get_progress(self, mock_publish):
+        """Test that a user who attaches to a running job receives its later progress"""
+        from functools import partial
+        from material_ledger.material_ledger.services.job_progress import JobProgress
+        from material_ledger.material_ledger.services.job_registry import InFlightRegistry
+        from material_ledger.material_ledger.services.queue_service import _get_job_watchers
+        
+        cache_key = f"test-{frappe.generate_hash(length=8)}"
+        progress = JobProgress(cache_key, partial(_get_job_watchers, cache_key, "owner@example.com"))
+        
+        progress.update(10, persist=False)
+        InFlightRegistry().add_watcher(cache_key, "late@example.com")
+        progress.update(20, persist=False)
+        InFlightRegistry().release(cache_key)
+        
+        recipients = [(c.kwargs["message"]["progress"], c.kwargs["user"]) for c in mock_publish.call_args_list]
+        self.assertEqual(recipients, [
+            (10, "owner@example.com"), (20, "owner@example.com"), (20, "late@example.com")
+        ])
+    
+    def test_status_reads_fast_path_while_running(self):
+        """Test that get_job_status answers from Redis without loading the document"""
+        from material_ledger.material_ledger.services.job_progress import set_progress
+        from material_ledger.material_ledger.services.queue_service import AIQueueService
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        set_progress(job_id, {"status": "processing", "progress": 42})
+        
+        with patch("material_ledger.material_ledger.services.queue_service.frappe.get_doc") as mock_get_doc:
+            status = AIQueueService().get_job_status(job_id)
+        
+        self.assertEqual(status["status"], "processing")
+        self.assertEqual(status["progress"], 42)
+        mock_get_doc.assert_not_called()
+    
+    def test_result_body_only_fetched_on_request(self):
+        """Test that status reads of a finished job skip the result until it is asked for"""
+        from material_ledger.material_ledger.services.job_progress import set_progress
+        from material_ledger.material_ledger.services.queue_service import AIQueueService
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        set_progress(job_id, {"status": "completed", "progress": 100})
+        
+        with patch("material_ledger.material_ledger.services.queue_service.frappe.db.get_value") as mock_get_value:
+            mock_get_value.return_value = frappe._dict(status="completed", progress=100, error=None, result='{"ok": 1}')
+            status = AIQueueService().get_job_status(job_id)
+            mock_get_value.assert_not_called()
+            
+            status = AIQueueService().get_job_status(job_id, include_result=True)
+        
+        self.assertEqual(status["result"], {"ok": 1})
+        self.assertIn("result", mock_get_value.call_args[0][2])
+
+
+class TestMapReduce(FrappeTestCase):
+    """Test cases for map-reduce execution of chunked AI jobs"""
+    
+    def _run_job(self, chunks, map_func, run_order):
+        """Dispatch chunks, run the chunk jobs in run_order and return the captured enqueues"""
+        import time
+        from material_ledger.material_ledger.services import map_reduce
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        spec = {"map": map_func, "reduce": lambda partials, context=None: [x for partial in partials for x in partial], "progress": (0, 100)}
+        enqueued = []
+        
+        with patch.dict(map_reduce.MAP_REDUCE_JOBS, {"test_job": spec}), \
+             patch.object(map_reduce.frappe, "enqueue", side_effect=lambda **kw: enqueued.append(kw)), \
+             patch.object(map_reduce.frappe.db, "get_value", return_value=frappe._dict(user="Administrator", cache_key="test")), \
+             patch.object(map_reduce.JobProgress, "update"):
+            map_reduce.dispatch_chunks(job_id, "test_job", chunks)
+            
+            for index in run_order:
+                map_reduce.process_ai_chunk(job_id, index)
+            
+            # Failed chunks wait for their backoff, then the retry sweep enqueues them
+            with patch.object(map_reduce.time, "time", return_value=time.time() + 3600):
+                map_reduce.enqueue_due_chunk_retries()
+            for retry in [e for e in enqueued[len(chunks):] if e["method"].endswith("process_ai_chunk")]:
+                map_reduce.process_ai_chunk(job_id, retry["index"], retry["attempt"])
+            
+            with patch("material_ledger.material_ledger.services.queue_service.complete_ai_job") as mock_complete:
+                if enqueued[-1]["method"].endswith("process_ai_reduce"):
+                    map_reduce.process_ai_reduce(job_id)
+        
+        return enqueued, mock_complete
+    
+    def test_partial_results_merge_in_chunk_order(self):
+        """Test that chunks finishing out of order are reduced in chunk order"""
+        enqueued, mock_complete = self._run_job(
+            [[1, 2], [3], [4, 5]], lambda chunk, context=None: [x * 10 for x in chunk], run_order=[2, 0, 1]
+        )
+        
+        self.assertEqual(len([e for e in enqueued if e["method"].endswith("process_ai_reduce")]), 1)
+        self.assertEqual(mock_complete.call_args.args[3], [10, 20, 30, 40, 50])
+    
+    def test_failed_chunk_is_retried_individually(self):
+        """Test that a transient chunk failure re-runs only that chunk"""
+        calls = []
+        
+        def flaky(chunk, context=None):
+            calls.append(chunk[0])
+            if chunk[0] == 3 and calls.count(3) == 1:
+                raise ConnectionError("provider timeout")
+            return chunk
+        
+        _enqueued, mock_complete = self._run_job([[1], [3]], flaky, run_order=[0, 1])
+        
+        self.assertEqual(calls, [1, 3, 3])
+        self.assertEqual(mock_complete.call_args.args[3], [1, 3])
+    
+    def test_chunk_is_counted_done_once(self):
+        """Test that a chunk finishing twice (a redelivered job) is counted once"""
+        from material_ledger.material_ledger.services.map_reduce import ChunkStore
+        
+        store = ChunkStore(f"test-{frappe.generate_hash(length=8)}")
+        self.assertEqual(store.mark_done(0), 1)
+        self.assertIsNone(store.mark_done(0))
+        self.assertEqual(store.mark_done(1), 2)
+        store.clear(2)
+    
+    def test_lost_chunk_is_re_enqueued_then_fails_job(self):
+        """Test that a chunk whose worker died runs again, and fails the job once retries are used up"""
+        from material_ledger.material_ledger.services import map_reduce
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        spec = {"map": lambda chunk, context=None: chunk, "reduce": lambda partials, context=None: partials, "progress": (0, 100)}
+        started = MagicMock()
+        started.get_status.return_value = "started"
+        enqueued = []
+        
+        with patch.dict(map_reduce.MAP_REDUCE_JOBS, {"test_job": spec}), \
+             patch.object(map_reduce.frappe, "enqueue", side_effect=lambda **kw: enqueued.append(kw)), \
+             patch.object(map_reduce.frappe.db, "get_value", return_value=frappe._dict(user="Administrator", cache_key="test")), \
+             patch.object(map_reduce.frappe, "get_all", return_value=[job_id]), \
+             patch.object(map_reduce.JobProgress, "update"), \
+             patch("material_ledger.material_ledger.services.queue_service.fail_ai_job") as mock_fail:
+            map_reduce.dispatch_chunks(job_id, "test_job", [[1], [2]])
+            map_reduce.process_ai_chunk(job_id, 0)
+            
+            # Chunk 1 is still running within its timeout
+            with patch("frappe.utils.background_jobs.get_job", return_value=started):
+                map_reduce.recover_lost_chunks()
+            self.assertEqual(len(enqueued), 2)
+            
+            # Its worker was killed: the RQ job is gone and chunk 1 never marked itself done
+            with patch("frappe.utils.background_jobs.get_job", return_value=None):
+                for _attempt in range(4):
+                    map_reduce.recover_lost_chunks()
+        
+        retries = enqueued[2:]
+        self.assertEqual([(e["index"], e["attempt"]) for e in retries], [(1, 1), (1, 2), (1, 3)])
+        self.assertEqual(retries[0]["job_id"], f"{job_id}:chunk:1")
+        mock_fail.assert_called_once()
+        self.assertIn("Chunk 2 of 2 was lost", mock_fail.call_args.args[3])
+
+
+class TestJobControl(FrappeTestCase):
+    """Test cases for cooperative cancellation and deadlines of AI jobs"""
+    
+    def tearDown(self):
+        from material_ledger.material_ledger.services import job_control
+        job_control.activate(None)
+    
+    def test_cancelled_job_stops_before_llm_call(self):
+        """Test that a cancelled job raises at the next LLM call, through service fallbacks"""
+        from material_ledger.material_ledger.services import job_control
+        from material_ledger.material_ledger.services.job_control import JobCancelled, JobControl
+        from material_ledger.material_ledger.services.llm_providers import build_provider
+        
+        control = JobControl(f"test-{frappe.generate_hash(length=8)}")
+        job_control.activate(control)
+        provider = build_provider("Stub")
+        
+        provider.complete("before cancel")
+        control.cancel()
+        
+        with patch.object(provider, "_complete") as mock_complete:
+            with self.assertRaises(JobCancelled):
+                provider.complete("after cancel")
+            mock_complete.assert_not_called()
+        
+        # Broad `except Exception` fallbacks must not swallow cancellation
+        self.assertFalse(issubclass(JobCancelled, Exception))
+    
+    def test_deadline_expires(self):
+        """Test that a job past its deadline is stopped"""
+        import time
+        from material_ledger.material_ledger.services.job_control import JobCancelled, JobControl
+        
+        control = JobControl(f"test-{frappe.generate_hash(length=8)}")
+        control.set_deadline(0.01)
+        control.check()
+        
+        time.sleep(0.02)
+        with self.assertRaises(JobCancelled) as ctx:
+            control.check()
+        self.assertIn("Deadline", ctx.exception.reason)
+    
+    def test_deadline_starts_at_dispatch(self):
+        """Test that time spent waiting for a lane slot does not count against the deadline"""
+        import time
+        from material_ledger.material_ledger.services import queue_service
+        from material_ledger.material_ledger.services.job_control import JobControl
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        JobControl(job_id).set_deadline(0.01)  # e.g. left over from an earlier attempt
+        time.sleep(0.02)
+        
+        with patch.object(queue_service.AIQueueService, "_get_deadline_seconds", return_value=60), \
+             patch.object(queue_service.frappe, "get_doc"), \
+             patch.object(queue_service, "JobProgress"), \
+             patch.object(queue_service, "process_financial_prediction", return_value={"ok": 1}), \
+             patch.object(queue_service, "complete_ai_job") as mock_complete, \
+             patch.object(queue_service, "cancel_ai_job_run") as mock_cancel:
+            queue_service.process_ai_job(job_id, "financial_prediction", "_Test Company", {}, "Administrator")
+        
+        mock_cancel.assert_not_called()
+        mock_complete.assert_called_once()
+        JobControl(job_id).check()
+    
+    def test_cancelling_running_job_leaves_cleanup_to_worker(self):
+        """Test that cancelling a running job only flags it; the worker frees its slot"""
+        from material_ledger.material_ledger.services import queue_service
+        from material_ledger.material_ledger.services.job_control import JobControl
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        job = frappe._dict(job_type="anomaly_detection", user="Administrator", status="processing")
+        rq_job = MagicMock()
+        rq_job.get_status.return_value = "started"
+        
+        with patch.object(queue_service.frappe.db, "get_value", return_value=job), \
+             patch("frappe.utils.background_jobs.get_job", return_value=rq_job), \
+             patch.object(queue_service, "cancel_ai_job_run") as mock_cancel:
+            result = queue_service.cancel_ai_job(job_id)
+        
+        self.assertEqual(result, {"status": "cancelling", "cancelled": True})
+        mock_cancel.assert_not_called()
+        self.assertTrue(JobControl(job_id).is_cancelled())
+    
+    def test_cancelling_job_with_dead_worker_finalizes_it(self):
+        """Test that a processing job whose RQ job is no longer started is cancelled at once"""
+        from material_ledger.material_ledger.services import queue_service
+        
+        job_id = f"test-{frappe.generate_hash(length=8)}"
+        job = frappe._dict(job_type="anomaly_detection", user="Administrator", status="processing")
+        rq_job = MagicMock()
+        rq_job.get_status.return_value = "failed"
+        
+        with patch.object(queue_service.frappe.db, "get_value", return_value=job), \
+             patch("frappe.utils.background_jobs.get_job", return_value=rq_job), \
+             patch.object(queue_service, "cancel_ai_job_run") as mock_cancel:
+            result = queue_service.cancel_ai_job(job_id)
+        
+        self.assertEqual(result, {"status": "cancelled", "cancelled": True})
+        mock_cancel.assert_called_once()
+        self.assertEqual(mock_cancel.call_args.args[:3], (job_id, "anomaly_detection", "Administrator"))
+
+
+class TestJobCheckpoints(FrappeTestCase):
+    """Test cases for checkpointed, resumable AI jobs"""
+    
+    def test_resume_skips_checkpointed_chunks(self):
+        """Test that a retried anomaly job reuses stored chunk results"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        class MemoryCheckpoint:
+            def __init__(self, results):
+                self.results = dict(results)
+            
+            def get_result(self, index):
+                return self.results.get(index)
+            
+            def save_result(self, index, result):
+                self.results[index] = result
+        
+        service = AIAnomalyService()
+        chunks = [[{"id": c}] * 10 for c in range(3)]
+        checkpoint = MemoryCheckpoint({0: ["stored-0"]})
+        
+        with patch.object(service, "detect_statistical_anomalies", side_effect=lambda chunk, baseline=None: [f"stat-{chunk[0]['id']}"]) as mock_stat, \
+             patch.object(service, "_rate_limited_ai_detection", side_effect=lambda chunk, budget: [f"ai-{chunk[0]['id']}"]), \
+             patch("material_ledger.material_ledger.services.concurrency.run_in_site_context",
+                   side_effect=lambda site, func, *args: func(*args)):
+            result = service.detect_all_anomalies(chunks, checkpoint=checkpoint)
+        
+        self.assertEqual(result, ["stored-0", "stat-1", "ai-1", "stat-2", "ai-2"])
+        self.assertEqual(mock_stat.call_count, 2)
+        self.assertEqual(checkpoint.results[2], ["stat-2", "ai-2"])
+    
+    def test_only_transient_failures_are_retried(self):
+        """Test that provider and network errors are retried and deterministic errors fail at once"""
+        from material_ledger.material_ledger.services import queue_service
+        from material_ledger.material_ledger.services.llm_providers import LLMProviderError
+        
+        def run(error):
+            with patch.object(queue_service.frappe, "get_doc"), \
+                 patch.object(queue_service, "JobProgress"), \
+                 patch.object(queue_service, "process_anomaly_detection", side_effect=error), \
+                 patch.object(queue_service, "schedule_ai_job_retry", return_value=True) as mock_retry, \
+                 patch.object(queue_service, "fail_ai_job") as mock_fail:
+                queue_service.process_ai_job(
+                    f"test-{frappe.generate_hash(length=8)}", "anomaly_detection", "_Test Company", {}, "Administrator"
+                )
+            return mock_retry.called, mock_fail.called
+        
+        self.assertEqual(run(LLMProviderError("unavailable")), (True, False))
+        self.assertEqual(run(ConnectionError("reset")), (True, False))
+        self.assertEqual(run(frappe.ValidationError("bad filters")), (False, True))
+        self.assertEqual(run(ValueError("Unknown job type: x")), (False, True))
+    
+    def test_retry_backoff_doubles(self):
+        """Test exponential retry backoff"""
+        from material_ledger.material_ledger.services.queue_service import get_retry_delay
+        
+        self.assertEqual([get_retry_delay(attempt) for attempt in range(3)], [30, 60, 120])
+
+
+class TestJobScheduler(FrappeTestCase):
+    """Test cases for AI job priority lanes and fair scheduling"""
+    
+    def setUp(self):
+        from material_ledger.material_ledger.services.job_scheduler import FairScheduler
+        self.scheduler = FairScheduler(key_prefix=f"test_ai_scheduler:{frappe.generate_hash(length=8)}")
+    
+    def _submit(self, job_id, lane, tenant, cost):
+        self.scheduler.submit(job_id, lane, tenant, cost, method="test.method", timeout=60)
+    
+    def _dispatch(self, action=None):
+        """Dispatch (or run action, which dispatches) and return the enqueued (job_id, queue) pairs"""
+        with patch("frappe.enqueue") as mock_enqueue:
+            (action or self.scheduler.dispatch)()
+        return [(call.kwargs["job_id"], call.kwargs["queue"]) for call in mock_enqueue.call_args_list]
+    
+    def test_lane_from_cost(self):
+        """Test that cheap jobs get faster lanes and a requested lane can only slow a job down"""
+        from material_ledger.material_ledger.services.job_scheduler import classify_lane
+        
+        self.assertEqual(classify_lane(100), "interactive")
+        self.assertEqual(classify_lane(10000), "standard")
+        self.assertEqual(classify_lane(10 ** 6), "bulk")
+        self.assertEqual(classify_lane(100, requested="bulk"), "bulk")
+        self.assertEqual(classify_lane(10 ** 6, requested="interactive"), "bulk")
+    
+    def test_interactive_before_bulk(self):
+        """Test that interactive jobs are dispatched ahead of bulk jobs submitted earlier"""
+        with patch.dict(frappe.conf, {"ai_lane_slots": {"interactive": 1, "standard": 1, "bulk": 1}}):
+            self._submit("bulk-1", "bulk", "A|a", 10 ** 6)
+            self._submit("bulk-2", "bulk", "A|a", 10 ** 6)
+            self._submit("fast-1", "interactive", "B|b", 10)
+            
+            self.assertEqual(self._dispatch(), [("fast-1", "short"), ("bulk-1", "long")])
+    
+    def test_fair_share_across_tenants(self):
+        """Test that a tenant with many queued jobs does not hold back another tenant"""
+        with patch.dict(frappe.conf, {"ai_lane_slots": {"standard": 1}}):
+            for i in range(3):
+                self._submit(f"a-{i}", "standard", "A|a", 1000)
+            self._submit("b-0", "standard", "B|b", 1000)
+            
+            order = [job_id for job_id, _ in self._dispatch()]
+            while len(order) < 4:
+                dispatched = self._dispatch(lambda: self.scheduler.release(order[-1]))
+                self.assertEqual(len(dispatched), 1)
+                order.append(dispatched[0][0])
+            
+            self.assertEqual(order[:2], ["a-0", "b-0"])
+    
+    def test_release_frees_slot(self):
+        """Test that a lane never runs more jobs than its slots until one is released"""
+        with patch.dict(frappe.conf, {"ai_lane_slots": {"standard": 1}}):
+            self._submit("s-1", "standard", "A|a", 10)
+            self._submit("s-2", "standard", "A|a", 10)
+            
+            self.assertEqual(len(self._dispatch()), 1)
+            self.assertEqual(self._dispatch(), [])
+            
+            self.scheduler.reconcile(lambda job_id: job_id == "s-1")
+            self.assertEqual(self._dispatch(), [("s-2", "default")])
+    
+    def test_killed_worker_slot_reclaimed(self):
+        """Test that slots of jobs whose worker died are reclaimed and the jobs finalized"""
+        import time
+        from material_ledger.material_ledger.services.job_scheduler import RUN_GRACE
+        
+        def rq_job(status):
+            job = MagicMock()
+            job.get_status.return_value = status
+            return job
+        
+        on_lost = MagicMock(return_value=True)
+        with patch.dict(frappe.conf, {"ai_lane_slots": {"standard": 1}}):
+            for i in range(3):
+                self._submit(f"k-{i}", "standard", "A|a", 10)
+            self.assertEqual(self._dispatch(), [("k-0", "default")])
+            
+            # Still running within its timeout: the slot stays taken
+            with patch("frappe.utils.background_jobs.get_job", return_value=rq_job("started")):
+                self.scheduler.reconcile(lambda job_id: False, on_lost)
+            on_lost.assert_not_called()
+            self.assertEqual(self._dispatch(), [])
+            
+            # The work horse was killed and RQ marked the job failed
+            with patch("frappe.utils.background_jobs.get_job", return_value=rq_job("failed")):
+                self.scheduler.reconcile(lambda job_id: False, on_lost)
+            on_lost.assert_called_once_with("k-0")
+            self.assertEqual(self._dispatch(), [("k-1", "default")])
+            
+            # The whole worker was killed, leaving the job "started" past its timeout
+            later = time.time() + 60 + RUN_GRACE + 1
+            with patch("frappe.utils.background_jobs.get_job", return_value=rq_job("started")), \
+                 patch("time.time", return_value=later):
+                self.scheduler.reconcile(lambda job_id: False, on_lost)
+            on_lost.assert_called_with("k-1")
+            self.assertEqual(self._dispatch(), [("k-2", "default")])
+    
+    def test_lost_job_failed_and_released(self):
+        """Test that a lost job is failed, which releases its slot and claim"""
+        from material_ledger.material_ledger.services import queue_service
+        
+        job = frappe._dict(job_type="anomaly_detection", user="test@example.com")
+        with patch("frappe.db.get_value", return_value=job), \
+             patch.object(queue_service, "fail_ai_job") as mock_fail:
+            self.assertTrue(queue_service._fail_lost_ai_job("JOB-1"))
+        
+        mock_fail.assert_called_once()
+        self.assertEqual(mock_fail.call_args.args[:3], ("JOB-1", "anomaly_detection", "test@example.com"))
+
+
+class TestAnomalyBaselines(FrappeTestCase):
+    """Test cases for persisted running anomaly baselines and incremental scoring"""
+    
+    def _entries(self, amounts, start=0):
+        import datetime
+        base = datetime.datetime(2026, 1, 1, 10, 0, 0)
+        return [{
+            "name": f"GLE-{start + i:05d}",
+            "account": "Cash - _TC",
+            "owner": "test@example.com",
+            "abs_amount": amount,
+            "posting_date": base.date(),
+            "creation": base + datetime.timedelta(minutes=start + i)
+        } for i, amount in enumerate(amounts)]
+    
+    def test_running_stats_merge_matches_statistics(self):
+        """Test that merged Welford statistics equal statistics over all values"""
+        import random
+        import statistics
+        from material_ledger.material_ledger.services.anomaly_state import RunningStats
+        
+        values = [random.uniform(0, 10000) for _ in range(500)]
+        left, right = RunningStats(), RunningStats()
+        for value in values[:137]:
+            left.add(value)
+        for value in values[137:]:
+            right.add(value)
+        merged = left.merge(right)
+        
+        self.assertEqual(merged.count, 500)
+        self.assertAlmostEqual(merged.mean, statistics.mean(values), places=6)
+        self.assertAlmostEqual(merged.stdev, statistics.stdev(values), places=6)
+    
+    @patch("frappe.get_all", return_value=[])
+    def test_entries_scored_against_prior_baseline(self, mock_get_all):
+        """Test that an outlier is flagged against earlier entries and then folded in"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        from material_ledger.material_ledger.services.anomaly_state import AnomalyState
+        
+        state = AnomalyState("_Test Company")
+        service = AIAnomalyService()
+        
+        # A cold baseline flags nothing
+        self.assertEqual(service.score_against_baseline(self._entries([50000]), state), [])
+        
+        history = self._entries([100 + i % 7 for i in range(30)], start=1)
+        service.score_against_baseline(history, state)
+        
+        anomalies = service.score_against_baseline(self._entries([90000], start=100), state)
+        flagged = [a for a in anomalies if a["type"] == "unusual_amount"]
+        self.assertEqual([a["entry_name"] for a in flagged], ["GLE-00100"])
+        self.assertEqual(state.account_stats("Cash - _TC").count, 32)
+        self.assertEqual(state.watermark[1], "GLE-00100")
+    
+    def test_incremental_run_reads_after_watermark(self):
+        """Test that an incremental run asks for entries created since the overlap window behind the watermark"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        watermark = frappe._dict(
+            scope="Company", scope_key="_Test Company", state="{}",
+            last_creation="2026-01-01 10:00:00", last_entry="GLE-00001"
+        )
+        service = AIAnomalyService()
+        
+        with patch("frappe.get_all", return_value=[watermark]), \
+             patch.object(service, "get_transaction_data", return_value=[]) as mock_fetch:
+            anomalies, scored = service.detect_incremental_anomalies("_Test Company")
+        
+        self.assertEqual((anomalies, scored), ([], 0))
+        self.assertEqual(str(mock_fetch.call_args.kwargs["since"]), "2026-01-01 09:50:00")
+    
+    def test_late_committed_entry_scored_once(self):
+        """Test that an entry committed after a run, though created before its watermark, is folded in once"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        from material_ledger.material_ledger.services.anomaly_state import AnomalyState
+        
+        with patch("frappe.get_all", return_value=[]):
+            state = AnomalyState("_Test Company")
+        service = AIAnomalyService()
+        
+        first = self._entries([100 + i % 7 for i in range(10)])
+        late = first.pop(5)  # Its transaction commits after the first run
+        service.score_against_baseline(first, state)
+        self.assertLessEqual(state.read_from(), late["creation"])
+        
+        with patch("frappe.db.delete"), patch("frappe.db.bulk_insert") as mock_insert:
+            state.save()
+        rows = {row[6]: row for row in mock_insert.call_args.kwargs["values"]}
+        stored = frappe._dict(
+            scope="Company", scope_key="_Test Company", state=rows["Company"][9],
+            last_creation=rows["Company"][10], last_entry=rows["Company"][11]
+        )
+        
+        with patch("frappe.get_all", return_value=[stored]), \
+             patch.object(service, "get_transaction_data", return_value=[*first, late]), \
+             patch.object(service, "detect_model_anomalies", return_value=[]), \
+             patch("frappe.db.delete"), patch("frappe.db.bulk_insert") as mock_insert, \
+             patch("material_ledger.material_ledger.services.realtime_anomaly.publish_snapshot"):
+            _anomalies, scored = service.detect_incremental_anomalies("_Test Company")
+        
+        self.assertEqual(scored, 1)
+        counts = {row[6]: row[8] for row in mock_insert.call_args.kwargs["values"]}
+        self.assertEqual(counts["Company"], 10)
+
+
+class TestAnomalyDetectors(FrappeTestCase):
+    """Test cases for the whole-dataset anomaly detectors"""
+    
+    def _line(self, name, voucher_no, account, amount, **extra):
+        import datetime
+        line = {
+            "name": name,
+            "voucher_type": "Journal Entry",
+            "voucher_no": voucher_no,
+            "account": account,
+            "abs_amount": amount,
+            "owner": "test@example.com",
+            "posting_date": datetime.date(2026, 1, 1),
+            "creation": datetime.datetime(2026, 1, 1, 10, 0, 0)
+        }
+        line.update(extra)
+        return line
+    
+    def test_account_pairs_counted_over_whole_dataset(self):
+        """Test that a pair seen in two vouchers is not rare, even when the vouchers sit in different chunks"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        data = [
+            self._line("L1", "JV-1", "Bank", 200000), self._line("L2", "JV-1", "Sales", 200000),
+            self._line("L3", "JV-2", "Bank", 200000), self._line("L4", "JV-2", "Sales", 200000),
+            self._line("L5", "JV-3", "Bank", 200000), self._line("L6", "JV-3", "Suspense", 200000)
+        ]
+        anomalies = [
+            a for a in AIAnomalyService().detect_dataset_anomalies(data)
+            if a["type"] == "unusual_account_combination"
+        ]
+        
+        self.assertEqual(sorted(a["entry_name"] for a in anomalies), ["L5", "L6"])
+        self.assertEqual(anomalies[0]["account_pair"], "Bank|Suspense")
+    
+    def test_account_combinations_on_large_dataset(self):
+        """Test that one rare voucher among many common ones is found through the voucher index"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        data = []
+        for i in range(20000):
+            data.append(self._line(f"A{i}", f"JV-{i}", "Bank", 500000))
+            data.append(self._line(f"B{i}", f"JV-{i}", f"Expense {i % 50}", 500000))
+        data.append(self._line("R1", "JV-R", "Bank", 500000))
+        data.append(self._line("R2", "JV-R", "Suspense", 500000))
+        
+        anomalies = AIAnomalyService()._detect_account_anomalies(data)
+        self.assertEqual(sorted(a["entry_name"] for a in anomalies), ["R1", "R2"])
+    
+    def test_transaction_rows_fetched_in_one_query(self):
+        """Test that transaction data is one streamed query into compact, serializable rows"""
+        import datetime
+        import pickle
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService, TransactionRow
+        from material_ledger.material_ledger.services.queue_service import _json_serial
+        
+        row = ("GLE-1", datetime.date(2026, 1, 3), "Cash", 500, 0, 500, 500, "Journal Entry", "JV-1",
+               None, None, "Main", None, "", datetime.datetime(2026, 1, 3, 21, 5), None, "test@example.com",
+               None, 21, 7, "No", "Cash", "Asset", 0, 1, 1)
+        
+        with patch("frappe.db.sql", return_value=iter([row])) as mock_sql, \
+             patch("frappe.db.unbuffered_cursor", MagicMock()), \
+             patch("frappe.db.get_value") as mock_get_value:
+            data = AIAnomalyService().get_transaction_data("_Test Company", {})
+        
+        self.assertEqual(mock_sql.call_count, 1)
+        mock_get_value.assert_not_called()
+        
+        entry = data[0]
+        self.assertIsInstance(entry, TransactionRow)
+        self.assertEqual((entry["account"], entry["root_type"]), ("Cash", "Asset"))
+        self.assertIs(entry.get("is_weekend"), True)
+        self.assertIs(entry.get("is_after_hours"), True)
+        self.assertEqual(pickle.loads(pickle.dumps(entry)).as_dict(), entry.as_dict())
+        self.assertIn('"voucher_no": "JV-1"', json.dumps({"details": entry}, default=_json_serial))
+    
+    def test_engine_matches_loop_detectors(self):
+        """Test that the columnar engine returns the loop detectors' records, in order"""
+        import random
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyEngine
+        
+        rng = random.Random(3)
+        data = [
+            self._line(f"L{i}", f"JV-{i}", f"Account {rng.randrange(20)}",
+                       rng.choice([20000, 5000, 0.5, round(rng.lognormvariate(7, 1.5), 2)]),
+                       owner=f"user{rng.randrange(4)}@example.com")
+            for i in range(3000)
+        ]
+        service, engine = AIAnomalyService(), AnomalyEngine(data)
+        
+        pairs = [
+            (service._detect_amount_anomalies(data), engine.amount_anomalies()),
+            (service._detect_pattern_anomalies(data), engine.pattern_anomalies()),
+            (service._detect_user_behavior_anomalies(data), engine.user_anomalies()),
+            (service._detect_benford_anomalies(data), engine.benford_anomalies())
+        ]
+        for expected, actual in pairs:
+            self.assertTrue(expected)
+            self.assertEqual(len(actual), len(expected))
+            for loop_record, engine_record in zip(expected, actual, strict=True):
+                self.assertEqual(loop_record.keys(), engine_record.keys())
+                for key, value in loop_record.items():
+                    if isinstance(value, float):
+                        self.assertAlmostEqual(engine_record[key], value, delta=abs(value) * 1e-9)
+                    else:
+                        self.assertEqual(engine_record[key], value)
+    
+    def test_benchmark_findings_identical(self):
+        """Test that the engine finds what the loop detectors find (timing is left to bench execute)"""
+        from material_ledger.material_ledger.services.anomaly_engine import benchmark
+        
+        result = benchmark(rows=3000)
+        
+        self.assertTrue(result["identical"])
+    
+    def test_baseline_scores_independent_of_chunking(self):
+        """Test that chunks scored against the dataset baseline flag the same rows for any chunk size"""
+        import random
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        rng = random.Random(5)
+        data = [
+            self._line(f"L{i}", f"JV-{i}", f"Account {rng.randrange(5)}",
+                       round(rng.lognormvariate(7, 1), 2) * (40 if rng.random() < 0.01 else 1),
+                       owner=f"user{rng.randrange(3)}@example.com")
+            for i in range(3000)
+        ]
+        service = AIAnomalyService()
+        baseline = service.build_baseline(data)
+        
+        def flagged(chunk_size, baseline):
+            names = set()
+            for start in range(0, len(data), chunk_size):
+                for anomaly in service.detect_statistical_anomalies(data[start:start + chunk_size], baseline):
+                    if anomaly["type"] in ("unusual_amount", "unusual_user_amount"):
+                        names.add((anomaly["type"], anomaly["entry_name"]))
+            return names
+        
+        self.assertTrue(flagged(1000, baseline))
+        self.assertEqual(flagged(1000, baseline), flagged(700, baseline))
+        self.assertEqual(flagged(1000, baseline), flagged(len(data), None))
+    
+    def test_duplicates_reported_as_clusters(self):
+        """Test that identical lines form one cluster record and close postings form a near-duplicate cluster"""
+        import datetime
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        payroll = [self._line(f"P{i}", f"JV-P{i}", "Salaries", 8000, party=f"EMP-{i % 2}") for i in range(20000)]
+        near = [
+            self._line("N1", "JV-N1", "Supplies", 5000, creation=datetime.datetime(2026, 1, 2, 9, 0)),
+            self._line("N2", "JV-N2", "Supplies", 5020, creation=datetime.datetime(2026, 1, 2, 9, 20)),
+            self._line("N3", "JV-N3", "Supplies", 4990, creation=datetime.datetime(2026, 1, 2, 9, 50)),
+            self._line("F1", "JV-F1", "Supplies", 5010, creation=datetime.datetime(2026, 1, 2, 15, 0))
+        ]
+        
+        anomalies = AIAnomalyService()._detect_duplicate_anomalies(payroll + near)
+        
+        exact = [a for a in anomalies if a["type"] == "potential_duplicate"]
+        self.assertEqual([a["member_count"] for a in exact], [10000, 10000])
+        self.assertEqual(exact[0]["members"][:2], ["P0", "P2"])
+        
+        near_clusters = [a for a in anomalies if a["type"] == "near_duplicate"]
+        self.assertEqual(len(near_clusters), 1)
+        self.assertEqual(near_clusters[0]["members"], ["N1", "N2", "N3"])
+        self.assertEqual(near_clusters[0]["member_count"], 3)
+    
+    def test_rapid_sequences_use_time_of_day(self):
+        """Test that bursts are found from creation times across the whole dataset, per user and account"""
+        import datetime
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        def at(minute, second):
+            return datetime.datetime(2026, 1, 5, 10, minute, second)
+        
+        data = [
+            self._line("R1", "JV-1", "Cash", 1000, creation=at(0, 0)),
+            self._line("R2", "JV-2", "Cash", 1020, creation=at(0, 20)),
+            self._line("R3", "JV-3", "Cash", 1010, creation=at(0, 45)),
+            self._line("S1", "JV-4", "Cash", 1000, creation=at(0, 30), owner="other@example.com"),
+            self._line("S2", "JV-5", "Cash", 9000, creation=at(0, 35)),
+            self._line("T1", "JV-6", "Cash", 1000, creation=at(30, 0)),
+            self._line("T2", "JV-7", "Cash", 1000, creation=at(45, 0))
+        ]
+        data += [self._line(f"X{i}", f"JV-X{i}", "Bank", 50, creation=at(50, i)) for i in range(5)]
+        
+        settings = {"anomaly_rapid_sequence_count": 3, "anomaly_rapid_sequence_window": 60}
+        with patch("material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings.MaterialLedgerSettings.get_settings",
+                   return_value=settings):
+            bursts = AIAnomalyService()._detect_rapid_sequences(data)
+        
+        self.assertEqual([b["members"] for b in bursts], [["R1", "R2", "R3"], ["X0", "X1", "X2", "X3", "X4"]])
+        self.assertEqual(bursts[0]["time_gap"], 45)
+    
+    def test_baselines_merge(self):
+        """Test that baselines of two halves merge into the baseline of all rows"""
+        from material_ledger.material_ledger.services.anomaly_engine import AnomalyBaseline
+        
+        data = [self._line(f"L{i}", f"JV-{i}", f"Account {i % 3}", 100 + i * 7 % 13) for i in range(60)]
+        merged = AnomalyBaseline.from_data(data[:25]).merge(AnomalyBaseline.from_data(data[25:]))
+        whole = AnomalyBaseline.from_data(data)
+        
+        for account, stats in whole.accounts.items():
+            self.assertEqual(merged.accounts[account].count, stats.count)
+            self.assertAlmostEqual(merged.accounts[account].mean, stats.mean)
+            self.assertAlmostEqual(merged.accounts[account].stdev, stats.stdev)
+
+
+class TestAnomalyModel(FrappeTestCase):
+    """Test cases for the per-company local anomaly model"""
+    
+    def _history(self, rows=2000):
+        import random
+        
+        rng = random.Random(11)
+        return [{
+            "name": f"GLE-{i}",
+            "account": f"Expense {rng.randrange(5)}",
+            "owner": f"user{rng.randrange(3)}@example.com",
+            "abs_amount": round(rng.lognormvariate(7, 0.3), 2),
+            "posting_date": "2026-01-01",
+            "voucher_type": "Journal Entry",
+            "creation_hour": min(max(round(rng.gauss(12, 1.5)), 8), 17),
+            "day_of_week": rng.randrange(2, 7),
+            "is_weekend": False,
+            "is_after_hours": False,
+            "is_opening": "No"
+        } for i in range(rows)]
+    
+    def _outlier(self, name):
+        return {
+            "name": name, "account": "Suspense", "owner": "new@example.com", "abs_amount": 950000,
+            "posting_date": "2026-01-03", "voucher_type": "Journal Entry", "creation_hour": 3,
+            "day_of_week": 1, "is_weekend": True, "is_after_hours": True, "is_opening": "No"
+        }
+    
+    def test_model_ranks_injected_outliers_first(self):
+        """Test that entries unlike the training history score highest"""
+        from material_ledger.material_ledger.services.anomaly_model import AnomalyModel
+        
+        model = AnomalyModel.fit(self._history())
+        batch = [*self._history(300), self._outlier("OUT-1")]
+        
+        outliers = model.top_outliers(batch, k=5)
+        
+        self.assertEqual(batch[outliers[0][0]]["name"], "OUT-1")
+        self.assertGreater(outliers[0][1], model.threshold)
+    
+    def test_only_top_outliers_sent_to_ai(self):
+        """Test that one AI call explains the model's top outliers"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        from material_ledger.material_ledger.services.anomaly_model import AnomalyModel
+        
+        model = AnomalyModel.fit(self._history())
+        batch = [*self._history(500), self._outlier("OUT-1"), self._outlier("OUT-2")]
+        
+        ai_service = MagicMock()
+        ai_service.is_available.return_value = True
+        ai_service.complete.return_value = (
+            '```json\n{"explanations": [{"entry_name": "OUT-1", "severity": "عالي", '
+            '"explanation": "مبلغ كبير على حساب معلق ليلاً", "recommendation": "مراجعة القيد"}]}\n```'
+        )
+        
+        with patch("material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings.MaterialLedgerSettings.get_settings",
+                   return_value={"ai_anomaly_model": 1}), \
+             patch("material_ledger.material_ledger.services.anomaly_model.load_active_model", return_value=model), \
+             patch("material_ledger.material_ledger.services.ai_service.get_ai_service", return_value=ai_service), \
+             patch("material_ledger.material_ledger.services.prompt_budget.get_prompt_budget") as mock_budget:
+            mock_budget.return_value.compose.side_effect = lambda header, sections, footer: header + "".join(sections) + footer
+            anomalies = AIAnomalyService().detect_model_anomalies("_Test Company", batch)
+        
+        self.assertEqual(ai_service.complete.call_count, 1)
+        self.assertLessEqual(len(anomalies), 20)
+        by_name = {a["entry_name"]: a for a in anomalies}
+        self.assertEqual(by_name["OUT-1"]["severity"], "high")
+        self.assertEqual(by_name["OUT-1"]["recommendation"], "مراجعة القيد")
+        self.assertIn("OUT-2", by_name)
+    
+    def test_chunks_skip_ai_when_model_scores(self):
+        """Test that chunks are not sent to the AI provider when a model scores the dataset"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        service = AIAnomalyService()
+        with patch.object(service, "_ai_anomaly_detection") as mock_ai:
+            service.detect_chunk_anomalies(self._history(50), use_ai=False)
+        
+        mock_ai.assert_not_called()
+
+
+class TestRealtimeAnomalyAlerts(FrappeTestCase):
+    """Test cases for GL Entry submit scoring against cached baselines"""
+    
+    def _snapshot(self):
+        from material_ledger.material_ledger.services.anomaly_state import AnomalyState
+        from material_ledger.material_ledger.services.realtime_anomaly import build_snapshot
+        
+        with patch("frappe.get_all", return_value=[]):
+            state = AnomalyState("_Test Company")
+        for i in range(30):
+            state.update({
+                "name": f"GLE-{i:05d}", "account": "Cash - _TC", "owner": "test@example.com",
+                "abs_amount": 100 + i % 7, "creation": f"2026-01-01 10:{i:02d}:00"
+            })
+        with patch("material_ledger.material_ledger.services.realtime_anomaly.get_users_with_role",
+                   return_value=["accounts@example.com"]):
+            return build_snapshot(state)
+    
+    def _gl_entry(self, name, debit):
+        return frappe._dict(
+            name=name, company="_Test Company", account="Cash - _TC", debit=debit, credit=0,
+            posting_date="2026-01-02", voucher_type="Journal Entry", voucher_no="ACC-JV-0001",
+            is_cancelled=0
+        )
+    
+    def test_outlier_alerted_after_commit(self):
+        """Test that an outlier is pushed to the dashboard and queued only once the posting commits"""
+        import time
+        from material_ledger.material_ledger.services import realtime_anomaly
+        
+        with patch.dict(realtime_anomaly._snapshots, {"_Test Company": (time.monotonic(), self._snapshot())}), \
+             patch("material_ledger.material_ledger.doctype.material_ledger_settings.material_ledger_settings.MaterialLedgerSettings.get_settings",
+                   return_value={"ai_realtime_anomaly_alerts": 1}), \
+             patch("frappe.db.after_commit") as mock_after_commit, \
+             patch("frappe.publish_realtime") as mock_publish, \
+             patch("frappe.cache") as mock_cache:
+            realtime_anomaly.on_gl_entry_submit(self._gl_entry("GLE-NORMAL", 103))
+            self.assertFalse(mock_after_commit.add.called)
+            
+            realtime_anomaly.on_gl_entry_submit(self._gl_entry("GLE-OUTLIER", 90000))
+            self.assertFalse(mock_publish.called)
+            
+            mock_after_commit.add.call_args.args[0]()
+        
+        alert = mock_publish.call_args.kwargs["message"]
+        self.assertEqual(mock_publish.call_args.kwargs["event"], "ai_anomaly_alert")
+        self.assertEqual(mock_publish.call_args.kwargs["user"], "accounts@example.com")
+        self.assertEqual((alert["entry_name"], alert["severity"]), ("GLE-OUTLIER", "high"))
+        self.assertEqual(mock_cache.return_value.rpush.call_args.args[0], realtime_anomaly.ALERT_QUEUE)
+    
+    def test_hook_reads_only_the_settings_per_entry(self):
+        """Test that scoring a normal posting costs one cached settings read and no queries"""
+        import time
+        from material_ledger.material_ledger.services import realtime_anomaly
+        
+        entries = [self._gl_entry(f"GLE-{i}", 100 + i % 7) for i in range(200)]
+        with patch.dict(realtime_anomaly._snapshots, {"_Test Company": (time.monotonic(), self._snapshot())}), \
+             patch("frappe.cache") as mock_cache, \
+             patch("frappe.db") as mock_db:
+            mock_cache.return_value.get_value.return_value = {"ai_realtime_anomaly_alerts": 1}
+            for entry in entries:
+                realtime_anomaly.on_gl_entry_submit(entry)
+        
+        self.assertEqual(mock_cache.return_value.get_value.call_count, len(entries))
+        self.assertEqual([name for name, args, kwargs in mock_cache.return_value.method_calls], ["get_value"] * len(entries))
+        self.assertEqual(mock_db.method_calls, [])
+    
+    def test_flush_persists_alerts_in_one_insert(self):
+        """Test that queued alerts are written in one batch and trimmed from the queue"""
+        from material_ledger.material_ledger.services import realtime_anomaly
+        
+        alerts = [json.dumps({
+            "type": "unusual_amount", "severity": "high", "company": "_Test Company",
+            "entry_name": name, "account": "Cash - _TC", "amount": 90000, "z_score": 12.5,
+            "posting_date": "2026-01-02", "description": "مبلغ غير عادي"
+        }) for name in ("GLE-1", "GLE-2")]
+        
+        with patch("frappe.cache") as mock_cache, \
+             patch("frappe.db.delete"), \
+             patch("frappe.db.commit"), \
+             patch("frappe.db.bulk_insert") as mock_insert:
+            mock_cache.return_value.lrange.side_effect = [alerts, []]
+            realtime_anomaly.flush_anomaly_alerts()
+        
+        self.assertEqual(mock_insert.call_count, 1)
+        self.assertEqual(len(mock_insert.call_args.kwargs["values"]), 2)
+        mock_cache.return_value.ltrim.assert_called_once_with(realtime_anomaly.ALERT_QUEUE, 2, -1)
+
+
+class TestAnomalyFindings(FrappeTestCase):
+    """Test cases for anomaly findings stored per detection job"""
+    
+    def _anomalies(self, count):
+        return [{
+            "type": "unusual_amount" if i % 2 else "potential_duplicate",
+            "severity": "high" if i % 3 == 0 else "medium",
+            "entry_name": f"GLE-{i:05d}",
+            "account": "Cash - _TC",
+            "amount": 1000 * (i + 1),
+            "posting_date": "2026-01-02",
+            "z_score": 4.2,
+            "members": [f"GLE-{i:05d}", f"GLE-{i + 1:05d}"],
+            "description": "مبلغ غير عادي",
+            "details": {"name": f"GLE-{i:05d}", "remarks": "x" * 500}
+        } for i in range(count)]
+    
+    def test_report_references_source_rows(self):
+        """Test that the job result holds no source rows and every anomaly becomes a finding"""
+        from material_ledger.material_ledger.services.ai_anomaly_service import AIAnomalyService
+        
+        with patch("material_ledger.material_ledger.services.anomaly_findings.save_findings") as mock_save:
+            report = AIAnomalyService().generate_anomaly_report(self._anomalies(40), "JOB-1", "_Test Company")
+        
+        self.assertNotIn("full_anomalies", report)
+        self.assertEqual(report["findings_job"], "JOB-1")
+        self.assertEqual(len(report["prioritized_anomalies"]), 20)
+        self.assertTrue(all("details" not in anomaly for anomaly in report["prioritized_anomalies"]))
+        
+        job_id, company, saved = mock_save.call_args.args
+        self.assertEqual((job_id, company, len(saved)), ("JOB-1", "_Test Company", 40))
+    
+    def test_findings_saved_in_batches(self):
+        """Test that findings replace the job's rows in bulk inserts and reference their GL Entry"""
+        from material_ledger.material_ledger.services import anomaly_findings
+        
+        with patch.object(anomaly_findings, "INSERT_BATCH", 2), \
+             patch("frappe.db.delete") as mock_delete, \
+             patch("frappe.db.bulk_insert") as mock_insert:
+            anomaly_findings.save_findings("JOB-1", "_Test Company", self._anomalies(5))
+        
+        mock_delete.assert_called_once_with("AI Anomaly Finding", {"job": "JOB-1"})
+        self.assertEqual(mock_insert.call_count, 3)
+        
+        fields = mock_insert.call_args_list[0].kwargs["fields"]
+        row = dict(zip(fields, mock_insert.call_args_list[0].kwargs["values"][0], strict=True))
+        self.assertEqual((row["job"], row["gl_entry"], row["score"]), ("JOB-1", "GLE-00000", 4.2))
+        self.assertEqual(json.loads(row["info"]), {"members": ["GLE-00000", "GLE-00001"]})
+    
+    def test_findings_paginated_with_server_side_counts(self):
+        """Test that one page is fetched and the counts cover every matching finding"""
+        from material_ledger.material_ledger.services.anomaly_findings import get_anomaly_findings
+        
+        page_rows = [frappe._dict(name="JOB-1-000100", severity="high", info='{"members": []}')]
+        counts = [frappe._dict(severity="high", count=120)]
+        
+        with patch("frappe.get_list", side_effect=[page_rows, counts]) as mock_get_list:
+            result = get_anomaly_findings("JOB-1", filters='{"severity": "high", "from_date": "2026-01-01"}',
+                                          page=3, page_length=50)
+        
+        page_call = mock_get_list.call_args_list[0].kwargs
+        self.assertEqual(page_call["filters"], {"job": "JOB-1", "severity": "high", "posting_date": [">=", "2026-01-01"]})
+        self.assertEqual((page_call["limit_start"], page_call["limit_page_length"]), (100, 50))
+        self.assertEqual(result["total"], 120)
+        self.assertEqual(result["findings"][0].info, {"members": []})
+    
+    def test_deleting_job_deletes_its_findings(self):
+        """Test that trashing a finished job removes its findings so the link does not block it"""
+        from material_ledger.material_ledger.doctype.ai_job_queue.ai_job_queue import AIJobQueue
+        
+        job = MagicMock(name="JOB-1", job_id="JOB-1", status="completed")
+        job.name = "JOB-1"
+        with patch("frappe.db.delete") as mock_delete:
+            AIJobQueue.on_trash(job)
+        
+        mock_delete.assert_called_once_with("AI Anomaly Finding", {"job": "JOB-1"})
+
+
+class TestPredictionHistory(FrappeTestCase):
+    """Test cases for the monthly series prediction jobs are built from and their forecasts"""
+    
+    def test_monthly_series_from_one_grouped_query(self):
+        """Test that monthly totals come from one grouped query with no per-entry account lookups"""
+        from decimal import Decimal
+        from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
+        
+        totals = [
+            frappe._dict(year=2025, month=12, revenue=Decimal("5000.50"), expenses=Decimal("3200"), assets=0,
+                         liabilities=0, equity=0, cash_flow=Decimal("1800.5")),
+            frappe._dict(year=2026, month=1, revenue=Decimal("6100"), expenses=None, assets=0,
+                         liabilities=0, equity=0, cash_flow=0)
+        ]
+        
+        with patch("frappe.db.sql", return_value=totals) as mock_sql, \
+             patch("frappe.db.get_value") as mock_get_value:
+            data = AIPredictionService().get_historical_data("_Test Company", {"from_date": "2025-01-01"})
+        
+        self.assertEqual(mock_sql.call_count, 1)
+        self.assertIn("GROUP BY", mock_sql.call_args.args[0])
+        self.assertFalse(mock_get_value.called)
+        self.assertEqual([row["date"] for row in data], ["2025-12", "2026-01"])
+        self.assertEqual((data[0]["revenue"], data[1]["expenses"]), (5000.5, 0.0))
+    
+    def _months(self, count, start_year=2023):
+        import math
+        return [{
+            "date": f"{start_year + i // 12}-{i % 12 + 1:02d}",
+            "revenue": 10000 + 150 * i + 2000 * math.sin(2 * math.pi * (i % 12) / 12),
+            "expenses": 7000 + 80 * i,
+            "cash_flow": 3000 + 70 * i
+        } for i in range(count)]
+    
+    def test_engine_recovers_trend_and_seasonality(self):
+        """Test that noiseless trend plus seasonality series are projected exactly, all in one fit"""
+        import numpy as np
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine, monthly_matrix
+        
+        history = self._months(48)
+        future = self._months(60)[48:]
+        series, first_month = monthly_matrix(history, ["revenue", "expenses", "cash_flow"])
+        
+        forecast = ForecastEngine(series, first_month).forecast(12)
+        
+        expected = np.array([[row[metric] for row in future] for metric in ["revenue", "expenses", "cash_flow"]])
+        self.assertEqual(forecast["dates"], [row["date"] for row in future])
+        self.assertTrue(np.allclose(forecast["point"], expected, atol=1e-6))
+        self.assertTrue(np.allclose(forecast["upper"] - forecast["lower"], 0, atol=1e-6))
+    
+    def test_engine_matches_per_series_fits(self):
+        """Test that the batched fit equals fitting each series alone, with intervals widening over the horizon"""
+        import numpy as np
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine, linear_trends
+        
+        rng = np.random.default_rng(3)
+        series = rng.normal(1000, 200, size=(300, 20)) + np.arange(20) * rng.normal(10, 5, size=(300, 1))
+        
+        engine = ForecastEngine(series)
+        forecast = engine.forecast(6)
+        
+        for row in (0, 150, 299):
+            slope, intercept = np.polyfit(np.arange(20), series[row], 1)
+            self.assertAlmostEqual(engine.trends[row], slope, places=6)
+            self.assertAlmostEqual(forecast["point"][row][0], intercept + slope * 20, places=6)
+        self.assertTrue(np.allclose(engine.trends, linear_trends(series)))
+        
+        widths = forecast["upper"] - forecast["lower"]
+        self.assertTrue((forecast["lower"] < forecast["point"]).all())
+        self.assertTrue((np.diff(widths, axis=1) > 0).all())
+    
+    def test_prediction_carries_intervals(self):
+        """Test that predictions without an AI provider come from the engine and carry intervals"""
+        from material_ledger.material_ledger.services.ai_prediction_service import AIPredictionService
+        
+        ai_service = MagicMock()
+        ai_service.is_available.return_value = False
+        
+        with patch("material_ledger.material_ledger.services.ai_service.get_ai_service", return_value=ai_service):
+            result = AIPredictionService().predict_chunk(self._months(36))
+        
+        predictions = result["predictions"]
+        self.assertEqual([p["date"] for p in predictions], [row["date"] for row in self._months(48)[36:]])
+        for prediction in predictions:
+            lower, upper = prediction["intervals"]["revenue"]
+            self.assertLessEqual(lower, upper)
+        self.assertEqual(result["trend_analysis"]["revenue_trend"], "increasing")
+
+
+class TestDimensionForecast(FrappeTestCase):
+    """Test cases for batch forecasts of every cost center or project"""
+    
+    def _history(self, values=300, months=36):
+        import random
+        rng = random.Random(5)
+        rows = []
+        for v in range(values):
+            base, growth = rng.uniform(1000, 50000), rng.uniform(-50, 200)
+            for i in range(months):
+                rows.append(frappe._dict(
+                    value=f"CC-{v:03d} - _TC", year=2023 + i // 12, month=i % 12 + 1,
+                    revenue=base + growth * i + rng.gauss(0, 100), expenses=base * 0.7, cash_flow=base * 0.2
+                ))
+        return rows
+    
+    def test_every_value_forecast_from_one_query(self):
+        """Test that 300 cost centers are read with one query and forecast like separate fits"""
+        import numpy as np
+        from material_ledger.material_ledger.services.dimension_forecast import forecast_dimension
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine
+        
+        history = self._history()
+        with patch("frappe.db.sql", return_value=history) as mock_sql:
+            forecast = forecast_dimension("_Test Company", "Cost Center", "2023-01-01", "2025-12-31")
+        
+        self.assertEqual(mock_sql.call_count, 1)
+        self.assertEqual(forecast["point"].shape, (300, 3, 12))
+        self.assertEqual(forecast["dates"][0], "2026-01")
+        
+        index = forecast["values"].index("CC-123 - _TC")
+        own = [row.revenue for row in history if row.value == "CC-123 - _TC"]
+        alone = ForecastEngine(np.array([own]), 2023 * 12).forecast(12)
+        self.assertTrue(np.allclose(forecast["point"][index, 0], alone["point"][0]))
+        self.assertTrue(np.allclose(forecast["upper"][index, 0], alone["upper"][0]))
+    
+    def test_late_starting_value_fit_from_first_posting(self):
+        """Test that a cost center opened late is fitted on its own months, not leading zeros"""
+        import numpy as np
+        from material_ledger.material_ledger.services.dimension_forecast import forecast_dimension
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine
+        
+        history = self._history(values=5)
+        late = self._history(values=1, months=36)[18:]
+        for row in late:
+            row.value = "CC-NEW - _TC"
+        
+        with patch("frappe.db.sql", return_value=history + late):
+            forecast = forecast_dimension("_Test Company", "Cost Center", "2023-01-01", "2025-12-31")
+        
+        self.assertEqual(forecast["dates"][0], "2026-01")
+        index = forecast["values"].index("CC-NEW - _TC")
+        alone = ForecastEngine(np.array([[row.revenue for row in late]]), 2023 * 12 + 18).forecast(12)
+        self.assertTrue(np.allclose(forecast["point"][index, 0], alone["point"][0]))
+        self.assertTrue(np.allclose(forecast["lower"][index, 0], alone["lower"][0]))
+        
+        index = forecast["values"].index("CC-001 - _TC")
+        own = [row.revenue for row in history if row.value == "CC-001 - _TC"]
+        alone = ForecastEngine(np.array([own]), 2023 * 12).forecast(12)
+        self.assertTrue(np.allclose(forecast["point"][index, 0], alone["point"][0]))
+    
+    def test_forecasts_replace_stored_rows_in_batches(self):
+        """Test that a run replaces the dimension's stored forecasts with bulk inserts"""
+        from material_ledger.material_ledger.services import dimension_forecast
+        
+        with patch("frappe.db.sql", return_value=self._history(values=10, months=12)):
+            forecast = dimension_forecast.forecast_dimension("_Test Company", "Project", "2023-01-01", "2023-12-31")
+        
+        with patch.object(dimension_forecast, "INSERT_BATCH", 100), \
+             patch("frappe.db.delete") as mock_delete, \
+             patch("frappe.db.bulk_insert") as mock_insert:
+            rows = dimension_forecast.save_dimension_forecasts("JOB-1", "_Test Company", "Project", forecast)
+        
+        self.assertEqual(rows, 10 * 3 * 12)
+        mock_delete.assert_called_once_with("AI Dimension Forecast", {"company": "_Test Company", "dimension": "Project"})
+        self.assertEqual(mock_insert.call_count, 4)
+        
+        fields = mock_insert.call_args_list[0].kwargs["fields"]
+        row = dict(zip(fields, mock_insert.call_args_list[0].kwargs["values"][0], strict=True))
+        self.assertEqual((row["metric"], row["forecast_month"]), ("revenue", "2024-01-01"))
+        self.assertLessEqual(row["lower_bound"], row["upper_bound"])
+
+
+class TestFittedModelCache(FrappeTestCase):
+    """Test cases for reusing fitted forecast parameters of unchanged series"""
+    
+    def _cache(self):
+        from material_ledger.material_ledger.services.model_cache import FittedModelCache
+        return FittedModelCache(f"test-{frappe.generate_hash()}", 1)
+    
+    def _series(self, count=200, months=36):
+        import numpy as np
+        rng = np.random.default_rng(11)
+        steps = np.arange(months)
+        return rng.uniform(1000, 50000, (count, 1)) + rng.uniform(-50, 200, (count, 1)) * steps \
+            + rng.normal(0, 100, (count, months))
+    
+    def test_only_changed_series_are_refit(self):
+        """Test that a second run refits only the series whose history changed"""
+        import numpy as np
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine
+        
+        cache = self._cache()
+        series = self._series()
+        first = ForecastEngine(series, 2023 * 12, cache)
+        self.assertEqual(first.refitted, 200)
+        
+        series[7, -1] += 500  # Latest month revised
+        second = ForecastEngine(series, 2023 * 12, cache)
+        self.assertEqual(second.refitted, 1)
+        
+        uncached = ForecastEngine(series, 2023 * 12).forecast(12)
+        cached = second.forecast(12)
+        self.assertTrue(np.allclose(cached["point"], uncached["point"]))
+        self.assertTrue(np.allclose(cached["upper"], uncached["upper"]))
+        self.assertFalse(np.allclose(cached["point"][7], first.forecast(12)["point"][7]))
+    
+    def test_fit_context_and_version_are_part_of_the_key(self):
+        """Test that another starting month or method version does not reuse a fit"""
+        from material_ledger.material_ledger.services.forecast_engine import ForecastEngine
+        from material_ledger.material_ledger.services.model_cache import FittedModelCache
+        
+        cache = self._cache()
+        series = self._series(count=5)
+        ForecastEngine(series, 2023 * 12, cache)
+        
+        self.assertEqual(ForecastEngine(series, 2023 * 12 + 1, cache).refitted, 5)
+        self.assertEqual(ForecastEngine(series, 2024 * 12, cache).refitted, 0)  # Same calendar phase
+        
+        bumped = FittedModelCache(cache.method, cache.version + 1)
+        self.assertEqual(ForecastEngine(series, 2023 * 12, bumped).refitted, 5)
+
+
 class TestMaterialLedgerSettings(FrappeTestCase):
     """Test cases for Material Ledger Settings"""
     
@@ -346,6 +1785,23 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestFinancialCalculator))
     suite.addTests(loader.loadTestsFromTestCase(TestValidators))
     suite.addTests(loader.loadTestsFromTestCase(TestAIService))
+    suite.addTests(loader.loadTestsFromTestCase(TestLLMProviders))
+    suite.addTests(loader.loadTestsFromTestCase(TestInFlightRegistry))
+    suite.addTests(loader.loadTestsFromTestCase(TestPromptBudget))
+    suite.addTests(loader.loadTestsFromTestCase(TestAIConcurrency))
+    suite.addTests(loader.loadTestsFromTestCase(TestJobProgress))
+    suite.addTests(loader.loadTestsFromTestCase(TestMapReduce))
+    suite.addTests(loader.loadTestsFromTestCase(TestJobControl))
+    suite.addTests(loader.loadTestsFromTestCase(TestJobCheckpoints))
+    suite.addTests(loader.loadTestsFromTestCase(TestJobScheduler))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnomalyBaselines))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnomalyDetectors))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnomalyModel))
+    suite.addTests(loader.loadTestsFromTestCase(TestRealtimeAnomalyAlerts))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnomalyFindings))
+    suite.addTests(loader.loadTestsFromTestCase(TestPredictionHistory))
+    suite.addTests(loader.loadTestsFromTestCase(TestDimensionForecast))
+    suite.addTests(loader.loadTestsFromTestCase(TestFittedModelCache))
     suite.addTests(loader.loadTestsFromTestCase(TestMaterialLedgerSettings))
     
     runner = unittest.TextTestRunner(verbosity=2)